@@ -1,85 +1,137 @@
+import os
 import sys
+import json
 import time
+import queue
+import threading
 from pathlib import Path
-from typing import List, Dict
-from multiprocessing import Process
+from typing import List, Dict, Tuple, Callable, Optional, Any
 
 from flask_cors import CORS
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 
 backend_dir = Path(__file__).resolve().parent.parent
 root = backend_dir.resolve().parent
 sys.path.insert(0, str(backend_dir))
 from utils import utils
 from . import python2react
+from .jobs import JobQueue
+from .result_cache import get_result_cache
+from .resources import resources, DEFAULT_MODEL_NAME
 from mapping.dfs import dfs_wrapper
-from mapping.quasimodo import Quasimodo
+from mapping.beam_search import beam_search_wrapper
 from frequency.frequency import Frequencies
 from mapping.data_collector import DataCollector
-from mapping.beam_search import beam_search_wrapper
 from utils.sentence_embadding import SentenceEmbedding
-from mapping.mapping import FREQUENCY_THRESHOLD, NUM_OF_CLUSTERS_TO_CALC, EDGE_THRESHOLD
-from mapping.mapping import get_pair_mapping, get_edge_score, get_edges_with_maximum_weight, mapping_wrapper
+from mapping.mapping import NUM_OF_CLUSTERS_TO_CALC, EDGE_THRESHOLD, FREQUENCY_THRESHOLD, Solution
+from mapping.mapping import get_pair_mapping, get_pair_mapping_props, get_similarity_edges, get_edges_with_maximum_weight, mapping_wrapper
 
 app = Flask(__name__)
 CORS(app)
+# the long runs of /api/mapping (see run_mapping)
+jobs = JobQueue(run=lambda params, progress: get_mapping(params, progress)[0])
+# the responses of /api/mapping, the same queries are asked again and again (demos, refreshes, shared links).
+results = get_result_cache()
+if 'SKIP_WARM_UP' not in os.environ:
+    resources.warm_up_in_background()
+
+
+def get_mapping_params() -> dict:
+    # the params of /api/mapping. They are saved with the job when it is running in the background, so only json values.
+    return {
+        "base": [b.strip() for b in request.args.get('base').split(',')],
+        "target": [t.strip() for t in request.args.get('target').split(',')],
+        "suggestions": utils.get_int(request.args.get('suggestions'), 3),
+        "depth": utils.get_int(request.args.get('depth'), 20),
+        "algo": request.args.get('algo'), # TODO: make it choice in the GUI (not string input)
+        "threshold": request.args.get('threshold'),
+    }
+
 
 @app.route("/api/mapping", methods=["GET", "POST"])
 def mapping_entities():
+    params = get_mapping_params()
+
+    # trigger by mail (or asked explicitly), the long runs are going to the jobs queue instead of holding the request.
+    # the status, progress and the result are in /api/jobs/<job_id>
+    if request.args.get('email', False) or request.args.get('async', '').lower() in ('1', 'true'):
+        job_id = jobs.submit(params)
+        if job_id is None:
+            return jsonify({"error": "too many jobs are running, try again later"}), 503
+        # send mail here
+        return jsonify({
+            "jon_submitted": True,
+            "job_id": job_id,
+            "status_url": f"/api/jobs/{job_id}",
+        }), 202
+    
+    result, hit = get_mapping(params)
+    response = jsonify(result)
+    response.headers["X-Cache"] = "HIT" if hit else "MISS"
+    return response
+
+
+def get_mapping_key(params: dict) -> str:
+    # the order of the entities and the way the optional params are given are not changing the mapping.
+    return results.get_key(
+        base=sorted(params["base"]),
+        target=sorted(params["target"]),
+        algo='beam' if params["algo"] == 'beam' else 'dfs',
+        depth=params["depth"],
+        suggestions=params["suggestions"],
+        threshold=float(params["threshold"]) if params["threshold"] else float(FREQUENCY_THRESHOLD),
+        model=DEFAULT_MODEL_NAME,
+    )
+
+
+def get_mapping(params: dict, progress: Optional[Callable[[Dict[str, int]], None]] = None, events: Optional[Callable[[str, Any], None]] = None) -> Tuple[dict, bool]:
+    # returns the result, and if it was taken from the cache.
+    # the result is marked with cached, because the time of a cached result is the time of the run that computed it.
+    key = get_mapping_key(params)
+    result = results.get(key)
+    if result is not None:
+        return dict(result, cached=True), True
+    result = run_mapping(params, progress, events)
+    results.set(key, result)
+    return dict(result, cached=False), False
+
+
+def run_mapping(params: dict, progress: Optional[Callable[[Dict[str, int]], None]] = None, events: Optional[Callable[[str, Any], None]] = None) -> dict:
     start_time = time.time()
-
-    # required args
-    base = [b.strip() for b in request.args.get('base').split(',')]
-    target = [t.strip() for t in request.args.get('target').split(',')]
-
-    # trigger by mail
-    send_mail = request.args.get('email', False)
+    base = params["base"]
+    target = params["target"]
 
     # additional args
     # top_n = utils.get_int(request.args.get('top'), 3)
     args = {
-            "num_of_suggestions": utils.get_int(request.args.get('suggestions'), 3),
-            "N": utils.get_int(request.args.get('depth'), 20),
+            "num_of_suggestions": params["suggestions"],
+            "N": params["depth"],
             "verbose": True,
             "google": True,
             "openie": True,
             "quasimodo": True,
             "gpt3": True,
-            "conceptnet": False
+            "conceptnet": False,
+            "progress": progress
         }
 
-    # unmutable. TODO: pack them together
+    # unmutable. loaded once per worker, and shared between the requests.
     # actually this is happen in the mapping wrapper, but here need it after for the graphs.
-    quasimodo = Quasimodo()
-    data_collector = DataCollector(api=args, quasimodo=quasimodo)
-    model_name = 'msmarco-distilbert-base-v4'
-    model = SentenceEmbedding(model=model_name)
-    freq_th = request.args.get('threshold')
-    freq_th = freq_th if freq_th else FREQUENCY_THRESHOLD
-    freq_json_folder = root / 'backend' / 'frequency'
-    freq = Frequencies(freq_json_folder / 'freq.json', threshold=float(freq_th))
-    unmutables = {
-        "quasimodo": quasimodo,
-        "data_collector": data_collector,
-        "model": model,
-        "freq": freq
-    }
+    unmutables = resources.get_unmutables(api=args, threshold=params["threshold"])
+    data_collector = unmutables["data_collector"]
+    model = unmutables["model"]
+    freq = unmutables["freq"]
+
+    # the partial results of the search, in the same format of the final result.
+    if events:
+        args["events"] = lambda name, value: events(name, get_event_for_app(name, value, model, data_collector, freq))
     
     # for webapp
     data = []
     scores = []
     
     # here we map between base entitites and target entities
-    algo = request.args.get('algo') # TODO: make it choice in the GUI (not string input)
-    algo_func = beam_search_wrapper if algo == 'beam' else dfs_wrapper
-
-    if send_mail:
-        p = Process(target=mapping_wrapper, kwargs={'func': algo_func, 'base': base, 'target': target, 'args': args, 'unmutables': unmutables})
-        p.start()
-        # send mail here
-        return {
-            "jon_submitted": True
-        }
+    algo_func = beam_search_wrapper if params["algo"] == 'beam' else dfs_wrapper
     solutions = mapping_wrapper(algo_func, 
                                 base=base, 
                                 target=target,
@@ -87,64 +139,115 @@ def mapping_entities():
                                 unmutables=unmutables)
 
     for solution in solutions:
-        # prepare the nodes for the react app
-        nodes = python2react.get_nodes_for_app(props=solution.mapping, start_idx=0)
-        nodes_val2index = {node:i for i, node in enumerate(solution.mapping)}
-        edges = []
-        max_score_for_scaling = 0
-
-        # we iterate over the mapping that found. 
-        # the first iterate is the strongest map, and so on.
-        for relation in solution.relations:
-            # we count both direction. for example earth:sun, electrons:nucleus, we want also sun:earth, nucleus:electrons.
-            for direction in range(2):
-                node1 = f"{relation[0][0]} --> {relation[1][0]}"
-                node2 = f"{relation[0][1]} --> {relation[1][1]}"
-                edge = (nodes_val2index[node1], nodes_val2index[node2])
-                if direction == 1:
-                    edge = (edge[1], edge[0])
-                    relation = [(relation[0][1], relation[0][0]), (relation[1][1], relation[1][0])]
-
-                # now we extract information of the relation. 
-                # actually we already did it in dfs_wrapper(base, target), but this is very quick since we already saved all the props.
-                # and it more readable to do it here again.
-                graph = get_pair_mapping(model, data_collector, freq, relation)
-                if not graph:
-                    continue
-
-                # now we are building the labels on the edge between two nodes (node is a map between base and target)
-                # we take the best prop in each cluster.
-                label = []
-                for i, cluster_edge in enumerate(graph["graph"]):
-                    props = utils.get_ordered_edges_similarity(model, graph["clusters1"][cluster_edge[0]], graph["clusters2"][cluster_edge[1] - len(graph["clusters1"])])
-                    label.append(f"{relation[0][0]} {props[0][0]} {relation[0][1]} :: {relation[1][0]} {props[0][1]} {relation[1][1]} :: {cluster_edge[2]}")
-                label = sorted(label, key=lambda x: x.split('::')[2], reverse=True)[:NUM_OF_CLUSTERS_TO_CALC]
-                label = [l for l in label if float(l.split('::')[2]) > EDGE_THRESHOLD]
-                edges.append(python2react.get_single_edge_for_app(edge, "\n".join(label), graph["score"], len(edges)))
-                max_score_for_scaling = max(max_score_for_scaling, graph["score"])
-
-        # for scaling
-        for edge in edges:
-            edge["scaling"]["max"] = max_score_for_scaling
-        
-        data.append({
-            "graph": {
-                    "nodes": nodes,
-                    "edges": edges,
-                },
-            "top_suggestions" : solution.top_suggestions
-        })
-        
+        data.append(get_solution_for_app(solution, model, data_collector, freq))
         scores.append({
             "label": f"Top #{len(scores)+1} ({solution.score})",
             "value": len(scores)
         })
 
-    return jsonify({
+    return {
         "data": data,
         "scores": scores,
         "time": round(time.time() - start_time, 2),
-    })
+    }
+
+
+def get_solution_for_app(solution: Solution, model: SentenceEmbedding, data_collector: DataCollector, freq: Frequencies) -> dict:
+    # prepare the nodes for the react app
+    nodes = python2react.get_nodes_for_app(props=solution.mapping, start_idx=0)
+    nodes_val2index = {node:i for i, node in enumerate(solution.mapping)}
+    edges = []
+    max_score_for_scaling = 0
+
+    # we iterate over the mapping that found. 
+    # the first iterate is the strongest map, and so on.
+    for relation in solution.relations:
+        # we count both direction. for example earth:sun, electrons:nucleus, we want also sun:earth, nucleus:electrons.
+        for direction in range(2):
+            node1 = f"{relation[0][0]} --> {relation[1][0]}"
+            node2 = f"{relation[0][1]} --> {relation[1][1]}"
+            edge = (nodes_val2index[node1], nodes_val2index[node2])
+            if direction == 1:
+                edge = (edge[1], edge[0])
+                relation = [(relation[0][1], relation[0][0]), (relation[1][1], relation[1][0])]
+
+            # now we extract information of the relation. 
+            # actually we already did it while scoring (in the mapping wrapper), so the graph is taken from there.
+            graph = get_pair_mapping(model, data_collector, freq, relation)
+            if not graph:
+                continue
+
+            # now we are building the labels on the edge between two nodes (node is a map between base and target)
+            # we take the best prop in each cluster.
+            label = []
+            for cluster_edge, props in zip(graph["graph"], get_pair_mapping_props(model, data_collector, freq, relation, graph)):
+                label.append(f"{relation[0][0]} {props[0]} {relation[0][1]} :: {relation[1][0]} {props[1]} {relation[1][1]} :: {cluster_edge[2]}")
+            label = sorted(label, key=lambda x: x.split('::')[2], reverse=True)[:NUM_OF_CLUSTERS_TO_CALC]
+            label = [l for l in label if float(l.split('::')[2]) > EDGE_THRESHOLD]
+            edges.append(python2react.get_single_edge_for_app(edge, "\n".join(label), graph["score"], len(edges)))
+            max_score_for_scaling = max(max_score_for_scaling, graph["score"])
+
+    # for scaling
+    for edge in edges:
+        edge["scaling"]["max"] = max_score_for_scaling
+    
+    return {
+        "graph": {
+                "nodes": nodes,
+                "edges": edges,
+            },
+        "top_suggestions" : solution.top_suggestions
+    }
+
+
+def get_event_for_app(name: str, value: Any, model: SentenceEmbedding, data_collector: DataCollector, freq: Frequencies) -> Any:
+    if name == "pairs":
+        return [{"mapping": result["best_mapping"], "score": result["best_score"], "coverage": result["coverage"]} for result in value]
+    if name == "solution":
+        return dict(get_solution_for_app(value, model, data_collector, freq), score=value.score)
+    if name == "suggestions":
+        return [dict(get_solution_for_app(solution, model, data_collector, freq), score=solution.score) for solution in value]
+    return value
+
+
+@app.route("/api/mapping/stream", methods=["GET"])
+def mapping_entities_stream():
+    # same as /api/mapping, but the partial results are sent (as server-sent events) while the search is running:
+    # pairs (the ranking of the pair mappings), solution (each time there is a better top solution), suggestions,
+    # and in the end result (the same as /api/mapping) or error.
+    params = get_mapping_params()
+    start_time = time.time()
+    events = queue.Queue()
+
+    def run():
+        try:
+            result, _ = get_mapping(params, events=lambda name, data: events.put((name, data)))
+            events.put(("result", result))
+        except Exception as e:
+            events.put(("error", {"error": repr(e)}))
+        finally:
+            events.put(None)
+
+    def stream():
+        while True:
+            event = events.get()
+            if event is None:
+                return
+            name, data = event
+            yield f"event: {name}\ndata: {json.dumps({'time': round(time.time() - start_time, 2), 'data': data})}\n\n"
+
+    # the search is running in its own thread, so it is finished (and cached) even if the client is gone.
+    threading.Thread(target=run, daemon=True).start()
+    return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def job_status(job_id: str):
+    # the result can be big, so it can be excluded (result=false) while polling the status.
+    job = jobs.get(job_id, with_result=request.args.get('result', 'true').lower() in ('1', 'true'))
+    if job is None:
+        return jsonify({"error": f"no such job {job_id}"}), 404
+    return jsonify(job)
 
 
 @app.route("/api/single-mapping", methods=["GET", "POST"])
@@ -156,17 +259,14 @@ def single_mapping():
         "gpt3": True,
         "conceptnet": False
     }
-    data_collector = DataCollector(api=api)
-    model = SentenceEmbedding(model='msmarco-distilbert-base-v4')
+    data_collector = resources.get_data_collector(api)
+    model = resources.get_model()
 
     edge1 = (request.args.get('base1'), request.args.get('base2'))
     edge2 = (request.args.get('target1'), request.args.get('target2'))
     d = {0: {}, 1: {}, 2: {}, 3: {}}
     
-    threshold = request.args.get('threshold')
-    threshold = threshold if threshold else FREQUENCY_THRESHOLD
-    freq_json_folder = root / 'backend' / 'frequency'
-    freq = Frequencies(freq_json_folder / 'freq.json', threshold=float(threshold))
+    freq = resources.get_freq(request.args.get('threshold'))
 
     for edge_idx, edge_ in enumerate(utils.get_edges_combinations(edge1, edge2)):   
         props_edge1 = data_collector.get_entities_relations(edge_[0][0], edge_[0][1])
@@ -181,10 +281,7 @@ def single_mapping():
             continue
 
         # we want the weight of each edge between two nodes.
-        similatiry_edges = [
-            (prop1, prop2, get_edge_score(prop1, prop2, model, freq)) 
-            for prop1 in props_edge1 for prop2 in props_edge2
-        ]
+        similatiry_edges = get_similarity_edges(props_edge1, props_edge2, model, freq)
         
         for thresh in utils.DISTANCE_TRESHOLDS:
             clustered_sentences_1: Dict[int, List[str]] = model.clustering(props_edge1, distance_threshold=thresh)
@@ -228,7 +325,7 @@ def two_entities():
         "gpt3": True,
         "conceptnet": False
     }
-    data_collector = DataCollector(api=api) 
+    data_collector = resources.get_data_collector(api)
     props1 = data_collector.get_entities_relations(entity1, entity2, from_where=True)
     for k, v in props1.items():
         props1[k] = "<br/>".join(v)
@@ -257,12 +354,9 @@ def bipartite_graph():
         "gpt3": True,
         "conceptnet": False
     }
-    data_collector = DataCollector(api=api)
-    model = SentenceEmbedding(model='msmarco-distilbert-base-v4')
-    threshold = request.args.get('threshold')
-    threshold = threshold if threshold else FREQUENCY_THRESHOLD
-    freq_json_folder = root / 'backend' / 'frequency'
-    freq = Frequencies(freq_json_folder / 'freq.json', threshold=float(threshold))
+    data_collector = resources.get_data_collector(api)
+    model = resources.get_model()
+    freq = resources.get_freq(request.args.get('threshold'))
 
     if not utils.is_none(base1) and not utils.is_none(base2) and not utils.is_none(target1) and not utils.is_none(target2):
         props_edge1 = data_collector.get_entities_relations(base1, base2)
@@ -294,8 +388,8 @@ def clustring():
         "gpt3": True,
         "conceptnet": False
     }
-    data_collector = DataCollector(api=api)
-    model = SentenceEmbedding(model='msmarco-distilbert-base-v4')
+    data_collector = resources.get_data_collector(api)
+    model = resources.get_model()
 
     d = {}
     for thresh in utils.DISTANCE_TRESHOLDS:
@@ -318,6 +412,13 @@ def clustring():
     return jsonify(d)
 
 
+@app.route("/api/ready", methods=["GET"])
+def ready():
+    # the models are loaded in the background when the worker starts.
+    status = resources.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+
 @app.route("/api/test", methods=["GET", "POST"])
 def index():
     return "hello world!"
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Callable, Optional, Any
+
+from click import secho
+
+root = Path(__file__).resolve().parent.parent.parent
+DEFAULT_PATH = root / 'backend' / 'database' / 'jobs.sqlite'
+
+# the jobs are running in threads of the worker, so they are using the models that already loaded (see resources).
+MAX_WORKERS = int(os.environ.get("JOBS_MAX_WORKERS", 1))
+# new jobs are rejected when there are too many jobs that are waiting or running in the worker.
+MAX_PENDING = int(os.environ.get("JOBS_MAX_PENDING", 20))
+# the progress is written to the store at most once in this number of seconds.
+PROGRESS_INTERVAL = 1.0
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobStore(object):
+    """
+    The jobs (params, status, progress and result) in a SQLite database, so each of the workers can answer about
+    a job that submitted to another one, and the results are kept after the worker is restarted.
+    """
+    def __init__(self, path: Path = DEFAULT_PATH):
+        self.path = Path(path)
+        self.lock = threading.RLock()
+        self.connection = None
+        self.pid = None
+
+    def connect(self) -> sqlite3.Connection:
+        # sqlite connection cannot be shared with a forked process, so each process opens its own.
+        if self.connection is not None and self.pid == os.getpid():
+            return self.connection
+        self.pid = os.getpid()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(self.path), timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, status TEXT, params TEXT, progress TEXT, result TEXT, error TEXT,
+                pid INTEGER, created REAL, started REAL, finished REAL
+            )
+        """)
+        return self.connection
+
+    def create(self, job_id: str, params: dict):
+        with self.lock:
+            self.connect().execute(
+                "INSERT INTO jobs (id, status, params, progress, pid, created) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(params), json.dumps({}), os.getpid(), time.time())
+            )
+
+    def update(self, job_id: str, **fields: Any):
+        # params, progress and result are saved as json
+        fields = {key: json.dumps(value) if key in ("params", "progress", "result") else value for key, value in fields.items()}
+        with self.lock:
+            self.connect().execute(
+                f"UPDATE jobs SET {', '.join(f'{key} = ?' for key in fields)} WHERE id = ?",
+                tuple(fields.values()) + (job_id,)
+            )
+
+    def get(self, job_id: str, with_result: bool = True) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.connect().execute(
+                "SELECT id, status, params, progress, result, error, pid, created, started, finished FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(["id", "status", "params", "progress", "result", "error", "pid", "created", "started", "finished"], row))
+        for key in ("params", "progress", "result"):
+            job[key] = json.loads(job[key]) if job[key] is not None else None
+        # the worker that ran the job died (or restarted) before it finished.
+        pid = job.pop("pid")
+        if job["status"] in (QUEUED, RUNNING) and not is_alive(pid):
+            job["status"], job["error"] = FAILED, "the worker of the job stopped before it finished"
+        if not with_result:
+            job.pop("result")
+        return job
+
+
+class JobQueue(object):
+    """
+    Bounded pool of threads that are running the long requests in the background.
+    submit returns the id of the job immediately, the status, progress and result are in the store.
+    """
+    def __init__(self, run: Callable[[dict, Callable[[Dict[str, int]], None]], Any], store: Optional[JobStore] = None, max_workers: int = MAX_WORKERS, max_pending: int = MAX_PENDING):
+        self.run = run
+        self.store = store or JobStore()
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.executor = None
+        self.pid = None
+
+    def get_executor(self) -> ThreadPoolExecutor:
+        # threads are not copied to a forked process, so each process has its own pool.
+        if self.executor is None or self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.pending = 0
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+        return self.executor
+
+    def submit(self, params: dict) -> Optional[str]:
+        # returns None if the queue is full.
+        with self.lock:
+            executor = self.get_executor()
+            if self.pending >= self.max_pending:
+                return None
+            self.pending += 1
+        job_id = uuid.uuid4().hex
+        self.store.create(job_id, params)
+        executor.submit(self.run_job, job_id, params)
+        return job_id
+
+    def run_job(self, job_id: str, params: dict):
+        last_update = 0
+        last_counters = {}
+        def progress(counters: Dict[str, int]):
+            nonlocal last_update, last_counters
+            last_counters = counters
+            if time.time() - last_update >= PROGRESS_INTERVAL:
+                last_update = time.time()
+                self.store.update(job_id, progress=counters)
+
+        try:
+            self.store.update(job_id, status=RUNNING, started=time.time())
+            result = self.run(params, progress)
+            self.store.update(job_id, status=DONE, progress=last_counters, result=result, finished=time.time())
+        except Exception as e:
+            secho(f"[ERROR] job {job_id} failed: {e!r}", fg="red", bold=True)
+            self.store.update(job_id, status=FAILED, progress=last_counters, error=repr(e), finished=time.time())
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def get(self, job_id: str, with_result: bool = True) -> Optional[Dict[str, Any]]:
+        return self.store.get(job_id, with_result=with_result)
+
+
+def is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,119 @@
+import time
+import threading
+from pathlib import Path
+from typing import Dict, Tuple, Union, Optional
+
+from mapping.quasimodo import Quasimodo
+from frequency.frequency import Frequencies
+from mapping.suggestions import Suggestions
+from mapping.data_collector import DataCollector
+from mapping.mapping import FREQUENCY_THRESHOLD, Unmutables
+from utils.sentence_embadding import SentenceEmbedding
+
+root = Path(__file__).resolve().parent.parent.parent
+
+DEFAULT_MODEL_NAME = 'msmarco-distilbert-base-v4'
+DEFAULT_API = {
+    "google": True,
+    "openie": True,
+    "quasimodo": True,
+    "gpt3": True,
+    "conceptnet": False
+}
+API_SOURCES = ["google", "openie", "quasimodo", "gpt3", "conceptnet"]
+
+
+class Resources(object):
+    """
+    The heavy objects of the backend (quasimodo, sBERT model, data collectors, suggestions and frequencies).
+    They are not changed by the requests, so each worker loads them only once and shares them between the requests.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.quasimodo: Optional[Quasimodo] = None
+        self.models: Dict[str, SentenceEmbedding] = {}
+        self.data_collectors: Dict[Tuple[bool], DataCollector] = {}
+        self.suggestions: Dict[Tuple[bool], Suggestions] = {}
+        self.freqs: Dict[float, Frequencies] = {}
+        self.warm_up_thread: Optional[threading.Thread] = None
+        self.warm_up_time: Optional[float] = None
+        self.warm_up_error: Optional[str] = None
+        self.ready = False
+
+    def get_quasimodo(self) -> Quasimodo:
+        with self.lock:
+            if self.quasimodo is None:
+                self.quasimodo = Quasimodo()
+            return self.quasimodo
+
+    def get_model(self, model_name: str = DEFAULT_MODEL_NAME) -> SentenceEmbedding:
+        with self.lock:
+            if model_name not in self.models:
+                self.models[model_name] = SentenceEmbedding(model=model_name)
+            return self.models[model_name]
+
+    def get_data_collector(self, api: dict = DEFAULT_API) -> DataCollector:
+        # the data collector depends only on which sources are enabled.
+        key = tuple(bool(api.get(source, False)) for source in API_SOURCES)
+        with self.lock:
+            if key not in self.data_collectors:
+                self.data_collectors[key] = DataCollector(api={source: enabled for source, enabled in zip(API_SOURCES, key)}, quasimodo=self.get_quasimodo())
+            return self.data_collectors[key]
+
+    def get_suggestions(self, api: dict = DEFAULT_API) -> Suggestions:
+        # same as the data collector, it depends only on which sources are enabled.
+        key = tuple(bool(api.get(source, False)) for source in API_SOURCES)
+        with self.lock:
+            if key not in self.suggestions:
+                self.suggestions[key] = Suggestions(api={source: enabled for source, enabled in zip(API_SOURCES, key)}, quasimodo=self.get_quasimodo())
+            return self.suggestions[key]
+
+    def get_freq(self, threshold: Union[str, float, None] = None) -> Frequencies:
+        threshold = float(threshold) if threshold else float(FREQUENCY_THRESHOLD)
+        with self.lock:
+            if threshold not in self.freqs:
+                self.freqs[threshold] = Frequencies(root / 'backend' / 'frequency' / 'freq.json', threshold=threshold)
+            return self.freqs[threshold]
+
+    def get_unmutables(self, api: dict = DEFAULT_API, model_name: str = DEFAULT_MODEL_NAME, threshold: Union[str, float, None] = None) -> Dict[str, Unmutables]:
+        return {
+            "quasimodo": self.get_quasimodo(),
+            "data_collector": self.get_data_collector(api),
+            "suggestions": self.get_suggestions(api),
+            "model": self.get_model(model_name),
+            "freq": self.get_freq(threshold),
+        }
+
+    def warm_up(self):
+        start_time = time.time()
+        try:
+            unmutables = self.get_unmutables()
+            # the first encoding is much slower than the next ones.
+            unmutables["model"].encode_sentence("warm up")
+            self.warm_up_time = round(time.time() - start_time, 2)
+            self.ready = True
+        except Exception as e:
+            self.warm_up_error = repr(e)
+
+    def warm_up_in_background(self):
+        with self.lock:
+            if self.warm_up_thread is None:
+                self.warm_up_thread = threading.Thread(target=self.warm_up, daemon=True)
+                self.warm_up_thread.start()
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "warm_up_time": self.warm_up_time,
+            "error": self.warm_up_error,
+            "loaded": {
+                "quasimodo": self.quasimodo is not None,
+                "models": sorted(self.models.keys()),
+                "data_collectors": len(self.data_collectors),
+                "suggestions": len(self.suggestions),
+                "freq_thresholds": sorted(self.freqs.keys()),
+            }
+        }
+
+
+resources = Resources()
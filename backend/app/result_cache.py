@@ -0,0 +1,81 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from mapping.cache_store import CacheStore, get_cache_store
+
+# the results are kept for this number of seconds (0 is disabling the cache).
+RESULTS_CACHE_TTL = float(os.environ.get("RESULTS_CACHE_TTL", 3600))
+RESULTS_CACHE_SIZE = int(os.environ.get("RESULTS_CACHE_SIZE", 256))
+# the number of results that are kept in the cache store (the ones that expire last).
+RESULTS_STORE_SIZE = int(os.environ.get("RESULTS_STORE_SIZE", 4096))
+# the results are saved also in the cache store (shared by the workers and kept after restart) only if this environment variable is set.
+PERSIST_ENV = 'PERSIST_RESULTS'
+SOURCE = 'mapping_results'
+
+
+class ResultCache(object):
+    """
+    The whole responses of the requests, keyed by the normalized request (see get_key).
+    The last max_size used are kept in memory, each one for ttl seconds.
+    If cache_store is given they are also saved there (the last store_size), so the other workers can use them.
+    """
+    def __init__(self, 
+                ttl: float = RESULTS_CACHE_TTL, 
+                max_size: int = RESULTS_CACHE_SIZE, 
+                cache_store: Optional[CacheStore] = None, 
+                store_size: int = RESULTS_STORE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.store_size = store_size
+        self.cache_store = cache_store
+        self.results: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(**request: Any) -> str:
+        return json.dumps(request, sort_keys=True)
+
+    def get(self, key: str) -> Optional[Any]:
+        if self.ttl <= 0:
+            return None
+        with self.lock:
+            if key in self.results:
+                expires, result = self.results[key]
+                if expires > time.time():
+                    self.results.move_to_end(key)
+                    return result
+                del self.results[key]
+
+        if self.cache_store:
+            stored = self.cache_store.get(SOURCE, key, '')
+            if stored is None:
+                return None
+            if stored["expires"] > time.time():
+                self.add(key, stored["result"], stored["expires"])
+                return stored["result"]
+            self.cache_store.delete(SOURCE, key, '')
+        return None
+
+    def set(self, key: str, result: Any):
+        if self.ttl <= 0:
+            return
+        expires = time.time() + self.ttl
+        self.add(key, result, expires)
+        if self.cache_store:
+            self.cache_store.set(SOURCE, key, '', {"expires": expires, "result": result})
+            self.cache_store.trim(SOURCE, self.store_size, '$.expires')
+
+    def add(self, key: str, result: Any, expires: float):
+        with self.lock:
+            self.results[key] = (expires, result)
+            self.results.move_to_end(key)
+            while len(self.results) > self.max_size:
+                self.results.popitem(last=False)
+
+
+def get_result_cache() -> ResultCache:
+    return ResultCache(cache_store=get_cache_store() if os.environ.get(PERSIST_ENV, False) else None)
@@ -4,7 +4,6 @@ from typing import List
 from pathlib import Path
 
 import yaml
-import torch
 import click
 from click import secho
 
@@ -80,7 +79,8 @@ def evaluate(model_name: str,
              path: str, 
              specify: int,
              algorithm: str,
-             num_of_suggestions: int):
+             num_of_suggestions: int,
+             workers: int = 1):
     
     if algorithm not in ['beam', 'dfs']:
             secho("[ERROR] unsupported algorithm. (supported are 'beam' or 'dfs').")
@@ -106,7 +106,8 @@ def evaluate(model_name: str,
             "quasimodo": True,
             "gpt3": True if 'CI' not in os.environ else False,
             "conceptnet": False,
-            "use_base_mapping": tv["output"]["mapping"] if tv["input"].get("use_base_mapping", False) else []
+            "use_base_mapping": tv["output"]["mapping"] if tv["input"].get("use_base_mapping", False) else [],
+            "workers": workers
         }
 
         algo_func = beam_search_wrapper if algorithm == 'beam' else dfs_wrapper
@@ -166,9 +167,12 @@ def evaluate(model_name: str,
 @click.option('-s', '--specify', default=[], type=int, multiple=True, help="Specify which entry of the yaml file to evaluate")
 @click.option('-a', '--algo', default='beam', type=str, help="Which algorithm to use")
 @click.option('-g', '--num-of-suggestions', type=int, default=0, help="Number of suggestions for missing entities")
-def run(model, freq_th, yaml, comment, specify, algo, num_of_suggestions):
+@click.option('-w', '--workers', type=int, default=1, help="Number of threads for scoring the pairs (1 is serial)")
+def run(model, freq_th, yaml, comment, specify, algo, num_of_suggestions, workers):
+    # torch is imported only when running (the model needs it anyway), so importing this module is quick.
+    import torch
     torch.cuda.empty_cache()
-    evaluate(model, freq_th, yaml, list(specify), algo, num_of_suggestions)
+    evaluate(model, freq_th, yaml, list(specify), algo, num_of_suggestions, workers)
 
 if __name__ == '__main__':
     # os.environ['CI'] = 'true'
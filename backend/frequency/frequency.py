@@ -3,8 +3,6 @@ from typing import Union
 from pathlib import Path
 
 from tqdm import tqdm
-import gensim.downloader as api
-from sklearn.feature_extraction.text import CountVectorizer
 
 from utils import utils
 
@@ -18,6 +16,7 @@ class Frequencies():
         self.manual_stopwords()
     
     def apply_threshold(self, threshold):
+        self.threshold = threshold
         target_value = threshold if threshold >= 1 else int(threshold * len(self.data))
         self.stopwords = {k: v for i, (k, v) in enumerate(self.data.items()) if i < target_value}
     
@@ -40,6 +39,9 @@ class Frequencies():
     
 
 def ngram(ngram_range: tuple = (1, 4)):   
+    # building the frequencies is done offline, so gensim and sklearn are imported only here.
+    import gensim.downloader as api
+    from sklearn.feature_extraction.text import CountVectorizer
     dataset = api.load("wiki-english-20171001")
     start_iteration = 5000
     docs_in_json = 100
@@ -1,9 +1,8 @@
-import copy
 from pathlib import Path
 from typing import List, Dict
 
 from . import mapping
-from .mapping import Solution, Cache, Unmutables
+from .mapping import Solution, Cache, Unmutables, AvailablePairs
 from .suggestions import mapping_suggestions_wrapper
 
 root = Path(__file__).resolve().parent.parent.parent
@@ -26,14 +25,14 @@ def beam_search(
             # otherwise, if the best score is 0, we have no more mappings to do.
             if result["best_score"] > 0:
                 # the current solution is our base for the new one. We need it but we don't want to affect him
-                # by modified the new one, so we need that deepcopy.
-                solution_copy = copy.deepcopy(solution)
+                # by modified the new one, so we need a copy (which shares the big lists with him).
+                solution_copy = solution.copy()
                 
                 solution_copy.relations.append(result["best_mapping"])
-                relations_as_tuple = tuple([tuple(relation) for relation in sorted(solution_copy.relations)])
-                if relations_as_tuple in cache["relations"]:
+                solution_copy.relations_key |= cache["encoder"].get_relation_bit(result["best_mapping"])
+                if solution_copy.relations_key in cache["relations"]:
                     continue
-                cache["relations"].add(relations_as_tuple)
+                cache["relations"].add(solution_copy.relations_key)
 
                 solution_copy.scores.append(round(result["best_score"], 3))
                 solution_copy.coverage.append(result["coverage"])
@@ -45,19 +44,19 @@ def beam_search(
                 if b1 not in solution_copy.actual_base and t1 not in solution_copy.actual_target:
                     score += mapping.get_score(solution_copy.actual_base, solution_copy.actual_target, b1, t1, cache["scores"])
                     mapping.update_already_mapping(b1, t1, solution_copy.actual_base, solution_copy.actual_target, solution_copy.actual_indecies)
+                    solution_copy.mapping_key |= cache["encoder"].get_mapping_bit(b1, t1)
 
                 if b2 not in solution_copy.actual_base and t2 not in solution_copy.actual_target:
                     score += mapping.get_score(solution_copy.actual_base, solution_copy.actual_target, b2, t2, cache["scores"])
                     mapping.update_already_mapping(b2, t2, solution_copy.actual_base, solution_copy.actual_target, solution_copy.actual_indecies)
+                    solution_copy.mapping_key |= cache["encoder"].get_mapping_bit(b2, t2)
 
                 solution_copy.score += score
-                mapping_repr = [f"{b} --> {t}" for b, t in zip(solution_copy.actual_base, solution_copy.actual_target)]
-                mapping_repr_as_tuple = tuple(sorted(mapping_repr))
-                if mapping_repr_as_tuple in cache["mappings"]:
+                if solution_copy.mapping_key in cache["mappings"]:
                     continue
-                cache["mappings"].add(mapping_repr_as_tuple)
+                cache["mappings"].add(solution_copy.mapping_key)
 
-                solution_copy.mapping = mapping_repr
+                solution_copy.mapping = [f"{b} --> {t}" for b, t in zip(solution_copy.actual_base, solution_copy.actual_target)]
 
                 # here we update the possible/available pairs.
                 # for example, if we already map a->1, b->2, we will looking only for pairs which respect the 
@@ -70,6 +69,9 @@ def beam_search(
 
     if not curr_solutions:
         return
+    cache["progress"].set_max("depth", max(solution.length for solution in curr_solutions))
+    for solution in curr_solutions:
+        cache["progress"].add_solution(solution)
     
     # this is the core of the beam search algorithm. We always keep with N solutions.
     solutions_ = sorted(solutions + curr_solutions, key=lambda x: (x.length, x.score), reverse=True)[:args["N"]]
@@ -98,9 +100,12 @@ def beam_search_wrapper(
 
     # better to init all the objects here, since they are not changed in the run
     mapping.set_unmutables(unmutables, args)
+    mapping.prefetch_entities_relations(unmutables["data_collector"], base, target)
 
-    cache = {"scores": {}, "mappings": set(), "relations": set()}
-    best_results = mapping.get_best_pair_mapping(unmutables, available_pairs, cache)
+    cache = mapping.get_cache(progress=args.get("progress"), events=args.get("events"))
+    best_results = mapping.get_best_pair_mapping(unmutables, available_pairs, cache, workers=args.get("workers", 1))
+    cache["progress"].emit("pairs", best_results)
+    available_pairs = AvailablePairs(available_pairs)
 
     if args["use_base_mapping"]:
         actual_base = [v.split('-->')[0].strip() for v in args["use_base_mapping"]]
@@ -123,8 +128,9 @@ def beam_search_wrapper(
                 }, 
                 length=len(actual_base),
                 coverage=[],
-                availables=copy.deepcopy(available_pairs),
-                sorted_results=copy.deepcopy(best_results)
+                mapping_key=cache["encoder"].get_mapping_key(actual_base, actual_target),
+                availables=available_pairs,
+                sorted_results=best_results
             ) 
         ]
     else:
@@ -140,8 +146,8 @@ def beam_search_wrapper(
                 actual_indecies={'base': {}, 'target': {}}, 
                 length=0,
                 coverage=[],
-                availables=copy.deepcopy(available_pairs),
-                sorted_results=copy.deepcopy(best_results)
+                availables=available_pairs,
+                sorted_results=best_results
             ) 
             for _ in range(args["N"])
         ]
@@ -158,6 +164,7 @@ def beam_search_wrapper(
                                                         args,
                                                         unmutables,
                                                         cache)
+    cache["progress"].emit("suggestions", suggestions_solutions)
 
     all_solutions = sorted(solutions + suggestions_solutions, key=lambda x: (x.length, x.score), reverse=True)
     solutions_to_return_and_print = 10
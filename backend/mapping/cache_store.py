@@ -0,0 +1,173 @@
+import os
+import json
+import atexit
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Dict, Tuple, Optional, Any
+
+root = Path(__file__).resolve().parent.parent.parent
+DATABASE_FOLDER = root / 'backend' / 'database'
+DEFAULT_PATH = DATABASE_FOLDER / 'cache.sqlite'
+
+# the json files that the store was created from, the name of the file is the source.
+JSON_SOURCES = [
+    "google_edges",
+    "openie_edges",
+    "quasimodo_edges",
+    "conceptnet_edges",
+    "gpt3_edges",
+    "google_suggestinos",
+    "openie_suggestinos",
+    "quasimodo_suggestinos",
+]
+COMMIT_EVERY = 100
+Pair = Tuple[str, str]
+
+
+class CacheStore(object):
+    """
+    Key-value store of the values we got from the sources (relations, suggestions),
+    keyed by (source, entity1, entity2). It is backed by a SQLite database in WAL mode,
+    so few processes (flask workers) can read and write it at the same time.
+    The writes are kept in memory and committed together (every COMMIT_EVERY writes or when calling commit).
+    """
+    def __init__(self, path: Path = DEFAULT_PATH, json_folder: Optional[Path] = DATABASE_FOLDER):
+        self.path = Path(path)
+        self.json_folder = json_folder
+        self.pending: Dict[Tuple[str, str, str], Any] = {}
+        self.lock = threading.RLock()
+        self.connection = None
+        self.pid = None
+
+    def connect(self) -> sqlite3.Connection:
+        # sqlite connection cannot be shared with a forked process, so each process opens its own.
+        if self.connection is not None and self.pid == os.getpid():
+            return self.connection
+        self.pending = {}
+        self.pid = os.getpid()
+        self.connection = sqlite3.connect(str(self.path), timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS cache (source TEXT, entity1 TEXT, entity2 TEXT, value TEXT, PRIMARY KEY (source, entity1, entity2)) WITHOUT ROWID")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        if self.json_folder:
+            self.import_json_files(self.json_folder)
+        return self.connection
+
+    def get(self, source: str, entity1: str, entity2: str, default: Any = None) -> Any:
+        return self.get_many(source, [(entity1, entity2)]).get((entity1, entity2), default)
+
+    def get_many(self, source: str, pairs: List[Pair]) -> Dict[Pair, Any]:
+        # returns only the pairs that are in the store.
+        with self.lock:
+            connection = self.connect()
+            values = {}
+            for entity1, entity2 in dict.fromkeys(pairs):
+                if (source, entity1, entity2) in self.pending:
+                    values[(entity1, entity2)] = self.pending[(source, entity1, entity2)]
+                    continue
+                row = connection.execute(
+                    "SELECT value FROM cache WHERE source = ? AND entity1 = ? AND entity2 = ?",
+                    (source, entity1, entity2)
+                ).fetchone()
+                if row is not None:
+                    values[(entity1, entity2)] = json.loads(row[0])
+            return values
+
+    def get_source(self, source: str) -> Dict[Pair, Any]:
+        # all the entries of the source (including the writes that are not committed yet).
+        with self.lock:
+            connection = self.connect()
+            values = {
+                (entity1, entity2): json.loads(value)
+                for entity1, entity2, value in connection.execute("SELECT entity1, entity2, value FROM cache WHERE source = ?", (source,))
+            }
+            values.update({(entity1, entity2): value for (source_, entity1, entity2), value in self.pending.items() if source_ == source})
+            return values
+
+    def set(self, source: str, entity1: str, entity2: str, value: Any):
+        with self.lock:
+            self.connect()
+            self.pending[(source, entity1, entity2)] = value
+            if len(self.pending) >= COMMIT_EVERY:
+                self.commit()
+
+    def delete(self, source: str, entity1: str, entity2: str):
+        with self.lock:
+            connection = self.connect()
+            self.pending.pop((source, entity1, entity2), None)
+            connection.execute("DELETE FROM cache WHERE source = ? AND entity1 = ? AND entity2 = ?", (source, entity1, entity2))
+
+    def trim(self, source: str, max_size: int, order_by: str):
+        # keeps only the max_size entries of the source with the largest order_by (a json path in the value, like '$.expires').
+        with self.lock:
+            self.commit()
+            connection = self.connect()
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.execute(
+                    "DELETE FROM cache WHERE source = ? AND (entity1, entity2) IN "
+                    "(SELECT entity1, entity2 FROM cache WHERE source = ? ORDER BY json_extract(value, ?) DESC LIMIT -1 OFFSET ?)",
+                    (source, source, order_by, max_size)
+                )
+
+    def commit(self):
+        with self.lock:
+            if not self.pending or self.pid != os.getpid():
+                return
+            connection = self.connect()
+            rows = [(source, entity1, entity2, json.dumps(value)) for (source, entity1, entity2), value in self.pending.items()]
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.executemany("INSERT OR REPLACE INTO cache (source, entity1, entity2, value) VALUES (?, ?, ?, ?)", rows)
+            self.pending = {}
+
+    def import_json_files(self, folder: Path, force: bool = False):
+        # one time import of the old json caches (the keys there are "entity1#entity2").
+        # the entries that already in the store are not overridden.
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            if not force and self.connection.execute("SELECT value FROM meta WHERE key = 'json_imported'").fetchone():
+                return
+            for source in JSON_SOURCES:
+                path = Path(folder) / f'{source}.json'
+                if not path.exists():
+                    continue
+                with open(path, 'r') as f:
+                    content = json.load(f)
+                rows = []
+                for key, value in content.items():
+                    entity1, _, entity2 = key.partition('#')
+                    rows.append((source, entity1, entity2, json.dumps(value)))
+                self.connection.executemany("INSERT OR IGNORE INTO cache (source, entity1, entity2, value) VALUES (?, ?, ?, ?)", rows)
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_imported', '1')")
+
+    def close(self):
+        with self.lock:
+            self.commit()
+            if self.connection is not None and self.pid == os.getpid():
+                self.connection.close()
+            self.connection = None
+
+
+stores: Dict[Path, CacheStore] = {}
+stores_lock = threading.Lock()
+
+
+def get_cache_store(path: Optional[Path] = None) -> CacheStore:
+    # one store per database file, shared by all the objects in the process.
+    path = Path(path or DEFAULT_PATH).resolve()
+    with stores_lock:
+        if path not in stores:
+            stores[path] = CacheStore(path)
+            # the writes that are not committed yet
+            atexit.register(stores[path].commit)
+        return stores[path]
+
+
+if __name__ == '__main__':
+    store = get_cache_store()
+    store.connect()
+    store.import_json_files(DATABASE_FOLDER, force=True)
+    store.close()
@@ -1,27 +1,113 @@
+import os
+import csv
+import sys
+import gzip
 import json
+import zlib
+import sqlite3
+import threading
 from pathlib import Path
-from typing import List, Set, NoReturn, Tuple
+from collections import defaultdict
+from typing import List, Set, NoReturn, Tuple, Dict, Optional, Iterator
 
 import inflect
-import requests
 from click import secho
-from bs4 import BeautifulSoup
 
 root = Path(__file__).resolve().parent.parent.parent
+CONCEPTNET_INDEX_PATH = root / 'backend' / 'database' / 'conceptnet.sqlite'
+# the relations we are using (see get_entities_relations)
+RELATIONS = ["HasProperty", "CapableOf", "IsA", "UsedFor"]
+Edge = Tuple[str, str, float] # (start, end, weight)
 
 def read_json(path: str) -> dict:
     with open(path, 'r') as f:
         return json.load(f)
 
 
-def read_page(entity: str, which: str, n: int = 20) -> str:
-    url = f'https://conceptnet.io/c/en/{entity}?rel=/r/{which}&limit={n}'
-    try:
-        response = requests.get(url)
-        return response.text
-    except:
-        secho(f"[WARNING] Cannot read url {url}", fg="yellow", bold=True)
-        return ""
+class ConceptNetIndex(object):
+    """
+    The english edges of ConceptNet, keyed by (start concept, relation), sorted by their weight.
+    The edges of each key are kept compressed (zlib of json). It is built once from the assertions dump 
+    (see build_conceptnet_index), so the relations are taken without network.
+    """
+    def __init__(self, path: Path = CONCEPTNET_INDEX_PATH):
+        self.path = Path(path)
+        self.lock = threading.RLock()
+        self.connection = None
+        self.pid = None
+        self.warned = False
+
+    def connect(self) -> Optional[sqlite3.Connection]:
+        # returns None if the index is not built.
+        if self.connection is not None and self.pid == os.getpid():
+            return self.connection
+        if not self.path.exists():
+            if not self.warned:
+                secho(f"[WARNING] conceptnet index not found in {self.path} (python -m mapping.concept_net <assertions dump>)", fg="yellow", bold=True)
+                self.warned = True
+            return None
+        self.pid = os.getpid()
+        self.connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        return self.connection
+
+    def get_edges(self, entity: str, which: str, n: int = 20) -> List[Edge]:
+        # the n edges with the biggest weight.
+        with self.lock:
+            connection = self.connect()
+            if connection is None:
+                return []
+            row = connection.execute("SELECT edges FROM edges WHERE concept = ? AND relation = ?", (get_concept(entity), which)).fetchone()
+        if row is None:
+            return []
+        return [tuple(edge) for edge in json.loads(zlib.decompress(row[0]))[:n]]
+
+
+def get_concept(entity: str) -> str:
+    # /c/en/solar_system
+    return entity.strip().lower().replace(' ', '_')
+
+
+def get_label(uri: str) -> str:
+    return uri.split('/')[3].replace('_', ' ')
+
+
+def read_assertions(dump_path: Path) -> Iterator[List[str]]:
+    # the dump is a (gzip) tsv of: uri, relation, start, end, info (json)
+    csv.field_size_limit(sys.maxsize)
+    opener = gzip.open if str(dump_path).endswith('.gz') else open
+    with opener(dump_path, 'rt', encoding='utf-8', newline='') as f:
+        for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+            if len(row) == 5:
+                yield row
+
+
+def build_conceptnet_index(dump_path: Path, path: Path = CONCEPTNET_INDEX_PATH, relations: List[str] = RELATIONS):
+    # we write everything to a temporary file first, so other processes never see a partial index.
+    relations = set(f'/r/{relation}' for relation in relations)
+    edges: Dict[Tuple[str, str], List[Edge]] = defaultdict(list)
+    for _, relation, start, end, info in read_assertions(dump_path):
+        if relation not in relations or not start.startswith('/c/en/') or not end.startswith('/c/en/'):
+            continue
+        info = json.loads(info)
+        edges[(start.split('/')[3], relation[len('/r/'):])].append((get_label(start), info.get("surfaceEnd") or get_label(end), float(info.get("weight", 1.0))))
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.parent / f'.{path.name}.{os.getpid()}'
+    if tmp_path.exists():
+        tmp_path.unlink()
+    connection = sqlite3.connect(str(tmp_path))
+    connection.execute("CREATE TABLE edges (concept TEXT, relation TEXT, edges BLOB, PRIMARY KEY (concept, relation)) WITHOUT ROWID")
+    with connection:
+        connection.executemany(
+            "INSERT INTO edges (concept, relation, edges) VALUES (?, ?, ?)",
+            ((concept, relation, zlib.compress(json.dumps(sorted(concept_edges, key=lambda x: -x[2])).encode('utf-8'))) for (concept, relation), concept_edges in edges.items())
+        )
+    connection.close()
+    tmp_path.replace(path)
+
+
+conceptnet_index = ConceptNetIndex()
 
 
 def extend_plural_and_singular(engine: inflect.engine, entity: str, list_to_update: List[str]) -> NoReturn:
@@ -35,25 +121,16 @@ def extend_plural_and_singular(engine: inflect.engine, entity: str, list_to_upda
         list_to_update.append(singular)
 
 
-def extract_props(content: str, entity: str, matches: Set[str], weight_thresh: int = 0) -> List[Tuple[str, float]]:
-    soup = BeautifulSoup(content, 'html.parser')
-    # TODO: add test for that API
-    tds = soup.find_all('td', attrs={'class': 'edge-end'})
-    weights = soup.find_all('div', attrs={'class': 'weight'})
-    entities = soup.find_all('td', attrs={'class': 'edge-start'})
+def extract_props(edges: List[Edge], entity: str, matches: Set[str], weight_thresh: int = 0) -> List[Tuple[str, float]]:
     props = []
-    for td, weight, td_entity in zip(tds, weights, entities):
-        prop = td.find('a')
-        if prop:
-            w = float(weight.text.strip().split(':')[1].strip())
-            if w >= weight_thresh: # we want only props that bigger then the threshold
-                actual_entity = td_entity.find('a').text.strip()
-                if entity in actual_entity:
-                    # we check if our real entity include in the actual. This prevent noise
-                    prop_to_add = prop.text.strip()
-                    if (prop_to_add not in matches) and (prop_to_add != entity):
-                        matches.add(prop_to_add)  # this set use for quick check if exists
-                        props.append((prop_to_add, w))
+    for actual_entity, prop_to_add, w in edges:
+        if w >= weight_thresh: # we want only props that bigger then the threshold
+            if entity in actual_entity:
+                # we check if our real entity include in the actual. This prevent noise
+                prop_to_add = prop_to_add.strip()
+                if (prop_to_add not in matches) and (prop_to_add != entity):
+                    matches.add(prop_to_add)  # this set use for quick check if exists
+                    props.append((prop_to_add, w))
     return props
 
 
@@ -66,8 +143,8 @@ def extend_and_extract_props(engine: inflect.engine, which: str, entity1: str, n
     all_props = []
     matches = set()
     for entity in entities:
-        content = read_page(entity, which, n)
-        props = extract_props(content, entity, matches, weight_thresh)
+        edges = conceptnet_index.get_edges(entity, which, n)
+        props = extract_props(edges, entity, matches, weight_thresh)
         all_props.extend(props)
     
     # sorting by the weight that extracted with the prop
@@ -153,4 +230,5 @@ def get_entities_relations(entity1: str, entity2: str, engine: inflect.engine =
 if __name__ == '__main__':
     # res = get_entity_props("earth", n_best=10)
     # print(res)
-    pass
\ No newline at end of file
+    # the assertions dump is here: https://github.com/commonsense/conceptnet5/wiki/Downloads
+    build_conceptnet_index(Path(sys.argv[1]))
\ No newline at end of file
@@ -2,112 +2,124 @@ import os
 import json
 import inflect
 from pathlib import Path
-from typing import List, Optional, Dict, Set
+from typing import List, Optional, Dict, Set, Tuple, Callable
 
 from . import openIE
 from . import concept_net
 from . import google_autosuggest
 from . import gpt3
 from .quasimodo import Quasimodo
+from .cache_store import CacheStore, get_cache_store
 
 root = Path(__file__).resolve().parent.parent.parent
+Pair = Tuple[str, str]
+SOURCES = ["google", "openie", "quasimodo", "gpt3", "conceptnet"]
 
 class DataCollector(object):
-    def __init__(self, api: dict, quasimodo: Optional[Quasimodo] = None):
+    def __init__(self, api: dict, quasimodo: Optional[Quasimodo] = None, cache_store: Optional[CacheStore] = None):
 
         self.quasimodo = quasimodo
         self.engine = None
         self.api = api
-        if api.get("google", False):
-            self.google_edges = read_json(root / 'backend' / 'database' / 'google_edges.json')
-        if api.get("openie", False):
-            self.openie = read_json(root / 'backend' / 'database' / 'openie_edges.json')
-        if api.get("quasimodo", False):
-            self.quasimodo_edges = read_json(root / 'backend' / 'database' / 'quasimodo_edges.json')
-        if api.get("conceptnet", False):
-            self.conceptnet_edges = read_json(root / 'backend' / 'database' / 'conceptnet_edges.json')
-        # if api.get("gpt3", False):
-        #     self.gpt3_edges = read_json(root / 'backend' / 'database' / 'gpt3_edges.json')
-
+        self.cache_store = cache_store or get_cache_store()
         self.stopwords = read_stopwords(root / 'backend' / 'frequency' / 'stopwords.txt')
+        self.relations: Dict[Pair, Dict[str, List[str]]] = {}
+
+
+    def get_sources(self) -> Tuple[str, ...]:
+        # the enabled sources (api can be the args of the whole run)
+        return tuple(source for source in SOURCES if self.api.get(source, False))
 
 
     def get_entities_relations(self, entity1: str, entity2: str, from_where: bool = False) -> List[str]:
-        if self.api.get("google", False):
-            if f"{entity1}#{entity2}" in self.google_edges:
-                autosuggets_props = self.google_edges[f"{entity1}#{entity2}"]
-            else:
-                autosuggets_props = google_autosuggest.get_entities_relations(entity1, entity2).get("props", [])
-                self.google_edges[f"{entity1}#{entity2}"] = sorted(autosuggets_props) 
-                with open(root / 'backend' / 'database' / 'google_edges.json', 'w') as f2:
-                    json.dump(self.google_edges, f2, indent='\t')
-        else:
-            autosuggets_props = []
-
-        if self.api.get("openie", False):
-            if f"{entity1}#{entity2}" in self.openie:
-                openie_props = self.openie[f"{entity1}#{entity2}"]
-            else:
-                openie_props = []
-                # # You should download the database from here: https://allenai.org/data/openie-demo
-                # # Then you should split it to tsv files, two depth-directroies for the first two letters of the subjects.
-                # # full support will be in the future.
-                # openie_props = openIE.entities_relations_wrapper(entity1, entity2, n=10)
-                # self.openie[f"{entity1}#{entity2}"] = sorted(openie_props)
-                # with open(root / 'backend' / 'database' / 'openie_edges.json', 'w') as f4:
-                #     json.dump(self.openie, f4, indent='\t')
-        else:
-            openie_props = []
-
-        if self.api.get("quasimodo", False):
-            if f"{entity1}#{entity2}" in self.quasimodo_edges:
-                quasimodo_props = self.quasimodo_edges[f"{entity1}#{entity2}"]
-            else:
-                if not self.quasimodo:
-                    self.quasimodo = Quasimodo(path=root / 'backend' / 'tsv' / 'merged' / 'quasimodo.tsv')
-                quasimodo_props = self.quasimodo.get_entities_relations(entity1, entity2, n_largest=10, plural_and_singular=True)
-                self.quasimodo_edges[f"{entity1}#{entity2}"] = sorted(quasimodo_props)
-                with open(root / 'backend' / 'database' / 'quasimodo_edges.json', 'w') as f1:
-                    json.dump(self.quasimodo_edges, f1, indent='\t')
-        else:
-            quasimodo_props = []
-
-        if self.api.get("conceptnet", False):
-            if f"{entity1}#{entity2}" in self.conceptnet_edges:
-                concept_net_props = self.conceptnet_edges[f"{entity1}#{entity2}"]
-            else:
-                if not self.engine:
-                    self.engine = inflect.engine()
-                concept_net_props = concept_net.get_entities_relations(entity1, entity2, self.engine, plural_and_singular=True)
-                self.conceptnet_edges[f"{entity1}#{entity2}"] = sorted(concept_net_props)
-                with open(root / 'backend' / 'database' / 'conceptnet_edges.json', 'w') as f3:
-                    json.dump(self.conceptnet_edges, f3, indent='\t')
-        else:
-            concept_net_props = []
+        return self.get_entities_relations_batch([(entity1, entity2)], from_where=from_where)[(entity1, entity2)]
+
+
+    def get_entities_relations_batch(self, pairs: List[Pair], from_where: bool = False) -> Dict[Pair, List[str]]:
+        # the same pairs are asked many times during the mapping, so we keep the relations of each pair in memory.
+        # the pairs we don't have yet are resolved together, one source at a time.
+        missing_pairs = [pair for pair in dict.fromkeys(pairs) if pair not in self.relations]
+        if missing_pairs:
+            sources_props = {
+                "openie": self.get_openie_relations(missing_pairs),
+                "quasimodo": self.get_quasimodo_relations(missing_pairs),
+                "concept_net": self.get_concept_net_relations(missing_pairs),
+                "google_autosuggest": self.get_google_relations(missing_pairs),
+                "gpt3": self.get_gpt3_relations(missing_pairs),
+            }
+            for pair in missing_pairs:
+                self.relations[pair] = {
+                    source: sorted(list(set([prop for prop in props[pair] if prop not in self.stopwords])))
+                    for source, props in sources_props.items()
+                }
         
-        if self.api.get("gpt3", False):
-            if not self.engine:
-                self.engine = inflect.engine()
-            gpt3_props = gpt3.get_entities_relations(entity1, entity2, self.engine)
-        else:
-            gpt3_props = []
-
-        quasimodo_props = [prop for prop in quasimodo_props if prop not in self.stopwords]
-        autosuggets_props = [prop for prop in autosuggets_props if prop not in self.stopwords]
-        concept_net_props = [prop for prop in concept_net_props if prop not in self.stopwords]
-        openie_props = [prop for prop in openie_props if prop not in self.stopwords]
-        gpt3_props = [prop for prop in gpt3_props if prop not in self.stopwords]
-
         if from_where:
-            return {
-                "openie": sorted(list(set(openie_props))),
-                "quasimodo": sorted(list(set(quasimodo_props))),
-                "concept_net": sorted(list(set(concept_net_props))),
-                "google_autosuggest": sorted(list(set(autosuggets_props))),
-                "gpt3": sorted(list(set(gpt3_props))),
-            }
-
-        return sorted(list(set(quasimodo_props + autosuggets_props + concept_net_props + openie_props + gpt3_props)))
+            return {pair: {source: list(props) for source, props in self.relations[pair].items()} for pair in pairs}
+        
+        return {pair: sorted(list(set([prop for props in self.relations[pair].values() for prop in props]))) for pair in pairs}
+
+
+    def get_google_relations(self, pairs: List[Pair]) -> Dict[Pair, List[str]]:
+        if not self.api.get("google", False):
+            return {pair: [] for pair in pairs}
+        # the queries of all the pairs are sent to google together
+        return get_cached_relations_batch(
+            self.cache_store, 
+            'google_edges', 
+            pairs, 
+            lambda pairs_: {pair: result.get("props", []) for pair, result in google_autosuggest.get_entities_relations_batch(pairs_).items()}
+        )
+
+
+    def get_openie_relations(self, pairs: List[Pair]) -> Dict[Pair, List[str]]:
+        if not self.api.get("openie", False):
+            return {pair: [] for pair in pairs}
+        # the relations we already have are taken from the cache, the rest are looked up in the openie store
+        # (python -m mapping.openIE builds it). The lookup is fast, so there is no need to cache it.
+        openie_props = self.cache_store.get_many('openie_edges', pairs)
+        missing_pairs = [pair for pair in dict.fromkeys(pairs) if pair not in openie_props]
+        openie_props.update(openIE.get_entities_relations_batch(missing_pairs, n=10))
+        return {pair: openie_props[pair] for pair in pairs}
+
+
+    def get_quasimodo_relations(self, pairs: List[Pair]) -> Dict[Pair, List[str]]:
+        if not self.api.get("quasimodo", False):
+            return {pair: [] for pair in pairs}
+
+        def get_quasimodo_props(entity1: str, entity2: str) -> List[str]:
+            if not self.quasimodo:
+                self.quasimodo = Quasimodo(path=root / 'backend' / 'tsv' / 'merged' / 'quasimodo.tsv')
+            return self.quasimodo.get_entities_relations(entity1, entity2, n_largest=10, plural_and_singular=True)
+
+        return get_cached_relations(
+            self.cache_store, 
+            'quasimodo_edges', 
+            pairs, 
+            get_quasimodo_props
+        )
+
+
+    def get_concept_net_relations(self, pairs: List[Pair]) -> Dict[Pair, List[str]]:
+        if not self.api.get("conceptnet", False):
+            return {pair: [] for pair in pairs}
+
+        if not self.engine:
+            self.engine = inflect.engine()
+        # the relations we already have are taken from the cache, the rest are looked up in the local conceptnet index
+        # (python -m mapping.concept_net builds it). The lookup is fast, so there is no need to cache it.
+        conceptnet_props = self.cache_store.get_many('conceptnet_edges', pairs)
+        for entity1, entity2 in dict.fromkeys(pairs):
+            if (entity1, entity2) not in conceptnet_props:
+                conceptnet_props[(entity1, entity2)] = sorted(concept_net.get_entities_relations(entity1, entity2, self.engine, plural_and_singular=True))
+        return {pair: conceptnet_props[pair] for pair in pairs}
+
+
+    def get_gpt3_relations(self, pairs: List[Pair]) -> Dict[Pair, List[str]]:
+        if not self.api.get("gpt3", False):
+            return {pair: [] for pair in pairs}
+        if not self.engine:
+            self.engine = inflect.engine()
+        return gpt3.get_entities_relations_batch(pairs, self.engine)
     
 
     # def get_entitiy_props(self, entity: str, from_where: bool = False) -> List[str]:
@@ -143,6 +155,44 @@ class DataCollector(object):
     #     return sorted(list(set(quasimodo_props + concept_net_props + google_props)))
 
 
+def get_cached_relations(
+    cache_store: CacheStore, 
+    source: str, 
+    pairs: List[Pair], 
+    get_props: Callable[[str, str], List[str]]
+    ) -> Dict[Pair, List[str]]:
+    # the pairs that are not in the cache are fetched, and all of them are committed together.
+    relations = cache_store.get_many(source, pairs)
+    try:
+        for entity1, entity2 in pairs:
+            if (entity1, entity2) not in relations:
+                relations[(entity1, entity2)] = sorted(get_props(entity1, entity2))
+                cache_store.set(source, entity1, entity2, relations[(entity1, entity2)])
+    finally:
+        cache_store.commit()
+    return relations
+
+
+def get_cached_relations_batch(
+    cache_store: CacheStore, 
+    source: str, 
+    pairs: List[Pair], 
+    get_props_batch: Callable[[List[Pair]], Dict[Pair, List[str]]]
+    ) -> Dict[Pair, List[str]]:
+    # the same as get_cached_relations, but the pairs that are not in the cache are fetched in one call.
+    relations = cache_store.get_many(source, pairs)
+    missing_pairs = [pair for pair in dict.fromkeys(pairs) if pair not in relations]
+    if not missing_pairs:
+        return relations
+    try:
+        for (entity1, entity2), props in get_props_batch(missing_pairs).items():
+            relations[(entity1, entity2)] = sorted(props)
+            cache_store.set(source, entity1, entity2, relations[(entity1, entity2)])
+    finally:
+        cache_store.commit()
+    return relations
+
+
 def read_json(path: str) -> Dict[str, List[str]]:
     with open(path, 'r') as f:
         return json.load(f)
@@ -1,13 +1,97 @@
-import copy
+import heapq
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Tuple, Optional
 
 from . import mapping
-from .mapping import Solution, Cache, Unmutables
+from .mapping import Solution, Cache, Unmutables, AvailablePairs
 from .suggestions import mapping_suggestions_wrapper
 
 root = Path(__file__).resolve().parent.parent.parent
 
+SOLUTIONS_TO_RETURN = 10
+# the scores are rounded to 3 digits in each step, so the bound is kept with this margin.
+BOUND_MARGIN = 0.001
+
+
+def visit(base: List[str], target: List[str], solutions: List[Solution], curr_solution: Solution, cache: Dict[str, Cache]) -> bool:
+    # returns False if this node already seen in different variation
+    if not curr_solution.actual_base:
+        return True
+    if curr_solution.relations_key in cache["relations"]:
+        return False
+    if curr_solution.mapping_key in cache["mappings"]:
+        return False
+
+    # the following sets using only for quick exists-check.
+    cache["relations"].add(curr_solution.relations_key)
+    cache["mappings"].add(curr_solution.mapping_key)
+    curr_solution.mapping = [f"{b} --> {t}" for b, t in zip(curr_solution.actual_base, curr_solution.actual_target)]
+    # new solution. curr_solution is changed while going over the tree, so we keep a copy of it.
+    # in the end we will sort by the length and the score. So its ok to add all solutions
+    solutions.append(curr_solution.copy())
+    cache["progress"].set_max("depth", len(curr_solution.actual_base))
+    cache["progress"].add_solution(solutions[-1])
+    return True
+
+
+def apply_result(curr_solution: Solution, result: Dict, modified_results: List[Dict], cache: Dict[str, Cache]) -> Tuple:
+    # going down in the tree, curr_solution is changed in place.
+    # returns what needed for restoring it when going back (see undo_result).
+    undo = (len(curr_solution.actual_base), curr_solution.score, curr_solution.availables, curr_solution.sorted_results, curr_solution.length, curr_solution.mapping, curr_solution.mapping_key, curr_solution.relations_key)
+    encoder = cache["encoder"]
+    curr_solution.relations.append(result["best_mapping"])
+    curr_solution.relations_key |= encoder.get_relation_bit(result["best_mapping"])
+    curr_solution.scores.append(round(result["best_score"], 3))
+    curr_solution.coverage.append(result["coverage"])
+
+    # we will add the new mapping to the already mapping lists. They must be in the same shape.
+    b1, b2 = result["best_mapping"][0][0], result["best_mapping"][0][1]
+    t1, t2 = result["best_mapping"][1][0], result["best_mapping"][1][1]
+    score = 0
+    if b1 not in curr_solution.actual_indecies['base'] and t1 not in curr_solution.actual_indecies['target']:
+        score += mapping.get_score(curr_solution.actual_base, curr_solution.actual_target, b1, t1, cache["scores"])
+        mapping.update_already_mapping(b1, t1, curr_solution.actual_base, curr_solution.actual_target, curr_solution.actual_indecies)
+        curr_solution.mapping_key |= encoder.get_mapping_bit(b1, t1)
+
+    if b2 not in curr_solution.actual_indecies['base'] and t2 not in curr_solution.actual_indecies['target']:
+        score += mapping.get_score(curr_solution.actual_base, curr_solution.actual_target, b2, t2, cache["scores"])
+        mapping.update_already_mapping(b2, t2, curr_solution.actual_base, curr_solution.actual_target, curr_solution.actual_indecies)
+        curr_solution.mapping_key |= encoder.get_mapping_bit(b2, t2)
+
+    curr_solution.score += round(score, 3)
+
+    # here we update the possible/available pairs.
+    # for example, if we already map a->1, b->2, we will looking only for pairs which respect the 
+    # pairs that already maps. in our example it can be one of the following:
+    # (a->1, c->3) or (b->2, c->3).
+    curr_solution.availables = mapping.update_paris_map(curr_solution.availables, curr_solution.actual_base, curr_solution.actual_target, curr_solution.actual_indecies)
+    curr_solution.length = len(curr_solution.actual_base)
+    curr_solution.sorted_results = modified_results
+    return undo
+
+
+def undo_result(curr_solution: Solution, undo: Tuple):
+    length, curr_solution.score, curr_solution.availables, curr_solution.sorted_results, curr_solution.length, curr_solution.mapping, curr_solution.mapping_key, curr_solution.relations_key = undo
+    curr_solution.relations.pop()
+    curr_solution.scores.pop()
+    curr_solution.coverage.pop()
+    for b, t in zip(curr_solution.actual_base[length:], curr_solution.actual_target[length:]):
+        del curr_solution.actual_indecies['base'][b]
+        del curr_solution.actual_indecies['target'][t]
+    del curr_solution.actual_base[length:]
+    del curr_solution.actual_target[length:]
+
+
+def get_upper_bound(curr_solution: Solution, full_length: int) -> float:
+    # each two entities that mapped are adding the score of their pair mapping (b_i:b_j~t_i:t_j).
+    # all the pairs that will be added under this node are from the available pairs, 
+    # so non of them is better than the best one in sorted_results (it is sorted by the score).
+    if not curr_solution.sorted_results:
+        return curr_solution.score
+    length = len(curr_solution.actual_base)
+    remaining_pairs = full_length * (full_length - 1) // 2 - length * (length - 1) // 2
+    return curr_solution.score + remaining_pairs * max(curr_solution.sorted_results[0]["best_score"], 0)
+
 
 def dfs(
     base: List[str], 
@@ -17,70 +101,63 @@ def dfs(
     cache: Dict[str, Cache],
     args: dict):
 
-    if curr_solution.actual_base:
-        # first we will check if this node already seen in different variation
-        relations_as_tuple = tuple([tuple(relation) for relation in sorted(curr_solution.relations)])
-        if relations_as_tuple in cache["relations"]:
-            return
-        mapping_repr = [f"{b} --> {t}" for b, t in zip(curr_solution.actual_base, curr_solution.actual_target)]
-        mapping_repr_as_tuple = tuple(sorted(mapping_repr))
-        if mapping_repr_as_tuple in cache["mappings"]:
-            return
-        
-        # the following sets using only for quick exists-check.
-        cache["relations"].add(relations_as_tuple)
-        cache["mappings"].add(mapping_repr_as_tuple)
-        curr_solution.mapping = mapping_repr
-        # new solution
-        # in the end we will sort by the length and the score. So its ok to add all solutions
-        solutions.append(curr_solution)
-
-    # base case for recursive function. there is no more available pairs to match (base->target)
-    if len(curr_solution.actual_base) == min(len(base), len(target)):
-        return
-
-    # we will get the top-depth pairs with the best score.
-    best_results_for_current_iteration, modified_results = mapping.get_best_pair_mapping_for_current_iteration(curr_solution.availables, curr_solution.sorted_results, args["N"])
-    for result in best_results_for_current_iteration:
+    # the tree is traversed with an explicit stack (in the same order of the recursive traversal), 
+    # and there is only one solution that changed when going down and restored when going back.
+    full_length = min(len(base), len(target))
+
+    # a node can be skipped if all the solutions under it are worse than SOLUTIONS_TO_RETURN full solutions we already have.
+    # they cannot be in the returned solutions, but the suggestions are looking on all the visited mappings (cache["mappings"]), 
+    # so it is used only when there will be no suggestions (we dont look for suggestions if the best solution is full).
+    use_bound = args.get("num_of_suggestions", 0) == 0 or len(base) == len(target)
+    best_full_scores: List[float] = []  # min-heap of the best scores of the full solutions
+
+    def expand() -> Optional[list]:
+        # returns the frame of the current node, or None if we dont need to go over its children.
+        if curr_solution.actual_base:
+            if use_bound and curr_solution.length == full_length:
+                if len(best_full_scores) < SOLUTIONS_TO_RETURN:
+                    heapq.heappush(best_full_scores, curr_solution.score)
+                else:
+                    heapq.heappushpop(best_full_scores, curr_solution.score)
+
+        # base case. there is no more available pairs to match (base->target)
+        if len(curr_solution.actual_base) == full_length:
+            return None
+
+        if use_bound and len(best_full_scores) == SOLUTIONS_TO_RETURN:
+            if get_upper_bound(curr_solution, full_length) + BOUND_MARGIN < best_full_scores[0]:
+                return None
+
+        # we will get the top-depth pairs with the best score.
+        best_results_for_current_iteration, modified_results = mapping.get_best_pair_mapping_for_current_iteration(curr_solution.availables, curr_solution.sorted_results, args["N"])
+        # frame: the children results, the results for the next iteration, and the undo of the child we are in.
+        return [iter(best_results_for_current_iteration), modified_results, None]
+
+    stack = []
+    if visit(base, target, solutions, curr_solution, cache):
+        frame = expand()
+        if frame:
+            stack.append(frame)
+
+    while stack:
+        frame = stack[-1]
+        if frame[2] is not None:
+            # going back from the previous child
+            undo_result(curr_solution, frame[2])
+            frame[2] = None
+        result = next(frame[0], None)
+        if result is None:
+            stack.pop()
+            continue
+
         # if the best score is > 0, we will update the base and target lists of the already mapping entities.
         # otherwise, if the best score is 0, we have no more mappings to do.
         if result["best_score"] > 0:
-            # deepcopy is more safe when working with recursive functions
-            solution_copy = copy.deepcopy(curr_solution)
-            solution_copy.relations.append(result["best_mapping"])
-            solution_copy.scores.append(round(result["best_score"], 3))
-            solution_copy.coverage.append(result["coverage"])
-
-            # we will add the new mapping to the already mapping lists. They must be in the same shape.
-            b1, b2 = result["best_mapping"][0][0], result["best_mapping"][0][1]
-            t1, t2 = result["best_mapping"][1][0], result["best_mapping"][1][1]
-            score = 0
-            if b1 not in solution_copy.actual_base and t1 not in solution_copy.actual_target:
-                score += mapping.get_score(solution_copy.actual_base, solution_copy.actual_target, b1, t1, cache["scores"])
-                mapping.update_already_mapping(b1, t1, solution_copy.actual_base, solution_copy.actual_target, solution_copy.actual_indecies)
-
-            if b2 not in solution_copy.actual_base and t2 not in solution_copy.actual_target:
-                score += mapping.get_score(solution_copy.actual_base, solution_copy.actual_target, b2, t2, cache["scores"])
-                mapping.update_already_mapping(b2, t2, solution_copy.actual_base, solution_copy.actual_target, solution_copy.actual_indecies)
-            
-            solution_copy.score += round(score, 3)
-            
-            # here we update the possible/available pairs.
-            # for example, if we already map a->1, b->2, we will looking only for pairs which respect the 
-            # pairs that already maps. in our example it can be one of the following:
-            # (a->1, c->3) or (b->2, c->3).
-            solution_copy.availables = mapping.update_paris_map(solution_copy.availables, solution_copy.actual_base, solution_copy.actual_target, solution_copy.actual_indecies)
-            solution_copy.length = len(solution_copy.actual_base)
-            solution_copy.sorted_results = modified_results
-            
-            dfs(
-                base=base, 
-                target=target,
-                solutions=solutions,
-                curr_solution=solution_copy,
-                cache=cache,
-                args=args
-            )
+            frame[2] = apply_result(curr_solution, result, frame[1], cache)
+            if visit(base, target, solutions, curr_solution, cache):
+                child_frame = expand()
+                if child_frame:
+                    stack.append(child_frame)
 
 
 def dfs_wrapper(
@@ -96,9 +173,11 @@ def dfs_wrapper(
 
     # better to init all the objects here, since they are not changed in the run
     mapping.set_unmutables(unmutables, args)
+    mapping.prefetch_entities_relations(unmutables["data_collector"], base, target)
 
-    cache = {"scores": {}, "mappings": set(), "relations": set()}
-    best_results = mapping.get_best_pair_mapping(unmutables, available_pairs, cache)
+    cache = mapping.get_cache(progress=args.get("progress"), events=args.get("events"))
+    best_results = mapping.get_best_pair_mapping(unmutables, available_pairs, cache, workers=args.get("workers", 1))
+    cache["progress"].emit("pairs", best_results)
     initial_solution = Solution(
                             mapping=[], 
                             relations=[], 
@@ -110,7 +189,7 @@ def dfs_wrapper(
                             length=0,
                             coverage=[],
                             sorted_results=best_results,
-                            availables=copy.deepcopy(available_pairs)
+                            availables=AvailablePairs(available_pairs)
                         )
     
     # this is an array of solutions we going to update in the mapping function.
@@ -129,11 +208,11 @@ def dfs_wrapper(
                                                         args,
                                                         unmutables,
                                                         cache)
+    cache["progress"].emit("suggestions", suggestions_solutions)
 
     all_solutions = sorted(solutions + suggestions_solutions, key=lambda x: (x.length, x.score), reverse=True)
-    solutions_to_return_and_print = 10
-    all_solutions = all_solutions[:solutions_to_return_and_print]
+    all_solutions = all_solutions[:SOLUTIONS_TO_RETURN]
     if args["verbose"]:
         mapping.print_results(base, target, all_solutions) 
 
-    return all_solutions
\ No newline at end of file
+    return all_solutions
@@ -2,21 +2,129 @@ import re
 import os
 import time
 import json
+import threading
 from pathlib import Path
-from typing import List, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Optional, Iterator, TYPE_CHECKING
 
 import inflect
-import requests
 from click import secho
 
+if TYPE_CHECKING:
+    import requests
+
 root = Path(__file__).resolve().parent.parent.parent
 
 IGNORE = ["a"]
+QUESTIONS = ["why do", "why is", "why does", "why does it",  "why did", "how do", "how is", "how does", "how does it", "how did"]
+
+SUGGEST_URL = os.environ.get('GOOGLE_SUGGEST_URL', "http://suggestqueries.google.com/complete/search")
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('GOOGLE_MAX_CONCURRENT_REQUESTS', 8))
+# on average, the same pace as sleeping 0.1 seconds before each request
+REQUESTS_PER_SECOND = float(os.environ.get('GOOGLE_REQUESTS_PER_SECOND', 10))
+REQUESTS_BURST = int(os.environ.get('GOOGLE_REQUESTS_BURST', 10))
+
+Pair = Tuple[str, str]
 
 def read_json(path: str) -> dict:
     with open(path, 'r') as f:
         return json.load(f)
 
+
+class TokenBucket(object):
+    """
+    Rate limit of `rate` requests per second on average, allowing bursts of up to `capacity` requests.
+    """
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Fetcher(object):
+    """
+    Sends the autosuggest requests concurrently (up to max_workers), over a pool of connections that are reused
+    between the requests, and under the rate limit of a token bucket.
+    The first 403 sets SKIP_GOOGLE, and from then on the requests that are still waiting are not sent at all
+    (only the ones that were already on the way can still reach google).
+    """
+    def __init__(self, 
+                url: str = SUGGEST_URL, 
+                max_workers: int = MAX_CONCURRENT_REQUESTS, 
+                rate: float = REQUESTS_PER_SECOND, 
+                capacity: int = REQUESTS_BURST):
+        # requests is imported only when google is really asked.
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.url = url
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.bucket = TokenBucket(rate, capacity)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def get_url(self, query: str) -> str:
+        return f"{self.url}?{query}"
+
+    def fetch(self, query: str) -> Optional['requests.Response']:
+        # returns None if the request was not sent (google already blocked us)
+        if 'SKIP_GOOGLE' in os.environ:
+            return None
+        self.bucket.acquire()
+        if 'SKIP_GOOGLE' in os.environ:
+            return None
+        response = self.session.get(self.get_url(query))
+        if response.status_code == 403:
+            # google blocked us, the other workers should stop right now and not when the responses are read.
+            secho(f"[WARNING] cannot access to {self.get_url(query)}", fg="yellow", bold=True)
+            os.environ['SKIP_GOOGLE'] = 'true'
+        return response
+
+    def fetch_many(self, queries: List[str]) -> Iterator[Optional['requests.Response']]:
+        # all the requests are sent at once, the responses are returned in the order of the queries.
+        return self.executor.map(self.fetch, queries)
+
+
+fetcher: Optional[Fetcher] = None
+fetcher_lock = threading.Lock()
+
+
+def get_fetcher() -> Fetcher:
+    global fetcher
+    with fetcher_lock:
+        if fetcher is None:
+            fetcher = Fetcher()
+        return fetcher
+
+
+def is_blocked(response: Optional['requests.Response']) -> bool:
+    # the request was not sent because google already blocked us, or this is the request that google blocked.
+    return response is None or response.status_code == 403
+
+
+def read_response(query: str, response: Optional['requests.Response'] = None) -> Optional[List[str]]:
+    # returns the suggestions of google, or None if google blocked us (fetch already warned about it).
+    if response is None:
+        response = get_fetcher().fetch(query)
+    if is_blocked(response):
+        return None
+    return json.loads(response.text)[1]
+
 class GoogleAutoSuggestEntityProps(object):
     def __init__(self,
                 entity: str,
@@ -32,15 +140,10 @@ class GoogleAutoSuggestEntityProps(object):
     def init_suggestions(self) -> List[Tuple[str]]:
         sugges: List[str] = []
         keyword = f"{self.entity} {self.prop}".replace(" ", "+")
-        url = f"http://suggestqueries.google.com/complete/search?client={self.browser}&q={keyword}&hl=en"
-        time.sleep(0.1)
-        response = requests.get(url)
-        if response.status_code == 403:
-            secho(f"[WARNING] cannot access to {url}", fg="yellow", bold=True)
-            os.environ['SKIP_GOOGLE'] = 'true'
+        suggestions = read_response(f"client={self.browser}&q={keyword}&hl=en")
+        if suggestions is None:
             return []
         
-        suggestions = json.loads(response.text)[1]
         for suggestion in suggestions:
             match = re.match(self.regex, suggestion)
             if match:
@@ -58,27 +161,25 @@ class GoogleAutoSuggestOneEntity(object):
                 pattern1: str = '%s %s %s',
                 pattern2: str = '%s .* %s %s',
                 regex1: str = '%s %s %s (.*)',
-                regex2: str = '%s (.*) %s %s'):
+                regex2: str = '%s (.*) %s %s',
+                fetch: bool = True):
         self.entity = entity
         self.prop = prop
         self.browser = browser
         self.keywords = [pattern1 % (question, entity, prop), pattern2 % (question, prop, entity)]
         self.regexs = [regex1 % (question, prop, entity), regex2 % (question, prop, entity)] 
-        self.suggestinos = self.init_suggestions()
+        self.queries = [f"client={self.browser}&q={keyword.replace(' ', '+')}&hl=en" for keyword in self.keywords]
+        # without fetch, the queries are sent by the caller (together with other queries) and it calls init_suggestions with the responses.
+        self.suggestinos = self.init_suggestions() if fetch else []
 
-    def init_suggestions(self) -> List[Tuple[str]]:
+    def init_suggestions(self, responses: Optional[List[Optional['requests.Response']]] = None) -> List[Tuple[str]]:
+        responses = responses or [None] * len(self.queries)
         sugges: List[str] = []
-        for keyword_, regex_ in zip(self.keywords, self.regexs):
-            keyword = keyword_.replace(" ", "+")
-            url = f"http://suggestqueries.google.com/complete/search?client={self.browser}&q={keyword}&hl=en"
-            time.sleep(0.1)
-            response = requests.get(url)
-            if response.status_code == 403:
-                secho(f"[WARNING] cannot access to {url}", fg="yellow", bold=True)
-                os.environ['SKIP_GOOGLE'] = 'true'
+        for query, regex_, response in zip(self.queries, self.regexs, responses):
+            suggestions = read_response(query, response)
+            if suggestions is None:
                 return []
         
-            suggestions = json.loads(response.text)[1]
             for suggestion in suggestions:
                 match = re.match(regex_, suggestion)
                 if match:
@@ -93,30 +194,27 @@ class GoogleAutoSuggestTwoEntities(object):
                 entity2: str, 
                 browser: str = 'chrome',
                 pattern: str = '%s %s .* %s', 
-                regex: str = '^%s( a)?( an)?( the)? %s (.*) %s$'):
+                regex: str = '^%s( a)?( an)?( the)? %s (.*) %s$',
+                fetch: bool = True):
         self.question = question
         self.entity1 = entity1
         self.entity2 = entity2
         self.browser = browser
         self.keyword = pattern % (question, entity1, entity2)
         self.regex = regex % (question, entity1, entity2)
-        self.suggestions: List[Tuple[str]] = self.init_suggestions()
+        curser = len(self.question) + len(self.entity1) + 2
+        language = 'en'
+        self.query = f"client={self.browser}&q={self.keyword.replace(' ', '+')}&hl={language}&cp={curser}"
+        # without fetch, the query is sent by the caller (together with other queries) and it calls init_suggestions with the response.
+        self.suggestions: List[Tuple[str]] = self.init_suggestions() if fetch else []
 
-    def init_suggestions(self) -> List[Tuple[str]]:
+    def init_suggestions(self, response: Optional['requests.Response'] = None) -> List[Tuple[str]]:
         already_seen = set()
         sugges: List[Tuple[str]] = []
-        keyword = self.keyword.replace(" ", "+")
-        curser = len(self.question) + len(self.entity1) + 2
-        language = 'en'
-        url = f"http://suggestqueries.google.com/complete/search?client={self.browser}&q={keyword}&hl={language}&cp={curser}"
-        time.sleep(0.1)
-        response = requests.get(url)
-        if response.status_code == 403:
-            secho(f"[WARNING] cannot access to {url}", fg="yellow", bold=True)
-            os.environ['SKIP_GOOGLE'] = 'true'
+        suggestions = read_response(self.query, response)
+        if suggestions is None:
             return []
         
-        suggestions = json.loads(response.text)[1]
         for suggestion in suggestions:
             match = re.match(self.regex, suggestion)
             if match:
@@ -165,66 +263,75 @@ class GoogleAutoSuggestTwoEntities(object):
         secho(f"{spaces}--> ({self.keyword})")
 
 
-def extend_suggestions(entity1: str, entity2: str, question: str, suggestions: List[Tuple[str]], verbose: bool):
-    googleAC = GoogleAutoSuggestTwoEntities(question, entity1, entity2)
-    if 'SKIP_GOOGLE' in os.environ:
-        return
+def add_suggestions(googleAC: GoogleAutoSuggestTwoEntities, suggestions: Dict[str, List[str]], verbose: bool):
     for suggestion in googleAC.suggestions:
         if suggestion[0] not in suggestions["suggestions"] and suggestion[1] not in suggestions["props"]:
             if verbose:
                 googleAC.render_single_suggestion(suggestion)
+            # we want the whole suggestion and not only the prop for better visualization and debugging
             suggestions["suggestions"].append(suggestion[0])
             suggestions["props"].append(suggestion[1])
 
 
-def extend_to_plural_and_singular(engine: inflect.engine, entity1: str, entity2: str, question: str, suggestions: List[Tuple[str]], verbose: bool = False):
+def get_plural_and_singular(engine: inflect.engine, entity1: str, entity2: str) -> List[Pair]:
+    entities = []
     # extend the first entity
     plural = engine.plural(entity1)
     if plural:
-        extend_suggestions(plural, entity2, question, suggestions, verbose)
+        entities.append((plural, entity2))
 
     singular = engine.singular_noun(entity1)
     if singular:
-        extend_suggestions(singular, entity2, question, suggestions, verbose)
+        entities.append((singular, entity2))
 
     # extend the second entity
     plural = engine.plural(entity2)
     if plural:
-        extend_suggestions(entity1, plural, question, suggestions, verbose)
+        entities.append((entity1, plural))
 
     singular = engine.singular_noun(entity2)
     if singular:
-        extend_suggestions(entity1, singular, question, suggestions, verbose)
+        entities.append((entity1, singular))
+    return entities
 
 
 def get_entity_suggestions(entity: str, prop: str, plural_and_singular: bool = False):
     # given an entity and prop, it will suggest new entities to complete the sentence.
     # for example, given entity 'electricity' and prop 'discovered', it will return entities like: faraday, edison, benjamin
+    return get_entity_suggestions_batch(entity, [prop], plural_and_singular=plural_and_singular).get(prop, [])
+
+
+def get_entity_suggestions_batch(entity: str, props: List[str], plural_and_singular: bool = False) -> Dict[str, List[str]]:
+    # the suggestions of all the props of the entity, the queries of all of them are sent together.
+    # if google blocked us, the props after the blocked one are missing from the result.
+    if 'SKIP_GOOGLE' in os.environ:
+        return {}
+    entities = [entity]
     if plural_and_singular: 
         engine = inflect.engine()
-    suggestions = []
-    for question in ["why do", "why is", "why does", "why does it",  "why did", "how do", "how is", "how does", "how does it", "how did"]:
-        # time.sleep(1) # google policy
-        model = GoogleAutoSuggestOneEntity(question, entity, prop)
-        if 'SKIP_GOOGLE' in os.environ:
-            return list(set(suggestions))
-        suggestions.extend(model.suggestinos)
-        if plural_and_singular:
-            plural = engine.plural(entity)
-            if plural and plural != entity:
-                model = GoogleAutoSuggestOneEntity(question, plural, prop)
-                if 'SKIP_GOOGLE' in os.environ:
-                    return list(set(suggestions))
-                suggestions.extend(model.suggestinos)
-
-            singular = engine.singular_noun(entity)
-            if singular and singular != plural and singular != entity:
-                model = GoogleAutoSuggestOneEntity(question, singular, prop)
-                if 'SKIP_GOOGLE' in os.environ:
-                    return list(set(suggestions))
-                suggestions.extend(model.suggestinos)
-
-    return list(set(suggestions))
+        plural = engine.plural(entity)
+        if plural and plural != entity:
+            entities.append(plural)
+        singular = engine.singular_noun(entity)
+        if singular and singular != plural and singular != entity:
+            entities.append(singular)
+
+    props = list(dict.fromkeys(props))
+    models = {prop: [GoogleAutoSuggestOneEntity(question, entity_, prop, fetch=False) for question in QUESTIONS for entity_ in entities] for prop in props}
+    # the responses are read in the order of the queries.
+    responses = get_fetcher().fetch_many([query for prop in props for model in models[prop] for query in model.queries])
+    props_suggestions = {}
+    for prop in props:
+        suggestions = []
+        for model in models[prop]:
+            model_responses = [next(responses) for _ in model.queries]
+            model.suggestinos = model.init_suggestions(model_responses)
+            if any(is_blocked(response) for response in model_responses):
+                props_suggestions[prop] = list(set(suggestions))
+                return props_suggestions
+            suggestions.extend(model.suggestinos)
+        props_suggestions[prop] = list(set(suggestions))
+    return props_suggestions
 
 
 # def get_entity_props(entity: str):
@@ -242,45 +349,57 @@ def get_entity_suggestions(entity: str, prop: str, plural_and_singular: bool = F
 #     return google_db[entity]
 
 
+def get_questions(entity1: str, entity2: str) -> Dict[str, List[str]]:
+    return {question: [entity1, entity2] for question in QUESTIONS}
+
+
 def get_entities_relations(entity1: str, entity2: str, plural_and_singular: bool = True, verbose: bool = False) -> Dict[str, List[str]]:
     # given two entities, it will give the relations between them.
     # The order is important! get_entities_relations(entity1, entity2) != get_entities_relations(entity2, entity1)
     # for example, if entity1=earth, entity2=sun, it will return relations like: revolve around, not fall into, orbit.
-    d = {
-        "why do": [entity1, entity2],
-        "why is": [entity1, entity2],
-        "why does": [entity1, entity2],
-        "why does it": [entity1, entity2],
-        "why did": [entity1, entity2],
-        "how do": [entity1, entity2],
-        "how is": [entity1, entity2],
-        "how does": [entity1, entity2],
-        "how does it": [entity1, entity2],
-        "how did": [entity1, entity2],
-    }
-    return process(d, plural_and_singular=plural_and_singular, verbose=verbose)
+    return process(get_questions(entity1, entity2), plural_and_singular=plural_and_singular, verbose=verbose)
+
+
+def get_entities_relations_batch(pairs: List[Pair], plural_and_singular: bool = True, verbose: bool = False) -> Dict[Pair, Dict[str, List[str]]]:
+    # the same as get_entities_relations for each pair, but the queries of all the pairs are sent together.
+    pairs = list(dict.fromkeys(pairs))
+    results = process_batch([get_questions(entity1, entity2) for entity1, entity2 in pairs], plural_and_singular=plural_and_singular, verbose=verbose)
+    return dict(zip(pairs, results))
 
 
 def process(d: Dict[str, List[List[str]]], plural_and_singular: bool = True, verbose: bool = False) -> Dict[str, List[str]]:
+    return process_batch([d], plural_and_singular=plural_and_singular, verbose=verbose)[0]
+
+
+def process_batch(ds: List[Dict[str, List[List[str]]]], plural_and_singular: bool = True, verbose: bool = False) -> List[Dict[str, List[str]]]:
+    # all the queries of all the dicts are sent together. The responses are read in the order the queries 
+    # used to be sent one by one, so the suggestions (and when we stop because google blocked us) are the same.
     engine = inflect.engine()
-    suggestions = {"suggestions": [], "props": []}
-    for question, objects in d.items():
-        if verbose:
+    results = [{"suggestions": [], "props": []} for _ in ds]
+    if 'SKIP_GOOGLE' in os.environ:
+        return results
+
+    models: List[Tuple[int, str, GoogleAutoSuggestTwoEntities]] = []
+    for i, d in enumerate(ds):
+        for question, objects in d.items():
+            entity1, entity2 = objects
+            entities = [(entity1, entity2)]
+            if plural_and_singular:
+                entities += get_plural_and_singular(engine, entity1, entity2)
+            for entity1_, entity2_ in entities:
+                models.append((i, question, GoogleAutoSuggestTwoEntities(question, entity1_, entity2_, fetch=False)))
+
+    responses = get_fetcher().fetch_many([googleAC.query for _, _, googleAC in models])
+    last_question = None
+    for (i, question, googleAC), response in zip(models, responses):
+        if verbose and (i, question) != last_question:
             secho(f"\n[INFO] collect information on question '{question}'", fg="blue")
-        entity1, entity2 = objects
-        googleAC = GoogleAutoSuggestTwoEntities(question, entity1, entity2)
-        if 'SKIP_GOOGLE' in os.environ:
-            return suggestions
-        for suggestion in googleAC.suggestions:
-            if suggestion[0] not in suggestions["suggestions"] and suggestion[1] not in suggestions["props"]:
-                if verbose:
-                    googleAC.render_single_suggestion(suggestion)
-                # we want the whole suggestion and not only the prop for better visualization and debugging
-                suggestions["suggestions"].append(suggestion[0])
-                suggestions["props"].append(suggestion[1])
-        if plural_and_singular:
-            extend_to_plural_and_singular(engine, entity1, entity2, question, suggestions, verbose=verbose)
-    return suggestions
+            last_question = (i, question)
+        googleAC.suggestions = googleAC.init_suggestions(response)
+        if is_blocked(response):
+            break
+        add_suggestions(googleAC, results[i], verbose)
+    return results
 
 
 if __name__ == '__main__':
@@ -3,19 +3,28 @@ import os
 import json
 import time
 import inflect
+import threading
 from pathlib import Path
+from typing import List, Dict, Tuple, Optional
 
-import openai
-from openai.error import AuthenticationError
 from tqdm import tqdm
 
+from .cache_store import get_cache_store
+
 BACKEND_DIR = Path(__file__).resolve().parent.parent
 EVALUATION_FOLDER = BACKEND_DIR / 'evaluation'
 DATABASE_FOLDER = BACKEND_DIR / 'database'
 
+Pair = Tuple[str, str]
+
+# the completions of gpt3 are loaded once from the cache store and kept in memory. The new ones are written
+# to the store in the background (it commits every few writes), and together at the end of a batch or on exit.
+completions: Optional[Dict[Pair, List[str]]] = None
+# the relations after the post-processing of the completions (see get_entities_relations)
+relations_memo: Dict[Pair, List[str]] = {}
+lock = threading.RLock()
+
 OPENAI_API_KEY= os.environ.get("OPENAI_API_KEY", "")
-if 'CI' not in os.environ:
-    openai.api_key = OPENAI_API_KEY
 
 prompt = [
     "Q: What are the relations between blizzard and snowflake?",
@@ -45,34 +54,45 @@ prompt = [
     ""
 ]
 
-def get_entities_relations(entity1: str, entity2: str, engine: inflect.engine):
-    db_file = DATABASE_FOLDER / 'gpt3_edges.json'
-    with open(db_file, 'r') as f:
-        content = json.load(f)
-
-    should_save = False
-    if f"{entity1}#{entity2}" not in content:
-        content[f"{entity1}#{entity2}"] = get_entities_relations_api(entity1, entity2)
-        should_save = True
+def get_completions(entity1: str, entity2: str) -> List[str]:
+    global completions
+    cache_store = get_cache_store()
+    with lock:
+        if completions is None:
+            completions = cache_store.get_source('gpt3_edges')
+        if (entity1, entity2) in completions:
+            return completions[(entity1, entity2)]
+
+    # maybe another process already asked
+    relations = cache_store.get('gpt3_edges', entity1, entity2)
+    if relations is None:
+        relations = get_entities_relations_api(entity1, entity2)
+        cache_store.set('gpt3_edges', entity1, entity2, relations)
         time.sleep(0.1)
+    with lock:
+        completions[(entity1, entity2)] = relations
+    return relations
 
-    if f"{entity2}#{entity1}" not in content:
-        content[f"{entity2}#{entity1}"] = get_entities_relations_api(entity2, entity1)
-        should_save = True
-        time.sleep(0.1)
 
-    if f"{entity2}#{entity1}" not in content:
-        content[f"{entity2}#{entity1}"] = get_entities_relations_api(entity2, entity1)
-        should_save = True
-        time.sleep(1)
+def get_entities_relations_batch(pairs: List[Pair], engine: inflect.engine) -> Dict[Pair, List[str]]:
+    try:
+        return {(entity1, entity2): get_entities_relations(entity1, entity2, engine) for entity1, entity2 in pairs}
+    finally:
+        get_cache_store().commit()
+
+
+def get_entities_relations(entity1: str, entity2: str, engine: inflect.engine):
+    with lock:
+        if (entity1, entity2) in relations_memo:
+            return list(relations_memo[(entity1, entity2)])
 
-    if should_save:
-        with open(db_file, 'w') as fw:
-            json.dump(content, fw, indent='\t')
+    relations = {}
+    for e1, e2 in [(entity1, entity2), (entity2, entity1)]:
+        relations[(e1, e2)] = get_completions(e1, e2)
 
     relation_as_set = set()
-    relations = list(set(content[f"{entity1}#{entity2}"] + content[f"{entity2}#{entity1}"]))
-    # relations = list(set(content[f"{entity1}#{entity2}"]))
+    relations = list(set(relations[(entity1, entity2)] + relations[(entity2, entity1)]))
+    # relations = list(set(relations[(entity1, entity2)]))
     for relation in relations:
         relation = relation.lower()
         match = re.search(f'{entity1} (.*?) {entity2}', relation, flags=re.IGNORECASE)
@@ -97,11 +117,22 @@ def get_entities_relations(entity1: str, entity2: str, engine: inflect.engine):
                     if relation:
                         relation_as_set.add(relation)
     
-    return sorted(list(relation_as_set))
+    with lock:
+        relations_memo[(entity1, entity2)] = sorted(list(relation_as_set))
+        return list(relations_memo[(entity1, entity2)])
+
+
 
+def get_openai():
+    # openai is slow to import, so it is imported only when gpt3 is really asked (the relations are not in the cache).
+    import openai
+    if 'CI' not in os.environ:
+        openai.api_key = OPENAI_API_KEY
+    return openai
 
 
 def get_entities_relations_api(entity1: str, entity2: str):
+    openai = get_openai()
     question = [f"Q: What are the relations between {entity1} and {entity2}?"]
     prompt_s =  "\n".join(prompt + question)
     try:
@@ -114,7 +145,7 @@ def get_entities_relations_api(entity1: str, entity2: str):
             frequency_penalty=0,
             presence_penalty=0
         )
-    except AuthenticationError as e:
+    except openai.error.AuthenticationError as e:
         raise e
         
     relations = []
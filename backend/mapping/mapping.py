@@ -1,7 +1,11 @@
 import os
+import copy
 from pathlib import Path
-from itertools import combinations
-from typing import List, Dict, Tuple, Union, Set, Callable
+from functools import partial
+from itertools import combinations, permutations
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from typing import List, Dict, Tuple, Union, Set, Callable, Iterator, Iterable, Optional, Any
 
 from tqdm import tqdm
 from click import secho
@@ -10,14 +14,14 @@ from utils import utils
 from .quasimodo import Quasimodo
 from frequency.frequency import Frequencies
 from .data_collector import DataCollector
+from .pair_scores import Context, get_pair_scores, get_pair_graphs, get_pair_props
 from utils.sentence_embadding import SentenceEmbedding
 
 Pair = Tuple[str, str] # two entities: (b1,b2)
 SingleMatch = List[Pair] # [(b1,b2), (t1,t2)]
 ScoreCache = Dict[Tuple[Tuple[str, str], Tuple[str, str]], float]
-MappingCache = Set[Tuple[Tuple[Pair]]]
-RelationCache = Set[Tuple[str]]
-Cache = Union[ScoreCache, MappingCache, RelationCache]
+MappingCache = Set[int] # bitmask of the mapped b->t (see Encoder)
+RelationCache = Set[int] # bitmask of the relations (see Encoder)
 Unmutables = Union[Quasimodo, DataCollector, SentenceEmbedding, Frequencies]
 
 root = Path(__file__).resolve().parent.parent.parent
@@ -28,6 +32,171 @@ DEFAULT_DIST_THRESHOLD_FOR_CLUSTERS = 0.5
 FREQUENCY_THRESHOLD = 500
 
 
+class Encoder(object):
+    """
+    Interning of the entities to small ints, and of the mapped entities (b->t) and the relations (b1:b2~t1:t2) to bits.
+    A mapping or a list of relations is kept in the search as a bitmask (int), so checking if we already seen it 
+    is hashing an int instead of sorting and hashing a tuple of strings.
+    """
+    def __init__(self):
+        self.entities: Dict[str, int] = {}
+        self.bits: Dict[Tuple[int, ...], int] = {}
+
+    def get_entity_id(self, entity: str) -> int:
+        entity_id = self.entities.get(entity)
+        if entity_id is None:
+            entity_id = self.entities[entity] = len(self.entities)
+        return entity_id
+    
+    def get_bit(self, key: Tuple[int, ...]) -> int:
+        bit = self.bits.get(key)
+        if bit is None:
+            bit = self.bits[key] = 1 << len(self.bits)
+        return bit
+
+    def get_mapping_bit(self, b: str, t: str) -> int:
+        return self.get_bit((self.get_entity_id(b), self.get_entity_id(t)))
+    
+    def get_relation_bit(self, relation: SingleMatch) -> int:
+        (b1, b2), (t1, t2) = relation
+        return self.get_bit((self.get_entity_id(b1), self.get_entity_id(b2), self.get_entity_id(t1), self.get_entity_id(t2)))
+    
+    def get_mapping_key(self, base: List[str], target: List[str]) -> int:
+        key = 0
+        for b, t in zip(base, target):
+            key |= self.get_mapping_bit(b, t)
+        return key
+    
+    def get_relations_key(self, relations: List[SingleMatch]) -> int:
+        key = 0
+        for relation in relations:
+            key |= self.get_relation_bit(relation)
+        return key
+
+
+class Progress(object):
+    """
+    Counters of a running search (how many pair mappings are scored, and the length of the longest mapping so far).
+    Every change is reported to the callback, the jobs of the app use it to show the progress of a long search.
+    The partial results (the pairs ranking, a better top solution, the suggestions) are sent to events, 
+    so the app can stream them before the search is finished.
+    """
+    def __init__(self, callback: Optional[Callable[[Dict[str, int]], None]] = None, events: Optional[Callable[[str, Any], None]] = None):
+        self.callback = callback
+        self.events = events
+        self.counters: Dict[str, int] = {"pairs_scored": 0, "depth": 0}
+        self.best: Optional[Tuple[int, float]] = None
+
+    def add(self, name: str, value: int = 1):
+        self.counters[name] += value
+        self.report()
+
+    def set_max(self, name: str, value: int):
+        if value > self.counters[name]:
+            self.counters[name] = value
+            self.report()
+
+    def report(self):
+        if self.callback:
+            self.callback(dict(self.counters))
+
+    def emit(self, name: str, data: Any):
+        if self.events:
+            self.events(name, data)
+
+    def add_solution(self, solution: 'Solution'):
+        # the solution is sent only if it is better than the best one so far (same order as the final sorting).
+        if self.events and (self.best is None or (solution.length, solution.score) > self.best):
+            self.best = (solution.length, solution.score)
+            self.emit("solution", solution)
+
+
+Cache = Union[ScoreCache, MappingCache, RelationCache, Encoder, Progress]
+
+
+class AvailablePairs(object):
+    """
+    The pairs mapping that still available for a solution (respecting the entities that already mapped).
+    The pairs are indexed by the entities they contain, so when new entities are mapped, only the pairs with them are checked again.
+    The pairs and the indexes are shared by all the AvailablePairs that updated from the same one (they are never changed),
+    each one holds only the ids of its available pairs, as the bits of an int (bit i is the pair i), so updating it 
+    is clearing the bits of the pairs that are not valid anymore. Iterating over it is in the original order of the pairs.
+    """
+    def __init__(self, pairs_map: List[List[SingleMatch]]):
+        self.pairs_map = pairs_map
+        # both directions of a pair have the same id
+        self.ids: Dict[Tuple[Pair, Pair], int] = {}
+        self.by_entity: Dict[str, Dict[str, List[int]]] = {'base': defaultdict(list), 'target': defaultdict(list)}
+        for i, pair in enumerate(pairs_map):
+            self.ids[tuple(pair[0])] = i
+            self.ids[tuple(pair[1])] = i
+            for b in pair[0][0]:
+                self.by_entity['base'][b].append(i)
+            for t in pair[0][1]:
+                self.by_entity['target'][t].append(i)
+        self.available = (1 << len(pairs_map)) - 1
+        self.count = len(pairs_map)
+        # the entities that the available pairs are respecting
+        self.mapped = {'base': frozenset(), 'target': frozenset()}
+    
+    def __iter__(self) -> Iterator[List[SingleMatch]]:
+        # the bits from the lowest one, so the pairs are in their original order
+        bits = bin(self.available)[:1:-1]
+        i = bits.find('1')
+        while i != -1:
+            yield self.pairs_map[i]
+            i = bits.find('1', i + 1)
+    
+    def __len__(self) -> int:
+        return self.count
+    
+    def __contains__(self, direction: SingleMatch) -> bool:
+        i = self.ids.get(tuple(direction))
+        return i is not None and self.is_available(i)
+    
+    def is_available(self, i: int) -> bool:
+        return (self.available >> i) & 1 == 1
+    
+    def containing(self, domain: str, entities: Iterable[str]) -> Set[int]:
+        # the ids of the pairs that contain one of the entities (domain is 'base' or 'target')
+        ids = set()
+        for entity in entities:
+            ids.update(self.by_entity[domain].get(entity, []))
+        return ids
+    
+    def select(self, ids: Iterable[int]) -> 'AvailablePairs':
+        selected = [i for i in set(ids) if self.is_available(i)]
+        available_pairs = copy.copy(self)
+        available_pairs.available = sum(1 << i for i in selected)
+        available_pairs.count = len(selected)
+        return available_pairs
+
+    def update(self, 
+               base_already_mapping: List[str], 
+               target_already_mapping: List[str], 
+               actual_mapping_indecies: Dict[str, Dict[str, int]]
+               ) -> 'AvailablePairs':
+        new_base = set(base_already_mapping) - self.mapped['base']
+        new_target = set(target_already_mapping) - self.mapped['target']
+        # a pair that not contains any of the new mapped entities is still available.
+        affected = [i for i in self.containing('base', new_base) | self.containing('target', new_target) if self.is_available(i)]
+        base_already_mapping_as_set = set(base_already_mapping)
+        target_already_mapping_as_set = set(target_already_mapping)
+        not_valid = [i for i in affected 
+                     if not check_if_valid(self.pairs_map[i][0], 
+                                           base_already_mapping, 
+                                           base_already_mapping_as_set, 
+                                           target_already_mapping, 
+                                           target_already_mapping_as_set, 
+                                           actual_mapping_indecies)
+                    ]
+        available_pairs = copy.copy(self)
+        available_pairs.available = self.available & ~sum(1 << i for i in not_valid)
+        available_pairs.count = self.count - len(not_valid)
+        available_pairs.mapped = {'base': frozenset(base_already_mapping_as_set), 'target': frozenset(target_already_mapping_as_set)}
+        return available_pairs
+
+
 class Solution:
     def __init__(self, 
                 mapping: List[str], 
@@ -39,8 +208,10 @@ class Solution:
                 actual_indecies: Dict[str, Dict[str, int]], 
                 length: int,
                 coverage: List[int],
-                availables: List[List[SingleMatch]] = None,
-                sorted_results: List[Dict[str, Union[int, SingleMatch]]] = None
+                availables: AvailablePairs = None,
+                sorted_results: List[Dict[str, Union[int, SingleMatch]]] = None,
+                mapping_key: int = 0,
+                relations_key: int = 0
                 ):
         self.mapping = mapping
         self.relations = relations
@@ -51,10 +222,34 @@ class Solution:
         self.actual_indecies = actual_indecies
         self.length = length
         self.top_suggestions = []
+        # the mapping and the relations as bitmasks, using for quick exists-check (see Encoder)
+        self.mapping_key = mapping_key
+        self.relations_key = relations_key
         self.availables = availables
         self.sorted_results = sorted_results
         self.coverage = coverage
     
+    def copy(self) -> 'Solution':
+        # the new solution shares availables and sorted_results with this one (they are never changed in place,
+        # only replaced), so only the small state of the solution itself is copied.
+        solution = Solution(
+            mapping=list(self.mapping),
+            relations=list(self.relations),
+            scores=list(self.scores),
+            score=self.score,
+            actual_base=list(self.actual_base),
+            actual_target=list(self.actual_target),
+            actual_indecies={'base': dict(self.actual_indecies['base']), 'target': dict(self.actual_indecies['target'])},
+            length=self.length,
+            coverage=list(self.coverage),
+            availables=self.availables,
+            sorted_results=self.sorted_results,
+            mapping_key=self.mapping_key,
+            relations_key=self.relations_key
+        )
+        solution.top_suggestions = list(self.top_suggestions)
+        return solution
+
     def get_actual(self, which: str):
         if which == 'actual_base':
             return self.actual_base
@@ -108,6 +303,12 @@ def get_edge_score(prop1: str, prop2: str, model: SentenceEmbedding, freq: Frequ
         return model.similarity(prop1, prop2)
 
 
+def get_similarity_edges(props_edge1: List[str], props_edge2: List[str], model: SentenceEmbedding, freq: Frequencies) -> List[Tuple[str, str, float]]:
+    # the weight of each edge between two nodes (same as get_edge_score), computed as one matrix.
+    similarities = utils.get_similarity_matrix(model, props_edge1, props_edge2, freq).tolist()
+    return [(prop1, prop2, similarities[i][j]) for i, prop1 in enumerate(props_edge1) for j, prop2 in enumerate(props_edge2)]
+
+
 def get_score(base: List[str], target: List[str], base_entity: str, target_entity: str, cache: ScoreCache) -> float:
     # we take the score of the new b->t with all the others. 
     # i.e. we will take the score of b_i:b~t_i:t.
@@ -155,20 +356,19 @@ def check_if_valid(first_direction: SingleMatch,
     return True
 
 
-def update_paris_map(pairs_map: List[List[SingleMatch]], 
+def update_paris_map(pairs_map: Union[AvailablePairs, List[List[SingleMatch]]], 
                      base_already_mapping: List[str], 
                      target_already_mapping: List[str], 
                      actual_mapping_indecies: Dict[str, Dict[str, int]]
-                     ) -> List[List[SingleMatch]]:
+                     ) -> AvailablePairs:
     # This is List[SingleMatch] because there is two directions. But actully this is SingleMatch.
-    return [mapping for mapping in pairs_map 
-            if check_if_valid(mapping[0], 
-                              base_already_mapping, 
-                              set(base_already_mapping), 
-                              target_already_mapping, 
-                              set(target_already_mapping), 
-                              actual_mapping_indecies)
-            ]
+    if not isinstance(pairs_map, AvailablePairs):
+        pairs_map = AvailablePairs(pairs_map)
+    return pairs_map.update(base_already_mapping, target_already_mapping, actual_mapping_indecies)
+
+
+def get_cache(progress: Optional[Callable[[Dict[str, int]], None]] = None, events: Optional[Callable[[str, Any], None]] = None) -> Dict[str, Cache]:
+    return {"scores": {}, "mappings": set(), "relations": set(), "encoder": Encoder(), "progress": Progress(progress, events)}
 
 
 def get_all_possible_pairs_map(base: List[str], target: List[str]) -> List[List[SingleMatch]]:
@@ -196,6 +396,25 @@ def get_all_possible_pairs_map(base: List[str], target: List[str]) -> List[List[
     return all_mapping
 
 
+def prefetch_entities_relations(data_collector: DataCollector, base: List[str], target: List[str]):
+    # the scoring is asking for the relations of every ordered pair in the base and in the target,
+    # so we collect all of them at once before it starts.
+    pairs = list(permutations(base, 2)) + list(permutations(target, 2))
+    data_collector.get_entities_relations_batch(pairs)
+
+
+def prefetch_embeddings(unmutables: Dict[str, Unmutables], mappings: List[List[SingleMatch]]):
+    # all the props that the scoring of the given mappings is going to compare are encoded here, in one call.
+    # so the scoring is only reading the embeddings, and they are the same whether the mappings are scored in threads or not.
+    props = set()
+    for mapping in mappings:
+        for direction in mapping:
+            for pair in direction:
+                props.update(unmutables["data_collector"].get_entities_relations(pair[0], pair[1]))
+    if props:
+        unmutables["model"].get_embeddings(sorted(props))
+
+
 def get_edges_with_maximum_weight(similatiry_edges: List[Tuple[str, str, float]], 
                                 clustered_sentences_1: Dict[int, List[str]], 
                                 clustered_sentences_2: Dict[int, List[str]]
@@ -223,6 +442,18 @@ def get_edges_with_maximum_weight(similatiry_edges: List[Tuple[str, str, float]]
 
 
 def get_pair_mapping(model: SentenceEmbedding, data_collector: DataCollector, freq: Frequencies, mapping: SingleMatch):
+    # the graph of each direction is built once (usually while scoring), the next calls (like the app that shows
+    # the relations of the solutions) are taking it from pair_graphs.
+    context = get_context(model, data_collector, freq)
+    pair_graphs = get_pair_graphs()
+    graph = pair_graphs.get(context, mapping)
+    if graph is None:
+        graph = build_pair_mapping(model, data_collector, freq, mapping)
+        pair_graphs.set(context, mapping, graph)
+    return graph
+
+
+def build_pair_mapping(model: SentenceEmbedding, data_collector: DataCollector, freq: Frequencies, mapping: SingleMatch):
 
     props_edge1 = data_collector.get_entities_relations(mapping[0][0], mapping[0][1])
     props_edge2 = data_collector.get_entities_relations(mapping[1][0], mapping[1][1])
@@ -231,7 +462,7 @@ def get_pair_mapping(model: SentenceEmbedding, data_collector: DataCollector, fr
         return {}
 
     # we want the weight of each edge between two nodes.
-    similatiry_edges = [(prop1, prop2, get_edge_score(prop1, prop2, model, freq)) for prop1 in props_edge1 for prop2 in props_edge2]
+    similatiry_edges = get_similarity_edges(props_edge1, props_edge2, model, freq)
 
     # we want the cluster similar properties
     clustered_sentences_1: Dict[int, List[str]] = model.clustering(props_edge1, distance_threshold=DEFAULT_DIST_THRESHOLD_FOR_CLUSTERS)
@@ -248,75 +479,110 @@ def get_pair_mapping(model: SentenceEmbedding, data_collector: DataCollector, fr
         "graph": edges,
         "clusters1": clustered_sentences_1,
         "clusters2": clustered_sentences_2,
-        "score": round(sum([edge[2] for edge in edges[:NUM_OF_CLUSTERS_TO_CALC] if edge[2] > EDGE_THRESHOLD]), 3)
+        # score is just the sum of all the edges (edges between clusters)
+        "score": round(sum([edge[2] for edge in edges[:NUM_OF_CLUSTERS_TO_CALC] if edge[2] > EDGE_THRESHOLD]), 3),
+        # coverage messure
+        "coverage": min(len(props_edge1), len(props_edge2)),
     }
 
 
+def get_pair_mapping_props(model: SentenceEmbedding, data_collector: DataCollector, freq: Frequencies, mapping: SingleMatch, graph: dict) -> List[Tuple[str, str]]:
+    # the most similar props of each two clusters that matched in the graph (the labels of the edges in the app).
+    # they are computed once, and kept in pair_props (the cached graph itself is shared, so it is not changed).
+    context = get_context(model, data_collector, freq)
+    pair_props = get_pair_props()
+    props = pair_props.get(context, mapping)
+    if props is None:
+        props = [
+            utils.get_ordered_edges_similarity(model, graph["clusters1"][cluster_edge[0]], graph["clusters2"][cluster_edge[1] - len(graph["clusters1"])])[0][:2]
+            for cluster_edge in graph["graph"]
+        ]
+        pair_props.set(context, mapping, props)
+    return props
+
+
 def get_best_pair_mapping_for_current_iteration(
-    available_maps: List[List[SingleMatch]], 
+    available_maps: Union[AvailablePairs, List[List[SingleMatch]]], 
     initial_results: List[Dict[str, Union[int, SingleMatch]]], 
     depth: int
     ) -> Tuple[List[Dict[str, Union[int, SingleMatch]]], List[Dict[str, Union[int, SingleMatch]]]]:
 
-    # better to iterate one time over the available_maps and store it in a set
-    available_maps_flatten = set()
-    for available_map in available_maps:
-        available_maps_flatten.add(tuple(available_map[0]))
-        available_maps_flatten.add(tuple(available_map[1]))
+    # the available pairs are indexed, so the exists-check is quick
+    if not isinstance(available_maps, AvailablePairs):
+        available_maps = AvailablePairs(available_maps)
     
     # modified_results important for the next iteration
-    modified_results = [result for result in initial_results if tuple(result["best_mapping"]) in available_maps_flatten]
+    modified_results = [result for result in initial_results if result["best_mapping"] in available_maps]
     results_for_current_iteration = [result for result in modified_results[:depth]]
     return results_for_current_iteration, modified_results
 
 
+def get_mapping_score(unmutables: Dict[str, Unmutables], mapping: List[SingleMatch]) -> Tuple[float, int]:
+    # for each mapping we want both direction, for example:
+    # if we have in the base: earth, sun. AND in the target: electrons, nucleus.
+    # for the mapping earth->electrons, sun->nucleus , we will calculate: 
+    # earth .* sun, electrons .* nucleus AND sun .* earth, nucleus .* electrons
+    mapping_score = 0
+    coverage = 0
+    for direction in mapping:
+        graph = get_pair_mapping(unmutables["model"], unmutables["data_collector"], unmutables["freq"], direction)
+        if not graph:
+            continue
+        mapping_score += graph["score"]
+        coverage += graph["coverage"]
+
+    return mapping_score, coverage
+
+
+def get_scores_context(unmutables: Dict[str, Unmutables]) -> Context:
+    return get_context(unmutables["model"], unmutables["data_collector"], unmutables["freq"])
+
+
+def get_context(model: SentenceEmbedding, data_collector: DataCollector, freq: Frequencies) -> Context:
+    # everything that the score of a pair mapping depends on, except the entities.
+    return (model.model_name, freq.threshold, data_collector.get_sources())
+
+
 def get_best_pair_mapping(
     unmutables: Dict[str, Unmutables],
-    available_maps: List[List[SingleMatch]], 
+    available_maps: Union[AvailablePairs, List[List[SingleMatch]]], 
     cache: Dict[str, Cache], 
-    depth: int = 0
+    depth: int = 0,
+    workers: int = 1
     ) -> List[Dict[str, Union[int, SingleMatch]]]:
     
-    mappings = []
     # we will iterate over all the possible pairs mapping ((n choose 2)*(n choose 2)*2), 2->2, 3->18, 4->72
-    iterator = available_maps if os.environ.get('CI', False) else tqdm(available_maps)
-    for mapping in iterator:
-        # for each mapping we want both direction, for example:
-        # if we have in the base: earth, sun. AND in the target: electrons, nucleus.
-        # for the mapping earth->electrons, sun->nucleus , we will calculate: 
-        # earth .* sun, electrons .* nucleus AND sun .* earth, nucleus .* electrons
-        mapping_score = 0
-        coverage = 0
-        for direction in mapping:
-            b1, b2 = direction[0][0], direction[0][1]
-            t1, t2 = direction[1][0], direction[1][1]
-            props_edge1 = unmutables["data_collector"].get_entities_relations(b1, b2)
-            props_edge2 = unmutables["data_collector"].get_entities_relations(t1, t2)
-
-            if not props_edge1 or not props_edge2:
-                continue
-
-            # we want the weight of each edge between two nodes.
-            similatiry_edges = [(prop1, prop2, get_edge_score(prop1, prop2, unmutables["model"], unmutables["freq"])) for prop1 in props_edge1 for prop2 in props_edge2]
-
-            # we want the cluster similar properties
-            clustered_sentences_1: Dict[int, List[str]] = unmutables["model"].clustering(props_edge1, distance_threshold=DEFAULT_DIST_THRESHOLD_FOR_CLUSTERS)
-            clustered_sentences_2: Dict[int, List[str]] = unmutables["model"].clustering(props_edge2, distance_threshold=DEFAULT_DIST_THRESHOLD_FOR_CLUSTERS)
-
-            # for each two clusters (from the opposite side of the bipartite) we will take only one edge, which is the maximum weighted.
-            cluster_edges_weights = get_edges_with_maximum_weight(similatiry_edges, clustered_sentences_1, clustered_sentences_2)
-                
-            # now we want to get the maximum weighted match, which hold the constraint that each cluster has no more than one edge.
-            # we will look only on edges that appear in cluster_edges_weights
-            edges = utils.get_maximum_weighted_match(unmutables["model"], clustered_sentences_1, clustered_sentences_2, weights=cluster_edges_weights)
-            edges = sorted(edges, key=lambda x: x[2], reverse=True)
-            
-            # score is just the sum of all the edges (edges between clusters)
-            mapping_score += round(sum([edge[2] for edge in edges[:NUM_OF_CLUSTERS_TO_CALC] if edge[2] > EDGE_THRESHOLD]), 3)
-            
-            # coverage messure
-            coverage += min(len(props_edge1), len(props_edge2))
+    # each mapping is scored independently, so with workers > 1 they are scored in a thread pool 
+    # (the heavy parts are torch and numpy, which are not holding the GIL). 
+    # the results are collected in the original order, so it is the same as the serial run.
+    # the scores of the pairs that already scored (in this search or a previous one) are taken from pair_scores.
+    available_maps = list(available_maps)
+    pair_scores = get_pair_scores()
+    context = get_scores_context(unmutables)
+    known_scores = pair_scores.get_many(context, available_maps)
+    missing_maps = [mapping for i, mapping in enumerate(available_maps) if i not in known_scores]
+    prefetch_embeddings(unmutables, missing_maps)
+
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 and len(missing_maps) > 1 else None
+    try:
+        new_scores = (executor.map if executor else map)(partial(get_mapping_score, unmutables), missing_maps)
+        iterator = new_scores if os.environ.get('CI', False) or not missing_maps else tqdm(new_scores, total=len(missing_maps))
+        cache["progress"].add("pairs_scored", len(known_scores))
+        new_scores = []
+        for mapping_score in iterator:
+            new_scores.append(mapping_score)
+            cache["progress"].add("pairs_scored")
+    finally:
+        # also when one of the scores raised, the pending ones are not started
+        if executor:
+            executor.shutdown(cancel_futures=True)
+    pair_scores.set_many(context, missing_maps, new_scores)
+
+    new_scores = iter(new_scores)
+    scores = [known_scores[i] if i in known_scores else next(new_scores) for i in range(len(available_maps))]
 
+    mappings = []
+    for mapping, (mapping_score, coverage) in zip(available_maps, scores):
         mappings.append((mapping[0], mapping_score, coverage))
         cache["scores"][((mapping[0][0][0], mapping[0][0][1]),(mapping[0][1][0], mapping[0][1][1]))] = mapping_score
         cache["scores"][((mapping[1][0][0], mapping[1][0][1]),(mapping[1][1][0], mapping[1][1][1]))] = mapping_score
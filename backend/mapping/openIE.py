@@ -1,22 +1,101 @@
-from typing import List
+import os
+import csv
+import sqlite3
+import threading
 from pathlib import Path
 from collections import Counter
+from typing import List, Dict, Tuple, Optional
 
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
-import requests
-import pandas as pd
 from click import secho
-from bs4 import BeautifulSoup
 
 current_dir = Path(__file__).resolve().parent
+# You should download the database from here: https://allenai.org/data/openie-demo
+# Then you should split it to tsv files, two depth-directroies for the first two letters of the subjects.
+OPENIE_DATA_FOLDER = current_dir / 'openie_data'
+OPENIE_STORE_PATH = current_dir.parent / 'database' / 'openie.sqlite'
+Pair = Tuple[str, str]
+
+
+class OpenIEStore(object):
+    """
+    The OpenIE triples (subject, predicate, object), indexed by (subject, object) with the count of each predicate.
+    It is built once from the tsv files in openie_data (see build_openie_store), so the relations of two entities
+    are a point lookup instead of reading and filtering the whole tsv.
+    """
+    def __init__(self, path: Path = OPENIE_STORE_PATH):
+        self.path = Path(path)
+        self.lock = threading.RLock()
+        self.connection = None
+        self.pid = None
+
+    def connect(self) -> Optional[sqlite3.Connection]:
+        # returns None if the store is not built.
+        if self.connection is not None and self.pid == os.getpid():
+            return self.connection
+        if not self.path.exists():
+            return None
+        self.pid = os.getpid()
+        self.connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        return self.connection
+
+    def get_relations(self, subject: str, object_: str, n: int = 10) -> List[str]:
+        # the n most common predicates, the same order as Counter.most_common (ties by the first appearance).
+        with self.lock:
+            connection = self.connect()
+            if connection is None:
+                return []
+            rows = connection.execute(
+                "SELECT predicate FROM relations WHERE subject = ? AND object = ? ORDER BY count DESC, first_row ASC LIMIT ?",
+                (subject, object_, max(n, 0))
+            ).fetchall()
+            return [row[0] for row in rows]
+
+
+def read_triples(path: Path):
+    # the lines that are not triples are skipped.
+    with open(path, 'r', encoding='utf-8', errors='replace', newline='') as f:
+        for row in csv.reader(f, delimiter='\t'):
+            if len(row) == 3 and all(row):
+                yield row
+
+
+def build_openie_store(data_folder: Path = OPENIE_DATA_FOLDER, path: Path = OPENIE_STORE_PATH):
+    # each subject is only in one tsv file, so the predicates are counted one file at a time.
+    # we write everything to a temporary file first, so other processes never see a partial store.
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.parent / f'.{path.name}.{os.getpid()}'
+    if tmp_path.exists():
+        tmp_path.unlink()
+    connection = sqlite3.connect(str(tmp_path))
+    connection.execute("CREATE TABLE relations (subject TEXT, object TEXT, predicate TEXT, count INTEGER, first_row INTEGER, PRIMARY KEY (subject, object, predicate)) WITHOUT ROWID")
+    for tsv_path in sorted(Path(data_folder).glob('*/*.tsv')):
+        counts: Counter = Counter()
+        first_rows: Dict[Tuple[str, str, str], int] = {}
+        for i, (subject, predicate, object_) in enumerate(read_triples(tsv_path)):
+            counts[(subject, object_, predicate)] += 1
+            first_rows.setdefault((subject, object_, predicate), i)
+        with connection:
+            connection.executemany(
+                "INSERT INTO relations (subject, object, predicate, count, first_row) VALUES (?, ?, ?, ?, ?)",
+                ((subject, object_, predicate, count, first_rows[(subject, object_, predicate)]) for (subject, object_, predicate), count in counts.items())
+            )
+    connection.close()
+    tmp_path.replace(path)
+
+
+openie_store = OpenIEStore()
 
 
 def read_page(entity1: str, entity2: str, page: int = 0, predicate: str = "") -> str:
     url = f'https://openie.allenai.org/search/?arg1={entity1}&rel={predicate}&arg2={entity2}'
     if page > 0:
         url = f'{url}&page={page}'
+    # requests (and bs4 in the parsers) are imported only here, most of the time we are reading from the store.
+    import requests
     try:
         response = requests.get(url)
         return response.text
@@ -80,6 +159,7 @@ def get_entity_associations(associations: List[str],
                             n: int = 10,
                             full_search: bool = True):
     content = read_page(entity, "", current_page)
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(content, 'html.parser')
     associations_parser = soup.find('div', attrs={'id': 'results-content'})
     associations_parser = associations_parser.find('div', attrs={'class': 'tabbable tabs-left'})
@@ -140,23 +220,11 @@ def get_entities_relations(
     entity2: str,
     n: int = 10
 ):
-    first_letter, second_letter = entity1[0], entity1[1]
-    if not (current_dir / 'openie_data' / f'{first_letter}' / f'{second_letter}.tsv').exists():
-        return
+    relations.extend(openie_store.get_relations(entity1, entity2, n=n))
 
-    df = pd.read_csv(
-        current_dir / 'openie_data' / f'{first_letter}' / f'{second_letter}.tsv', 
-        sep='\t',
-        names=["subject", "predicate", "object"],
-        error_bad_lines=False,
-        warn_bad_lines=False,
-        engine='python'
-    )
 
-    df = df.loc[(df['subject'] == entity1) & (df['object'] == entity2)]
-    counter = Counter(df["predicate"].tolist()).most_common(n)
-    if counter:
-        relations.extend([relation[0] for relation in counter])
+def get_entities_relations_batch(pairs: List[Pair], n: int = 10) -> Dict[Pair, List[str]]:
+    return {(entity1, entity2): openie_store.get_relations(entity1, entity2, n=n) for entity1, entity2 in pairs}
 
 
 def get_entity_suggestions_wrapper(entity: str,
@@ -185,6 +253,7 @@ def get_entity_suggestions(entities: List[str],
                            n_largest: int = 5
                            ) -> List[str]:
     content = read_page(entity1=entity, entity2="", predicate=predicate)
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(content, 'html.parser')
     entities_suggestions = soup.find('div', attrs={'id': 'results-content'})
     entities_suggestions = entities_suggestions.find('div', attrs={'class': 'tabbable tabs-left'})
@@ -202,4 +271,8 @@ def get_entity_suggestions(entities: List[str],
 # print(associations)
 
 # suggestions = get_entity_suggestions_wrapper("river", "take their hands off")
-# print(suggestions)
\ No newline at end of file
+# print(suggestions)
+
+
+if __name__ == '__main__':
+    build_openie_store()
@@ -0,0 +1,141 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Tuple, Optional
+
+from .cache_store import CacheStore, get_cache_store
+
+PAIR_SCORES_CACHE_SIZE = 200000
+PAIR_GRAPHS_CACHE_SIZE = 20000
+# the scores are saved in the cache store only if this environment variable is set, 
+# since they are changed whenever the scoring is changed.
+PERSIST_ENV = 'PERSIST_PAIR_SCORES'
+SOURCE = 'pair_scores'
+
+Context = Tuple[str, float, Tuple[str, ...]] # model name, frequency threshold, enabled sources
+SingleMatch = List[Tuple[str, str]] # [(b1,b2), (t1,t2)]
+
+
+class PairScores(object):
+    """
+    The scores and the coverage of pairs mapping (b1:b2~t1:t2), shared by all the searches of the process,
+    so the same pair is not scored again in the next problem (or request).
+    The score depends also on the model, the frequency threshold and the enabled sources, so they are part of the key.
+    The last max_size used scores are kept in memory, and if cache_store is given they are also saved there.
+    """
+    def __init__(self, max_size: int = PAIR_SCORES_CACHE_SIZE, cache_store: Optional[CacheStore] = None):
+        self.max_size = max_size
+        self.cache_store = cache_store
+        self.scores: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(context: Context, mapping: List[SingleMatch]) -> Tuple:
+        # both directions of the pair have the same score
+        (b1, b2), (t1, t2) = mapping[0]
+        return (min((b1, b2, t1, t2), (b2, b1, t2, t1)),) + tuple(context)
+
+    def get_many(self, context: Context, mappings: List[List[SingleMatch]]) -> Dict[int, Tuple[float, int]]:
+        # returns only the mappings that we have (by their index)
+        keys = [self.get_key(context, mapping) for mapping in mappings]
+        values = {}
+        with self.lock:
+            for i, key in enumerate(keys):
+                if key in self.scores:
+                    self.scores.move_to_end(key)
+                    values[i] = self.scores[key]
+        
+        missing = [i for i in range(len(keys)) if i not in values]
+        if self.cache_store and missing:
+            context_repr = json.dumps(context)
+            stored = self.cache_store.get_many(SOURCE, [(context_repr, json.dumps(keys[i][0])) for i in missing])
+            for i in missing:
+                value = stored.get((context_repr, json.dumps(keys[i][0])))
+                if value is not None:
+                    values[i] = (value[0], value[1])
+                    self.add(keys[i], values[i])
+        return values
+
+    def set_many(self, context: Context, mappings: List[List[SingleMatch]], values: List[Tuple[float, int]]):
+        for mapping, value in zip(mappings, values):
+            key = self.get_key(context, mapping)
+            self.add(key, value)
+            if self.cache_store:
+                self.cache_store.set(SOURCE, json.dumps(context), json.dumps(key[0]), list(value))
+        if self.cache_store:
+            self.cache_store.commit()
+
+    def add(self, key: Tuple, value: Tuple[float, int]):
+        with self.lock:
+            self.scores[key] = value
+            self.scores.move_to_end(key)
+            while len(self.scores) > self.max_size:
+                self.scores.popitem(last=False)
+
+
+class PairGraphs(object):
+    """
+    The graphs of single directions (b1:b2~t1:t2) that are built while scoring (clusters, matched edges and score),
+    so the app can show the relations of the solutions without building them again.
+    They are kept only in memory (the last max_size used), and they must not be changed by the callers.
+    The props of the matched clusters (the labels in the app) are kept the same way, in their own instance.
+    """
+    def __init__(self, max_size: int = PAIR_GRAPHS_CACHE_SIZE):
+        self.max_size = max_size
+        self.graphs: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(context: Context, direction: SingleMatch) -> Tuple:
+        return (tuple(direction[0]), tuple(direction[1])) + tuple(context)
+
+    def get(self, context: Context, direction: SingleMatch) -> Optional[dict]:
+        key = self.get_key(context, direction)
+        with self.lock:
+            if key not in self.graphs:
+                return None
+            self.graphs.move_to_end(key)
+            return self.graphs[key]
+
+    def set(self, context: Context, direction: SingleMatch, graph: dict):
+        key = self.get_key(context, direction)
+        with self.lock:
+            self.graphs[key] = graph
+            self.graphs.move_to_end(key)
+            while len(self.graphs) > self.max_size:
+                self.graphs.popitem(last=False)
+
+
+pair_scores: Optional[PairScores] = None
+pair_scores_lock = threading.Lock()
+
+
+def get_pair_scores() -> PairScores:
+    global pair_scores
+    with pair_scores_lock:
+        if pair_scores is None:
+            pair_scores = PairScores(cache_store=get_cache_store() if os.environ.get(PERSIST_ENV, False) else None)
+        return pair_scores
+
+
+pair_graphs: Optional[PairGraphs] = None
+
+
+def get_pair_graphs() -> PairGraphs:
+    global pair_graphs
+    with pair_scores_lock:
+        if pair_graphs is None:
+            pair_graphs = PairGraphs()
+        return pair_graphs
+
+
+pair_props: Optional[PairGraphs] = None
+
+
+def get_pair_props() -> PairGraphs:
+    global pair_props
+    with pair_scores_lock:
+        if pair_props is None:
+            pair_props = PairGraphs()
+        return pair_props
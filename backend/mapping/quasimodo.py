@@ -1,15 +1,22 @@
-import copy
+import os
 import json
+import shutil
 from pathlib import Path
 from collections import Counter
-from typing import List, Union, Tuple
+from typing import List, Union, Tuple, Dict, TYPE_CHECKING
 
 import inflect
-import pandas as pd
+import numpy as np
 from click import secho
-from pandas import DataFrame
+
+# pandas is needed only for building the columns (once), so it is imported there.
+if TYPE_CHECKING:
+    from pandas import DataFrame
 
 root = Path(__file__).resolve().parent.parent.parent
+COLUMNS = ['subject', 'predicate', 'object']
+COLUMNS_VERSION = 1
+PLAUSIBILITY_DECIMALS = 4
 
 def render(row: dict):
     secho(f"{row['subject']} ", fg="blue", bold=True, nl=False)
@@ -35,9 +42,62 @@ def render_entities_similarity(entity1: str, entity2: str, row: dict):
     secho(f"{spaces}avg. score: ", nl=False)
     secho(f"{row['plausibility']}", fg="magenta")
 
+class StringTable:
+    """
+    Sorted unique strings, stored as one utf-8 buffer and the offsets of each string inside it.
+    The order of the utf-8 bytes is the same as the order of the python strings, so we can search
+    the table without decoding it. Both arrays can be memory-mapped.
+    """
+    def __init__(self, buffer: np.ndarray, offsets: np.ndarray):
+        self.buffer = buffer
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings: List[str]) -> 'StringTable':
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(string) for string in encoded])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets)
+
+    @classmethod
+    def load(cls, folder: Path, name: str) -> 'StringTable':
+        offsets = np.load(folder / f'{name}.string_offsets.npy', mmap_mode='r')
+        if offsets[-1] == 0:
+            # an empty file cannot be memory-mapped
+            return cls(np.empty(0, dtype=np.uint8), offsets)
+        return cls(np.load(folder / f'{name}.strings.npy', mmap_mode='r'), offsets)
+
+    def save(self, folder: Path, name: str):
+        np.save(folder / f'{name}.strings.npy', self.buffer)
+        np.save(folder / f'{name}.string_offsets.npy', self.offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def get_bytes(self, idx: int) -> bytes:
+        return self.buffer[self.offsets[idx]:self.offsets[idx + 1]].tobytes()
+
+    def __getitem__(self, idx: int) -> str:
+        return self.get_bytes(idx).decode('utf-8')
+
+    def index(self, string: str) -> int:
+        # binary search, returns -1 if the string is not in the table.
+        encoded = string.encode('utf-8')
+        low, high = 0, len(self)
+        while low < high:
+            mid = (low + high) // 2
+            if self.get_bytes(mid) < encoded:
+                low = mid + 1
+            else:
+                high = mid
+        if low < len(self) and self.get_bytes(low) == encoded:
+            return low
+        return -1
+
+
 class Quasimodo:
     def __init__(self, path: Union[str, Path] = root / 'backend' / 'tsv' / 'merged' / 'quasimodo.tsv'):
-        self.data = self.init_data(path)
+        self.init_indexes(Path(path))
         self.engine = inflect.engine()
     
     def extend_plural_and_singular(self, string: str, list_to_update: List[str]):
@@ -49,10 +109,80 @@ class Quasimodo:
         if singular and singular not in list_to_update:
             list_to_update.append(singular)
     
-    def init_data(self, path: str) -> DataFrame:
+    def init_data(self, path: str) -> 'DataFrame':
+        import pandas as pd
         if not Path(path).exists():
             merge_tsvs()
         return pd.read_csv(path, sep='\t', low_memory=False)
+
+    def init_indexes(self, path: Path):
+        # parsing the tsv is slow, so we do it only once and save the indexes as binary files next to it.
+        # the next loads are just memory-mapping these files (which is also shared between processes).
+        folder = get_columns_folder(path)
+        if not is_columns_folder_updated(folder, path):
+            build_columns(self.init_data(path), folder, path)
+        self.load_columns(folder)
+
+    def load_columns(self, folder: Path):
+        self.plausibility: np.ndarray = np.load(folder / 'plausibility.npy', mmap_mode='r')
+        self.codes: Dict[str, np.ndarray] = {}
+        self.values: Dict[str, StringTable] = {}
+        self.rows: Dict[str, np.ndarray] = {}
+        self.offsets: Dict[str, np.ndarray] = {}
+        for col in COLUMNS:
+            self.codes[col] = np.load(folder / f'{col}.codes.npy', mmap_mode='r')
+            self.values[col] = StringTable.load(folder, col)
+            self.rows[col] = np.load(folder / f'{col}.rows.npy', mmap_mode='r')
+            self.offsets[col] = np.load(folder / f'{col}.offsets.npy', mmap_mode='r')
+
+    def get_code(self, col: str, obj: str) -> int:
+        return self.values[col].index(obj)
+
+    def get_rows(self, col: str, obj: str) -> np.ndarray:
+        code = self.get_code(col, obj)
+        if code < 0:
+            return np.empty(0, dtype=np.int32)
+        return self.rows[col][self.offsets[col][code]:self.offsets[col][code + 1]]
+
+    def get_subjects_rows(self, subjects: List[str]) -> np.ndarray:
+        # all the rows of the given subjects (in the given order), without duplicates of (predicate, object).
+        rows = np.concatenate([self.get_rows('subject', subject) for subject in subjects])
+        return self.drop_duplicates(rows)
+
+    def get_value(self, col: str, row: int) -> str:
+        code = self.codes[col][row]
+        return self.values[col][code] if code >= 0 else np.nan
+
+    def get_row(self, row: int) -> dict:
+        return {
+            "subject": self.get_value('subject', row),
+            "predicate": self.get_value('predicate', row),
+            "object": self.get_value('object', row),
+            "plausibility": self.get_plausibility(row),
+        }
+
+    def get_plausibility(self, rows: Union[int, np.ndarray]) -> Union[float, np.ndarray]:
+        # the plausibility is saved as float32, rounding it back gives exactly the values of the tsv.
+        return np.round(np.asarray(self.plausibility[rows], dtype=np.float64), PLAUSIBILITY_DECIMALS)
+
+    def get_keys(self, rows: np.ndarray) -> np.ndarray:
+        # (predicate, object) as a single integer. Ordering by this key is the same as ordering by the strings.
+        return self.codes['predicate'][rows].astype(np.int64) * (len(self.values['object']) + 1) + self.codes['object'][rows] + 1
+
+    def drop_duplicates(self, rows: np.ndarray) -> np.ndarray:
+        # keep the first occurrence of each (predicate, object)
+        _, first_occurrences = np.unique(self.get_keys(rows), return_index=True)
+        return rows[np.sort(first_occurrences)]
+
+    def nlargest(self, rows: np.ndarray, n_largest: int, plausibility: np.ndarray = None) -> np.ndarray:
+        # same as DataFrame.nlargest (keep='first').
+        if plausibility is None:
+            plausibility = self.get_plausibility(rows)
+        if n_largest >= len(rows):
+            # pandas just sorting all the rows in this case (descending, with the default sort of numpy).
+            return rows[(len(rows) - 1 - np.argsort(plausibility[::-1]))[::-1]]
+        # otherwise the order between equal plausibility is the original order.
+        return rows[np.argsort(-plausibility, kind='stable')[:n_largest]]
     
     def get_entity_props(self, entity: str, n_largest: int = 10, verbose: bool = False, plural_and_singular: bool = False) -> List[Tuple[str]]:
         entities = [entity]
@@ -60,20 +190,18 @@ class Quasimodo:
         if plural_and_singular:
             self.extend_plural_and_singular(entity, entities)
         
-        # now we will filter by the entities and concat all to one dataframe.
-        dataframes = [self.filter_by('subject', s) for s in entities]
-        concat_df = pd.concat(dataframes)
-        concat_df = concat_df.drop_duplicates(subset=['predicate', 'object'])
+        # now we will take the rows of all the entities.
+        rows = self.get_subjects_rows(entities)
         
         # plausibility is our messure for good match
         if n_largest:
-            concat_df = concat_df.nlargest(n_largest, 'plausibility')
+            rows = self.nlargest(rows, n_largest)
 
         props_list = []
-        for _, row in concat_df.iterrows():
-            props_list.append((row['predicate'].replace('_', ' '), row['object']))
+        for row in rows:
+            props_list.append((self.get_value('predicate', row).replace('_', ' '), self.get_value('object', row)))
             if verbose:
-                render(row)
+                render(self.get_row(row))
         return props_list
 
     def get_entities_relations(self, entity1: str, entity2: str, n_largest: int = 0, verbose: bool = False, plural_and_singular: bool = False) -> List[Tuple[str]]:
@@ -84,25 +212,21 @@ class Quasimodo:
             self.extend_plural_and_singular(entity1, entities1)
             self.extend_plural_and_singular(entity2, entities2)
         
-        # we filter by our entities1, then we concat to one dataframe.
-        subject_dataframes = [self.filter_by('subject', h) for h in entities1]
-        concat_subject_df = pd.concat(subject_dataframes)
-        concat_subject_df = concat_subject_df.drop_duplicates(subset=['predicate', 'object'])
-
-        # the filtered dataframe (by entities1), we filter again with entities2, then we again concat to one dataframe.
-        filtered_dataframes = [self.filter_by('object', t, use_outside_df=True, df=concat_subject_df) for t in entities2]
-        concat_filtered_df = pd.concat(filtered_dataframes)
-        concat_filtered_df = concat_filtered_df.drop_duplicates(subset=['predicate', 'object'])
+        # we take the rows of our entities1, then we keep only the rows that their object is one of entities2.
+        subject_rows = self.get_subjects_rows(entities1)
+        subject_objects = self.codes['object'][subject_rows]
+        objects_codes = [self.get_code('object', t) for t in entities2]
+        rows = np.concatenate([subject_rows[:0]] + [subject_rows[subject_objects == code] for code in objects_codes if code >= 0])
 
         # plausibility is our messure for good match
         if n_largest:
-            concat_filtered_df = concat_filtered_df.nlargest(n_largest, 'plausibility')
+            rows = self.nlargest(rows, n_largest)
 
         props_list = []
-        for _, row in concat_filtered_df.iterrows():
-            props_list.append(row['predicate'].replace('_', ' '))
+        for row in rows:
+            props_list.append(self.get_value('predicate', row).replace('_', ' '))
             if verbose:
-                render(row)
+                render(self.get_row(row))
 
         return props_list
 
@@ -114,44 +238,32 @@ class Quasimodo:
             self.extend_plural_and_singular(entity1, entities1)
             self.extend_plural_and_singular(entity2, entities2)
         
-        # we now filter by the first entity
-        entity1_dataframes = [self.filter_by('subject', n1) for n1 in entities1]
-        concat_entity1_df = pd.concat(entity1_dataframes)
-        concat_entity1_df = concat_entity1_df.drop_duplicates(subset=['predicate', 'object'])
-
-        # we now filter by the second entity
-        entity2_dataframes = [self.filter_by('subject', n2) for n2 in entities2]
-        concat_entity2_df = pd.concat(entity2_dataframes)
-        concat_entity2_df = concat_entity2_df.drop_duplicates(subset=['predicate', 'object'])
-
-        # https://stackoverflow.com/questions/22219004/how-to-group-dataframe-rows-into-list-in-pandas-groupby
-        concat_df = pd.concat([concat_entity1_df, concat_entity2_df])
-        df = concat_df[['predicate','object']]
-        df = df[df.duplicated(keep=False)]
-        if df.empty:
+        # we now take the rows of each entity
+        entity1_rows = self.get_subjects_rows(entities1)
+        entity2_rows = self.get_subjects_rows(entities2)
+
+        # the (predicate, object) that both entities share, ordered by the predicate and then by the object.
+        entity1_keys = self.get_keys(entity1_rows)
+        entity2_keys = self.get_keys(entity2_rows)
+        _, entity1_idx, entity2_idx = np.intersect1d(entity1_keys, entity2_keys, assume_unique=True, return_indices=True)
+        entity1_rows = entity1_rows[entity1_idx]
+        entity2_rows = entity2_rows[entity2_idx]
+        valid = (self.codes['predicate'][entity1_rows] >= 0) & (self.codes['object'][entity1_rows] >= 0)
+        entity1_rows, entity2_rows = entity1_rows[valid], entity2_rows[valid]
+        if len(entity1_rows) == 0:
             return []
-            
-        indexies = df.groupby(list(df)).apply(lambda x: tuple(x.index)).tolist()
-        matches = []
-        for index in indexies:
-            entity1_row = concat_df.loc[index[0]]
-            entity2_row = concat_df.loc[index[1]]
-            matches.append({
-                "predicate": entity1_row['predicate'],
-                "object": entity1_row['object'],
-                "plausibility": (entity1_row['plausibility'] + entity2_row['plausibility']) / 2,
-            })
-
-        new_df = DataFrame(matches)
-        new_df = new_df.drop_duplicates(subset=['predicate', 'object'])
 
+        plausibility = (self.get_plausibility(entity1_rows) + self.get_plausibility(entity2_rows)) / 2
+        order = np.arange(len(entity1_rows))
         if n_largest:
-            new_df = new_df.nlargest(n_largest, 'plausibility')
+            order = self.nlargest(order, n_largest, plausibility=plausibility)
 
         props_list = []
-        for _, row in new_df.iterrows():
+        for i in order:
+            row = self.get_row(entity1_rows[i])
             props_list.append((row['predicate'].replace('_', ' '), row['object']))
             if verbose:
+                row['plausibility'] = plausibility[i]
                 render_entities_similarity(entity1, entity2, row)
         return props_list
     
@@ -160,27 +272,16 @@ class Quasimodo:
         if plural_and_singular:
             self.extend_plural_and_singular(entity, entities)
         
-        # we filter by our entities, then we concat to one dataframe.
-        subject_dataframes = [self.filter_by('subject', h) for h in entities]
-        concat_subject_df = pd.concat(subject_dataframes)
-        concat_subject_df = concat_subject_df.drop_duplicates(subset=['predicate', 'object'])
-        filtered_df = self.filter_by('predicate', prop, use_outside_df=True, df=concat_subject_df)
+        # we take the rows of our entities, then we keep only the rows with the given prop.
+        subject_rows = self.get_subjects_rows(entities)
+        prop_code = self.get_code('predicate', prop)
+        rows = subject_rows[self.codes['predicate'][subject_rows] == prop_code] if prop_code >= 0 else subject_rows[:0]
 
         # plausibility is our messure for good match
         if n_largest:
-            filtered_df = filtered_df.nlargest(n_largest, 'plausibility')
-
-        return list(set([row['object'].replace('_', ' ') for _, row in filtered_df.iterrows()]))
+            rows = self.nlargest(rows, n_largest)
 
-    
-    def filter_by(self, col: str, obj: str, inplace: bool = False, use_outside_df: bool = False, df: DataFrame = DataFrame(), n_largest: int = 0) -> DataFrame:
-        if not use_outside_df:
-            df = self.data if inplace else copy.deepcopy(self.data)
-        df = df.dropna(subset=[col])
-        df = df.loc[df[col] == obj]
-        if n_largest > 0:
-            df = df.nlargest(n_largest, 'plausibility')
-        return df
+        return list(set([self.get_value('object', row).replace('_', ' ') for row in rows]))
 
     # def save_predicates(self):
     #     values = [val.replace("_", " ").lower() for val in self.data["predicate"].tolist()]
@@ -190,7 +291,61 @@ class Quasimodo:
     #         json.dump(d, f, indent='\t')
     
 
+def get_columns_folder(path: Path) -> Path:
+    return path.parent / f'{path.stem}_columns'
+
+
+def is_columns_folder_updated(folder: Path, path: Path) -> bool:
+    if not (folder / 'meta.json').exists():
+        return False
+    with open(folder / 'meta.json', 'r') as f:
+        meta = json.load(f)
+    if meta.get("version") != COLUMNS_VERSION:
+        return False
+    if not path.exists():
+        # we don't need the tsv anymore
+        return True
+    stat = path.stat()
+    return meta.get("size") == stat.st_size and meta.get("mtime") == stat.st_mtime
+
+
+def build_columns(data: 'DataFrame', folder: Path, path: Path):
+    import pandas as pd
+    # each column is encoded into integers (by the sorted unique values), and for each value we keep
+    # the rows that contain it (ordered by the original row order).
+    # we write everything to a temporary folder first, so other processes never see a partial folder.
+    tmp_folder = folder.parent / f'.{folder.name}.{os.getpid()}'
+    if tmp_folder.exists():
+        shutil.rmtree(tmp_folder)
+    tmp_folder.mkdir(parents=True)
+
+    np.save(tmp_folder / 'plausibility.npy', data['plausibility'].to_numpy(dtype=np.float32))
+    for col in COLUMNS:
+        codes, values = pd.factorize(data[col], sort=True)
+        codes = codes.astype(np.int32)
+        # missing values encoded as -1, so they are at the start of the sorted rows, and never queried.
+        counts = np.bincount(codes[codes >= 0], minlength=len(values))
+        offsets = np.concatenate([[0], np.cumsum(counts)]) + np.count_nonzero(codes < 0)
+        np.save(tmp_folder / f'{col}.codes.npy', codes)
+        np.save(tmp_folder / f'{col}.rows.npy', np.argsort(codes, kind='stable').astype(np.int32))
+        np.save(tmp_folder / f'{col}.offsets.npy', offsets.astype(np.int64))
+        StringTable.from_strings(values.tolist()).save(tmp_folder, col)
+
+    stat = path.stat()
+    with open(tmp_folder / 'meta.json', 'w') as f:
+        json.dump({"version": COLUMNS_VERSION, "rows": len(data), "size": stat.st_size, "mtime": stat.st_mtime}, f, indent='\t')
+
+    if folder.exists():
+        shutil.rmtree(folder, ignore_errors=True)
+    try:
+        tmp_folder.rename(folder)
+    except OSError:
+        # another process just built it
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+
+
 def merge_tsvs(output: str = 'quasimodo.tsv'):
+    import pandas as pd
     tsv_folder = root / 'backend' / 'tsv'
     dataframes = [pd.read_csv(path, sep="\t") for path in (tsv_folder / 'parts').iterdir()]
     merged_df = pd.concat(dataframes)
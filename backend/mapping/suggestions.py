@@ -1,73 +1,104 @@
 import os
-import json
 import copy
+import threading
 from pathlib import Path
-from typing import List, Tuple, Set, Dict
+from typing import List, Tuple, Set, Dict, Optional, Callable
 
 from click import secho
 
 from . import openIE
-from utils import utils
 from . import google_autosuggest
 from .quasimodo import Quasimodo
 from .data_collector import DataCollector
+from .cache_store import CacheStore, get_cache_store
 from frequency.frequency import Frequencies
 from utils.sentence_embadding import SentenceEmbedding
-from .mapping import Cache, Solution, Pair, SingleMatch, FREQUENCY_THRESHOLD, Unmutables
+from .mapping import Cache, Solution, Pair, FREQUENCY_THRESHOLD, Unmutables, AvailablePairs
 from .mapping import get_score, update_already_mapping, update_paris_map, get_all_possible_pairs_map, get_best_pair_mapping
 
 root = Path(__file__).resolve().parent.parent.parent
 IGNORE_SUGGESTION = ["the", "they", "us", "we", "you", 'i']
 
 class Suggestions(object):
-    def __init__(self, entity: str, prop: str, api: dict, quasimodo: Quasimodo):
-        self.entity = entity
-        self.prop = prop
+    """
+    Suggestions of entities for (entity, prop), for example ('electricity', 'discovered') -> faraday, edison.
+    It lives as long as the other unmutables, so the suggestions of each source are loaded once from the cache store
+    and kept in memory. The new ones are written to the store behind, and committed at the end of each batch.
+    """
+    def __init__(self, api: dict, quasimodo: Quasimodo, cache_store: Optional[CacheStore] = None):
         self.api = api
         self.quasimodo = quasimodo
-        if api.get("google", False):
-            self.google_suggestinos = utils.read_json(root / 'backend' / 'database' / 'google_suggestinos.json')
-        if api.get("openie", False):
-            self.openie_suggestinos = utils.read_json(root / 'backend' / 'database' / 'openie_suggestinos.json')
-        if api.get("quasimodo", False):
-            self.quasimodo_suggestinos = utils.read_json(root / 'backend' / 'database' / 'quasimodo_suggestinos.json')
-
-    def get_suggestions(self):
+        self.cache_store = cache_store or get_cache_store()
+        self.suggestions: Dict[str, Dict[Pair, List[str]]] = {}
+        self.lock = threading.RLock()
+
+    def get_index(self, source: str) -> Dict[Pair, List[str]]:
+        with self.lock:
+            if source not in self.suggestions:
+                self.suggestions[source] = self.cache_store.get_source(source)
+            return self.suggestions[source]
+
+    def get_cached_suggestions(self, source: str, entity: str, props: List[str], get_suggestions: Callable[[List[str]], Dict[str, List[str]]]) -> Dict[str, List[str]]:
+        index = self.get_index(source)
+        missing_props = [prop for prop in dict.fromkeys(props) if (entity, prop) not in index]
+        if missing_props:
+            # maybe another process already asked
+            stored = self.cache_store.get_many(source, [(entity, prop) for prop in missing_props])
+            # the props that are missing from the result (google blocked us) are not saved.
+            new = get_suggestions([prop for prop in missing_props if (entity, prop) not in stored])
+            for prop, suggestions in new.items():
+                self.cache_store.set(source, entity, prop, suggestions)
+            with self.lock:
+                index.update(stored)
+                index.update({(entity, prop): suggestions for prop, suggestions in new.items()})
+        return {prop: index.get((entity, prop), []) for prop in props}
+
+    def get_suggestions(self, entity: str, prop: str) -> List[str]:
+        return self.get_suggestions_batch(entity, [prop])[prop]
+
+    def get_suggestions_batch(self, entity: str, props: List[str]) -> Dict[str, List[str]]:
+        try:
+            return self.collect_suggestions(entity, props)
+        finally:
+            self.cache_store.commit()
+
+    def collect_suggestions(self, entity: str, props: List[str]) -> Dict[str, List[str]]:
+        no_suggestions = {prop: [] for prop in props}
         if self.api.get("quasimodo", False):
-            if f"{self.entity}#{self.prop}" in self.quasimodo_suggestinos:
-                quasimodo_suggestinos = self.quasimodo_suggestinos[f"{self.entity}#{self.prop}"]
-            else:
-                quasimodo_suggestinos = self.quasimodo.get_entity_suggestions(self.entity, self.prop, n_largest=5, plural_and_singular=True)
-                self.quasimodo_suggestinos[f"{self.entity}#{self.prop}"] = quasimodo_suggestinos  
-                with open(root / 'backend' / 'database' / 'quasimodo_suggestinos.json', 'w') as f2:
-                    json.dump(self.quasimodo_suggestinos, f2, indent='\t')
+            quasimodo_suggestinos = self.get_cached_suggestions(
+                'quasimodo_suggestinos', entity, props,
+                lambda props_: {prop: self.quasimodo.get_entity_suggestions(entity, prop, n_largest=5, plural_and_singular=True) for prop in props_}
+            )
         else:
-            quasimodo_suggestinos = []
+            quasimodo_suggestinos = no_suggestions
 
         if 'SKIP_GOOGLE' not in os.environ and self.api.get("google", False):
-            if f"{self.entity}#{self.prop}" in self.google_suggestinos:
-                google_suggestinos = self.google_suggestinos[f"{self.entity}#{self.prop}"]
-            else:
-                google_suggestinos = google_autosuggest.get_entity_suggestions(self.entity, self.prop)
-                self.google_suggestinos[f"{self.entity}#{self.prop}"] = google_suggestinos  
-                with open(root / 'backend' / 'database' / 'google_suggestinos.json', 'w') as f1:
-                    json.dump(self.google_suggestinos, f1, indent='\t')
+            google_suggestinos = self.get_cached_suggestions(
+                'google_suggestinos', entity, props,
+                lambda props_: google_autosuggest.get_entity_suggestions_batch(entity, props_)
+            )
         else:
-            google_suggestinos = []
+            google_suggestinos = no_suggestions
 
         if self.api.get("openie", False):
-            if f"{self.entity}#{self.prop}" in self.openie_suggestinos:
-                openie_suggestinos = self.openie_suggestinos[f"{self.entity}#{self.prop}"]
-            else:
-                openie_suggestinos = openIE.get_entity_suggestions_wrapper(self.entity, self.prop, n_largest=5)
-                self.openie_suggestinos[f"{self.entity}#{self.prop}"] = openie_suggestinos  
-                with open(root / 'backend' / 'database' / 'openie_suggestinos.json', 'w') as f3:
-                    json.dump(self.openie_suggestinos, f3, indent='\t')
+            openie_suggestinos = self.get_cached_suggestions(
+                'openie_suggestinos', entity, props,
+                lambda props_: {prop: openIE.get_entity_suggestions_wrapper(entity, prop, n_largest=5) for prop in props_}
+            )
         else:
-            openie_suggestinos = []
+            openie_suggestinos = no_suggestions
 
-        suggestions = google_suggestinos + quasimodo_suggestinos + openie_suggestinos
-        return [suggestion for suggestion in suggestions if suggestion not in IGNORE_SUGGESTION]
+        return {
+            prop: [suggestion for suggestion in google_suggestinos[prop] + quasimodo_suggestinos[prop] + openie_suggestinos[prop] if suggestion not in IGNORE_SUGGESTION]
+            for prop in props
+        }
+
+
+def get_suggestions_provider(unmutables: Dict[str, Unmutables], args: dict) -> Suggestions:
+    # the provider is one of the unmutables, so its suggestions are shared between the runs.
+    if "suggestions" not in unmutables:
+        unmutables["suggestions"] = Suggestions(api=args, quasimodo=unmutables["data_collector"].quasimodo)
+    return unmutables["suggestions"]
 
 
 def get_suggestions_for_missing_entities(base_not_mapped_entity: str, 
@@ -90,9 +121,10 @@ def get_suggestions_for_missing_entities(base_not_mapped_entity: str,
 
         actual_suggestions = []
         # we going to run over the relations we found, and extract suggestions with them.
-        for relation in set(relations1 + relations2):
-            suggestions_model = Suggestions(match_target_entity, relation, api=args, quasimodo=unmutables["data_collector"].quasimodo)
-            suggestions = suggestions_model.get_suggestions()
+        relations = list(set(relations1 + relations2))
+        relations_suggestions = get_suggestions_provider(unmutables, args).get_suggestions_batch(match_target_entity, relations)
+        for relation in relations:
+            suggestions = relations_suggestions[relation]
             # We take only 1 or 2 tokens (since it should be nouns).
             suggestions = [p for p in suggestions if len(p.split()) <= 2]
             if suggestions:
@@ -176,7 +208,7 @@ def get_new_domains(first_domain: str, solution: Solution, entity_not_mapped_yet
 
 
 def mapping_suggestions_create_new_solution(
-    available_pairs: List[List[SingleMatch]],
+    available_pairs: AvailablePairs,
     current_solution: Solution,
     solutions: List[Solution],
     top_suggestions: List[str],
@@ -187,7 +219,7 @@ def mapping_suggestions_create_new_solution(
     """this function is use for mapping in suggestions mode. this is only one iteration"""
     
     # we will get the top-num-of-suggestions with the best score.
-    best_results_for_current_iteration = get_best_pair_mapping(unmutables, available_pairs, cache, args["N"])
+    best_results_for_current_iteration = get_best_pair_mapping(unmutables, available_pairs, cache, args["N"], workers=args.get("workers", 1))
     for result in best_results_for_current_iteration:
         # if the best score is > 0, we will update the base and target lists of the already mapping entities.
         # otherwise, if the best score is 0, we have no more mappings to do.
@@ -196,6 +228,7 @@ def mapping_suggestions_create_new_solution(
             base_already_mapping_new = copy.deepcopy(current_solution.actual_base)
             target_already_mapping_new = copy.deepcopy(current_solution.actual_target)
             actual_mapping_indecies_new = copy.deepcopy(current_solution.actual_indecies)
+            mapping_key = current_solution.mapping_key
             b1, b2 = result["best_mapping"][0][0], result["best_mapping"][0][1]
             t1, t2 = result["best_mapping"][1][0], result["best_mapping"][1][1]
             
@@ -204,17 +237,17 @@ def mapping_suggestions_create_new_solution(
                 score += result["best_score"]
                 # score += get_score(base_already_mapping_new, target_already_mapping_new, b1, t1, cache)
                 update_already_mapping(b1, t1, base_already_mapping_new, target_already_mapping_new, actual_mapping_indecies_new)
+                mapping_key |= cache["encoder"].get_mapping_bit(b1, t1)
             
             if b2 not in base_already_mapping_new and t2 not in target_already_mapping_new:
                 score += result["best_score"]
                 # score += get_score(base_already_mapping_new, target_already_mapping_new, b2, t2, cache)
                 update_already_mapping(b2, t2, base_already_mapping_new, target_already_mapping_new, actual_mapping_indecies_new)
+                mapping_key |= cache["encoder"].get_mapping_bit(b2, t2)
             
-            mapping_repr = [f"{b} --> {t}" for b, t in zip(base_already_mapping_new, target_already_mapping_new)]
-            mapping_repr_as_tuple = tuple(sorted(mapping_repr))
-            if mapping_repr_as_tuple in cache["mappings"]:
+            if mapping_key in cache["mappings"]:
                 continue
-            cache["mappings"].add(mapping_repr_as_tuple)
+            cache["mappings"].add(mapping_key)
             
             # sometimes it found the same entity
             if target_already_mapping_new[-1] == base_already_mapping_new[-1]:
@@ -228,10 +261,10 @@ def mapping_suggestions_create_new_solution(
             coverage = copy.deepcopy(current_solution.coverage)
             coverage.append(result["coverage"])
             
-            relations_as_tuple = tuple([tuple(relation) for relation in sorted(relations)])
-            if relations_as_tuple in cache["relations"]:
+            relations_key = current_solution.relations_key | cache["encoder"].get_relation_bit(result["best_mapping"])
+            if relations_key in cache["relations"]:
                 continue
-            cache["relations"].add(relations_as_tuple)
+            cache["relations"].add(relations_key)
                 
             # updating the top suggestions for the GUI
             if domain == "actual_base":
@@ -249,6 +282,8 @@ def mapping_suggestions_create_new_solution(
                 actual_indecies=actual_mapping_indecies_new,
                 length=len(base_already_mapping_new),
                 coverage=coverage,
+                mapping_key=mapping_key,
+                relations_key=relations_key,
             ))
 
 
@@ -274,19 +309,20 @@ def mapping_suggestions_helper(
     new_target = res["new_target"]
     index_domain = res["index_domain"]
 
-    all_pairs = get_all_possible_pairs_map(new_base, new_target)
-    available_pairs = update_paris_map(all_pairs, solution.get_actual("actual_base"), solution.get_actual("actual_target"), solution.actual_indecies)
+    all_pairs = AvailablePairs(get_all_possible_pairs_map(new_base, new_target))
     
     # in the current iteration, if the relations (clusters now) came from earth:sun, and we know that
     # earth->electron, we allow only pairs that contains electron:t_i. Where t_i are the new suggsetions.
+    # so only the pairs that contains the suggestions are checked.
     pair_allows: Set[Tuple[str, str]] = set([(entity_from_second_domain, v) for v in suggestions])
-    available_pairs = [pair for pair in available_pairs if pair[0][index_domain] in pair_allows]
+    allowed = [i for i in all_pairs.containing(['base', 'target'][index_domain], suggestions) if all_pairs.pairs_map[i][0][index_domain] in pair_allows]
+    available_pairs = update_paris_map(all_pairs.select(allowed), solution.get_actual("actual_base"), solution.get_actual("actual_target"), solution.actual_indecies)
     if not available_pairs:
         return
     
     mapping_suggestions_create_new_solution(
         available_pairs=available_pairs,
-        current_solution=copy.deepcopy(solution),
+        current_solution=solution.copy(),
         solutions=solutions,
         top_suggestions=top_suggestions,
         domain=domain,
@@ -1,17 +1,41 @@
 import os
 import sys
+import copy
+import json
+import time
+import hashlib
+import tempfile
 import unittest
+import subprocess
+import threading
+from unittest import mock
+from contextlib import contextmanager
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import networkx as nx
 from pathlib import Path
 
 import yaml
 
 backend_dir = Path(__file__).resolve().parent.parent
 sys.path.insert(0, str(backend_dir))
-from mapping.dfs import dfs_wrapper
+from mapping.dfs import dfs_wrapper, dfs, apply_result, undo_result, SOLUTIONS_TO_RETURN
+from mapping import mapping
 from mapping.mapping import FREQUENCY_THRESHOLD
 from mapping.beam_search import beam_search_wrapper
-from mapping.quasimodo import Quasimodo, merge_tsvs
-from mapping import concept_net, google_autosuggest
+from mapping.quasimodo import Quasimodo, merge_tsvs, is_columns_folder_updated, COLUMNS_VERSION
+from mapping.data_collector import DataCollector
+from mapping.cache_store import CacheStore
+from mapping.pair_scores import PairScores, PairGraphs
+from mapping.suggestions import Suggestions
+from utils.embedding_store import EmbeddingStore
+from utils import utils
+from utils.sentence_embadding import SentenceEmbedding
+from frequency.frequency import Frequencies
+from app.jobs import JobQueue, JobStore
+from app.result_cache import ResultCache
+from mapping import concept_net, google_autosuggest, openIE, gpt3
 
 
 with open(backend_dir / 'tests' / 'tests.yaml', 'r') as y:
@@ -21,13 +45,29 @@ if 'CI' in os.environ:
     merge_tsvs()
 quasimodo = Quasimodo(path=str(backend_dir / 'tsv' / 'merged' / 'quasimodo.tsv'))
 
+
+@contextmanager
+def conceptnet_index_of(dump_path: Path):
+    # builds an index from the given assertions dump, and concept_net is using it instead of the real one.
+    with tempfile.TemporaryDirectory() as folder:
+        concept_net.build_conceptnet_index(dump_path, Path(folder) / 'conceptnet.sqlite')
+        with mock.patch.object(concept_net, "conceptnet_index", concept_net.ConceptNetIndex(Path(folder) / 'conceptnet.sqlite')):
+            yield concept_net.conceptnet_index
+
+
 class TestFunctions(unittest.TestCase):
 
     def test_concept_net(self):
-        # testing concept_net.get_entities_relations
-        reference = ['revolving around the']
-        actual = concept_net.get_entities_relations("earth", "sun")
-        self.assertEqual(sorted(reference), sorted(actual))
+        # testing concept_net.get_entities_relations, on an index that built from a small part of the assertions dump.
+        with conceptnet_index_of(backend_dir / 'tests' / 'conceptnet_assertions.csv') as conceptnet_index:
+            # the edges are sorted by their weight, and the non english ones are not indexed
+            self.assertEqual([("earth", "round", 3.464), ("earth", "revolving around the sun", 2.0), ("earth", "closer to the sun", 0.5)], conceptnet_index.get_edges("earth", "HasProperty"))
+            self.assertEqual([("earth", "a planet", 4.0)], conceptnet_index.get_edges("earth", "IsA"))
+
+            # the weight of 'closer to the sun' is under the threshold
+            reference = ['revolving around the']
+            actual = concept_net.get_entities_relations("earth", "sun")
+            self.assertEqual(sorted(reference), sorted(actual))
 
         # # testing concept_net.get_entity_props
         # reference = ['4.5 billion years old', 'a word', 'an oblate sphereoid', 'an oblate spheroid', 'finite', 'flat', 'one astronomical unit from the Sun', 'one of many planets', 'receive rain from clouds', 'revolving around the sun', 'round like a ball', 'spherical', 'spherical in shape', 'very beautiful', 'very heavy']
@@ -67,6 +107,51 @@ class TestFunctions(unittest.TestCase):
         actual = quasimodo.get_entities_relations('sun', 'earth', n_largest=5, plural_and_singular=True)
         self.assertEqual(sorted(reference), sorted(actual))
 
+    def test_google_autosuggest_stub_server(self):
+        # a local server that answers like google autosuggest, and blocks the queries about the moon.
+        received = []
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)["q"][0]
+                received.append(query)
+                if "moon" in query:
+                    self.send_response(403)
+                    self.end_headers()
+                    return
+                question, entity2 = query.split(" .* ")
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write(json.dumps([query, [f"{question} orbit {entity2}", f"{question} revolve around {entity2}"]]).encode())
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        fetcher, skip_google = google_autosuggest.fetcher, os.environ.pop('SKIP_GOOGLE', None)
+        # one worker, so the requests are sent in the order of the queries
+        google_autosuggest.fetcher = google_autosuggest.Fetcher(url=f"http://127.0.0.1:{server.server_address[1]}/complete/search", max_workers=1, rate=1000, capacity=100)
+        try:
+            with mock.patch.object(google_autosuggest, "secho") as secho:
+                actual = google_autosuggest.get_entities_relations_batch([("earth", "sun"), ("earth", "moon"), ("mars", "sun")])
+            self.assertEqual(["orbit", "revolve around"], actual[("earth", "sun")]["props"])
+            self.assertEqual([], actual[("earth", "moon")]["props"])
+            # google blocked us, so we stop asking: no request reached the server after the blocked one
+            self.assertIn('SKIP_GOOGLE', os.environ)
+            self.assertEqual([], actual[("mars", "sun")]["props"])
+            self.assertIn("moon", received[-1])
+            self.assertEqual(1, len([query for query in received if "moon" in query]))
+            self.assertFalse(any("mars" in query for query in received))
+            # only the blocked request is warned about
+            self.assertEqual(1, secho.call_count)
+        finally:
+            server.shutdown()
+            google_autosuggest.fetcher = fetcher
+            os.environ.pop('SKIP_GOOGLE', None)
+            if skip_google is not None:
+                os.environ['SKIP_GOOGLE'] = skip_google
+
+
     def test_google_autosuggest_relations(self):
         # the return values changed all the time, so we just check the API is not broken.
         for test in spec["google_autosuggest_relations"]:
@@ -111,7 +196,437 @@ class TestFunctions(unittest.TestCase):
                 sorted(actual),
                 f"sorted(reference)={sorted(reference)} != sorted(actual)={sorted(actual)}"
             )
-    
+
+    def test_quasimodo_relations(self):
+        for test in spec["quasimodo_relations"]:
+            reference = test["output"]
+            actual = quasimodo.get_entities_relations(
+                test["input"]["entities"][0],
+                test["input"]["entities"][1],
+                n_largest=test["input"]["n_largest"],
+                plural_and_singular=test["input"]["plural_and_singular"]
+            )
+            self.assertEqual(
+                sorted(reference),
+                sorted(actual),
+                f"sorted(reference)={sorted(reference)} != sorted(actual)={sorted(actual)}"
+            )
+
+    def test_quasimodo_similarity_between_entities(self):
+        for test in spec["quasimodo_similarity_between_entities"]:
+            reference = test["output"]
+            actual = [
+                f"{prop[0]} {prop[1]}"
+                for prop in quasimodo.get_similarity_between_entities(
+                    test["input"]["entities"][0],
+                    test["input"]["entities"][1],
+                    n_largest=test["input"]["n_largest"],
+                    plural_and_singular=test["input"]["plural_and_singular"]
+                )
+            ]
+            self.assertEqual(
+                sorted(reference),
+                sorted(actual),
+                f"sorted(reference)={sorted(reference)} != sorted(actual)={sorted(actual)}"
+            )
+
+
+    def test_data_collector_batch(self):
+        data_collector = DataCollector(api={"quasimodo": True, "openie": True}, quasimodo=quasimodo)
+        pairs = [("sun", "earth"), ("earth", "sun"), ("sun", "earth")]
+        actual = data_collector.get_entities_relations_batch(pairs)
+        self.assertEqual(sorted(set(pairs)), sorted(actual.keys()))
+        for entity1, entity2 in pairs:
+            reference = DataCollector(api={"quasimodo": True, "openie": True}, quasimodo=quasimodo).get_entities_relations(entity1, entity2)
+            self.assertEqual(reference, actual[(entity1, entity2)])
+
+
+    def test_columns_folder_updated(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path, columns = Path(folder) / 'quasimodo.tsv', Path(folder) / 'quasimodo_columns'
+            columns.mkdir()
+            with open(columns / 'meta.json', 'w') as f:
+                json.dump({"version": COLUMNS_VERSION}, f)
+            # without the tsv, the columns are used as long as they have the current format
+            self.assertTrue(is_columns_folder_updated(columns, path))
+            with open(columns / 'meta.json', 'w') as f:
+                json.dump({"version": COLUMNS_VERSION - 1}, f)
+            self.assertFalse(is_columns_folder_updated(columns, path))
+
+
+    def test_cache_store(self):
+        with tempfile.TemporaryDirectory() as folder:
+            with open(Path(folder) / 'quasimodo_edges.json', 'w') as f:
+                json.dump({"sun#earth": ["orbit"]}, f)
+            cache_store = CacheStore(path=Path(folder) / 'cache.sqlite', json_folder=Path(folder))
+            self.assertEqual(["orbit"], cache_store.get('quasimodo_edges', 'sun', 'earth'))
+            self.assertIsNone(cache_store.get('quasimodo_edges', 'earth', 'sun'))
+            
+            cache_store.set('quasimodo_edges', 'earth', 'sun', ["revolve around"])
+            cache_store.close()
+            cache_store = CacheStore(path=Path(folder) / 'cache.sqlite', json_folder=Path(folder))
+            self.assertEqual({("earth", "sun"): ["revolve around"]}, cache_store.get_many('quasimodo_edges', [('earth', 'sun'), ('moon', 'sun')]))
+            cache_store.set('quasimodo_edges', 'moon', 'earth', ["orbit"])
+            self.assertEqual({("sun", "earth"): ["orbit"], ("earth", "sun"): ["revolve around"], ("moon", "earth"): ["orbit"]}, cache_store.get_source('quasimodo_edges'))
+            cache_store.close()
+
+
+    def test_gpt3_completions(self):
+        with tempfile.TemporaryDirectory() as folder:
+            cache_store = CacheStore(path=Path(folder) / 'cache.sqlite', json_folder=None)
+            cache_store.set('gpt3_edges', 'earth', 'sun', ["The earth revolves around the sun."])
+            cache_store.commit()
+            api = mock.Mock(side_effect=lambda entity1, entity2: [f"The {entity1} orbits the {entity2}."])
+            with mock.patch.object(gpt3, "get_cache_store", return_value=cache_store), \
+                 mock.patch.object(gpt3, "get_entities_relations_api", api), \
+                 mock.patch.object(gpt3, "completions", None), \
+                 mock.patch.object(gpt3, "relations_memo", {}), \
+                 mock.patch.object(gpt3.time, "sleep"):
+                actual = gpt3.get_entities_relations_batch([("earth", "sun"), ("mars", "sun")], engine=None)
+                self.assertEqual(["revolves around the"], actual[("earth", "sun")])
+                self.assertEqual(["orbits the"], actual[("mars", "sun")])
+                # the api is asked once for each direction that is not in the store
+                self.assertEqual([mock.call("sun", "earth"), mock.call("mars", "sun"), mock.call("sun", "mars")], api.call_args_list)
+
+                # the same pair again is answered from the memo, without the completions
+                with mock.patch.object(gpt3, "get_completions") as get_completions:
+                    self.assertEqual(actual[("earth", "sun")], gpt3.get_entities_relations_batch([("earth", "sun")], engine=None)[("earth", "sun")])
+                get_completions.assert_not_called()
+                self.assertEqual(3, api.call_count)
+
+            # the end of the batch committed the new completions to the store
+            self.assertEqual({}, cache_store.pending)
+            stored = CacheStore(path=Path(folder) / 'cache.sqlite', json_folder=None).get_source('gpt3_edges')
+            self.assertEqual({("earth", "sun"), ("sun", "earth"), ("mars", "sun"), ("sun", "mars")}, set(stored))
+            cache_store.close()
+
+
+    def test_suggestions_provider(self):
+        class FakeQuasimodo(object):
+            calls = []
+            def get_entity_suggestions(self, entity, prop, n_largest=0, plural_and_singular=False):
+                self.calls.append((entity, prop))
+                return ["faraday", "the"] if prop == "discovered" else []
+
+        with tempfile.TemporaryDirectory() as folder:
+            cache_store = CacheStore(path=Path(folder) / 'cache.sqlite', json_folder=None)
+            provider = Suggestions(api={"quasimodo": True}, quasimodo=FakeQuasimodo(), cache_store=cache_store)
+            self.assertEqual({"discovered": ["faraday"], "invented": []}, provider.get_suggestions_batch("electricity", ["discovered", "invented"]))
+            self.assertEqual(["faraday"], provider.get_suggestions("electricity", "discovered"))
+            self.assertEqual([("electricity", "discovered"), ("electricity", "invented")], FakeQuasimodo.calls)
+
+            # a new provider reads the suggestions from the store
+            provider = Suggestions(api={"quasimodo": True}, quasimodo=FakeQuasimodo(), cache_store=CacheStore(path=Path(folder) / 'cache.sqlite', json_folder=None))
+            self.assertEqual(["faraday"], provider.get_suggestions("electricity", "discovered"))
+            self.assertEqual(2, len(FakeQuasimodo.calls))
+            cache_store.close()
+
+
+    def test_available_pairs(self):
+        base, target = ["earth", "sun", "gravity", "newton"], ["electrons", "nucleus", "electricity", "faraday"]
+        all_pairs = mapping.get_all_possible_pairs_map(base, target)
+        actual_base, actual_target, indecies = [], [], {'base': {}, 'target': {}}
+        available_pairs = mapping.AvailablePairs(all_pairs)
+        for b, t in [("sun", "nucleus"), ("earth", "electrons"), ("gravity", "electricity")]:
+            mapping.update_already_mapping(b, t, actual_base, actual_target, indecies)
+            available_pairs = mapping.update_paris_map(available_pairs, actual_base, actual_target, indecies)
+            expected = [pair for pair in all_pairs if mapping.check_if_valid(pair[0], actual_base, set(actual_base), actual_target, set(actual_target), indecies)]
+            self.assertEqual(expected, list(available_pairs))
+        self.assertIn([("newton", "sun"), ("faraday", "nucleus")], available_pairs)
+        self.assertNotIn([("newton", "sun"), ("faraday", "electrons")], available_pairs)
+
+
+    def test_dfs(self):
+        # a small problem, with a fake model and data collector. The score of each pair mapping is the average of 
+        # the scores of its two b->t (taken from their hash).
+        class FakeModel(object):
+            model_name = "fake"
+        class FakeFreq(object):
+            threshold = 0
+        class FakeDataCollector(object):
+            def get_sources(self):
+                return ()
+            def get_entities_relations(self, entity1, entity2):
+                return []
+
+        def get_mapping_score(unmutables, pair_mapping):
+            (b1, b2), (t1, t2) = pair_mapping[0]
+            scores = [int(hashlib.md5(f"{b}{t}".encode()).hexdigest()[:8], 16) / 0xffffffff for b, t in [(b1, t1), (b2, t2)]]
+            return round(sum(scores) / 2, 3), 1
+
+        def recursive_dfs(solutions, curr_solution, cache, N):
+            # the recursive traversal (with a copy of the solution for each child) that dfs replaced.
+            if curr_solution.actual_base:
+                relations_as_tuple = tuple([tuple(relation) for relation in sorted(curr_solution.relations)])
+                mapping_repr = [f"{b} --> {t}" for b, t in zip(curr_solution.actual_base, curr_solution.actual_target)]
+                if relations_as_tuple in cache["relations"] or tuple(sorted(mapping_repr)) in cache["mappings"]:
+                    return
+                cache["relations"].add(relations_as_tuple)
+                cache["mappings"].add(tuple(sorted(mapping_repr)))
+                curr_solution.mapping = mapping_repr
+                solutions.append(curr_solution)
+            if len(curr_solution.actual_base) == min(len(base), len(target)):
+                return
+            best_results_for_current_iteration, modified_results = mapping.get_best_pair_mapping_for_current_iteration(curr_solution.availables, curr_solution.sorted_results, N)
+            for result in best_results_for_current_iteration:
+                if result["best_score"] > 0:
+                    # availables and sorted_results are only replaced, so they are not copied (it is quicker).
+                    solution_copy = copy.deepcopy(curr_solution, {id(curr_solution.availables): curr_solution.availables, id(curr_solution.sorted_results): curr_solution.sorted_results})
+                    solution_copy.relations.append(result["best_mapping"])
+                    solution_copy.scores.append(round(result["best_score"], 3))
+                    solution_copy.coverage.append(result["coverage"])
+                    score = 0
+                    for b, t in zip(result["best_mapping"][0], result["best_mapping"][1]):
+                        if b not in solution_copy.actual_base and t not in solution_copy.actual_target:
+                            score += mapping.get_score(solution_copy.actual_base, solution_copy.actual_target, b, t, cache["scores"])
+                            mapping.update_already_mapping(b, t, solution_copy.actual_base, solution_copy.actual_target, solution_copy.actual_indecies)
+                    solution_copy.score += round(score, 3)
+                    solution_copy.availables = mapping.update_paris_map(solution_copy.availables, solution_copy.actual_base, solution_copy.actual_target, solution_copy.actual_indecies)
+                    solution_copy.length = len(solution_copy.actual_base)
+                    solution_copy.sorted_results = modified_results
+                    recursive_dfs(solutions, solution_copy, cache, N)
+
+        def get_initial_solution(best_results, available_pairs):
+            return mapping.Solution(mapping=[], relations=[], scores=[], score=0, actual_base=[], actual_target=[], actual_indecies={'base': {}, 'target': {}},
+                                    length=0, coverage=[], sorted_results=best_results, availables=mapping.AvailablePairs(available_pairs))
+
+        def get_top(solutions):
+            solutions = sorted(solutions, key=lambda x: (x.length, x.score), reverse=True)[:SOLUTIONS_TO_RETURN]
+            return [(solution.mapping, solution.score, solution.relations, solution.scores) for solution in solutions]
+
+        base, target = ["earth", "sun", "gravity", "newton"], ["electrons", "nucleus", "electricity", "faraday", "proton"]
+        unmutables = {"model": FakeModel(), "data_collector": FakeDataCollector(), "freq": FakeFreq()}
+        available_pairs = mapping.get_all_possible_pairs_map(base, target)
+        cache = mapping.get_cache()
+        with mock.patch.object(mapping, "get_mapping_score", get_mapping_score):
+            best_results = mapping.get_best_pair_mapping(unmutables, available_pairs, cache)
+
+        reference = []
+        recursive_dfs(reference, get_initial_solution(best_results, available_pairs), {"scores": cache["scores"], "mappings": set(), "relations": set()}, N=16)
+        visited = []
+        # the bound is used only when there are no suggestions (or base and target are in the same size)
+        for num_of_suggestions in [1, 0]:
+            solutions = []
+            initial_solution = get_initial_solution(best_results, available_pairs)
+            dfs(base, target, solutions, initial_solution, dict(mapping.get_cache(), scores=cache["scores"]), {"num_of_suggestions": num_of_suggestions, "N": 16})
+            self.assertEqual(get_top(reference), get_top(solutions))
+            visited.append(len(solutions))
+            # the initial solution is restored after going back from all the children
+            self.assertEqual(([], {'base': {}, 'target': {}}, 0, 0, 0), (initial_solution.actual_base, initial_solution.actual_indecies, initial_solution.score, initial_solution.mapping_key, initial_solution.relations_key))
+        self.assertEqual(len(reference), visited[0])
+        self.assertLess(visited[1], visited[0])
+
+        # undo_result restores what apply_result changed
+        solution_cache = dict(mapping.get_cache(), scores=cache["scores"])
+        solution = get_initial_solution(best_results, available_pairs)
+        apply_result(solution, best_results[0], best_results, solution_cache)
+        second = next(result for result in best_results if result["best_mapping"] in solution.availables)
+        state = copy.deepcopy((solution.actual_base, solution.actual_target, solution.actual_indecies, solution.relations, solution.scores, solution.score, solution.length, solution.mapping_key, solution.relations_key))
+        availables, sorted_results = solution.availables, solution.sorted_results
+        undo = apply_result(solution, second, best_results[1:], solution_cache)
+        self.assertNotEqual(state[7], solution.mapping_key)
+        undo_result(solution, undo)
+        self.assertEqual(state, (solution.actual_base, solution.actual_target, solution.actual_indecies, solution.relations, solution.scores, solution.score, solution.length, solution.mapping_key, solution.relations_key))
+        self.assertIs(availables, solution.availables)
+        self.assertIs(sorted_results, solution.sorted_results)
+
+
+    def test_similarity_matrix(self):
+        class FakeFreq(object):
+            stopwords = {"be"}
+
+        model = SentenceEmbedding(store_folder=None)
+        props1, props2 = ["revolve around", "be", "orbit"], ["circle", "pull", "be"]
+        similarities = model.similarity_matrix(props1, props2)
+        for i, prop1 in enumerate(props1):
+            for j, prop2 in enumerate(props2):
+                self.assertEqual(model.similarity(prop1, prop2), similarities[i, j])
+
+        # the stopwords rows and columns are masked
+        similarities = utils.get_similarity_matrix(model, props1, props2, FakeFreq())
+        self.assertTrue(np.all(similarities[1, :] == 0))
+        self.assertTrue(np.all(similarities[:, 2] == 0))
+        self.assertEqual(model.similarity("orbit", "circle"), similarities[2, 0])
+
+
+    def test_clustering(self):
+        model = SentenceEmbedding(store_folder=None)
+        tokens = ["revolve around", "orbit", "circle", "attract", "pull"]
+        with mock.patch.object(model, "get_cluster_assignment", wraps=model.get_cluster_assignment) as get_cluster_assignment:
+            clusters = model.clustering(tokens, distance_threshold=mapping.DEFAULT_DIST_THRESHOLD_FOR_CLUSTERS)
+            # the same tokens in another order are the same clusters, taken from the memo
+            for permutation in [list(reversed(tokens)), sorted(tokens), tokens[2:] + tokens[:2]]:
+                actual = model.clustering(permutation, distance_threshold=mapping.DEFAULT_DIST_THRESHOLD_FOR_CLUSTERS)
+                self.assertEqual({cluster: sorted(props) for cluster, props in clusters.items()}, {cluster: sorted(props) for cluster, props in actual.items()})
+            self.assertEqual(1, get_cluster_assignment.call_count)
+        self.assertEqual(1, len(model.clusters))
+
+
+    def test_maximum_weighted_match(self):
+        # the same matches as networkx.minimum_weight_full_matching (which was used before), nan is a missing edge.
+        from networkx.algorithms import bipartite
+        matrices = [
+            [[0.9, 0.2, 0.4], [0.3, 0.8, 0.1], [0.5, 0.6, 0.7]],
+            [[0.1, 0.7, 0.3, 0.5], [0.6, 0.2, 0.9, 0.4]],
+            [[0.1, 0.7], [0.6, 0.2], [0.35, 0.9], [0.45, 0.8]],
+            [[np.nan, 0.7, 0.3], [0.6, np.nan, np.nan], [0.2, 0.5, np.nan]],
+            [[0.8, np.nan, np.nan, 0.4], [np.nan, 0.3, 0.6, np.nan]],
+        ]
+        for matrix in matrices:
+            n1, n2 = len(matrix), len(matrix[0])
+            weights = {(i, n1 + j): ("", "", matrix[i][j]) for i in range(n1) for j in range(n2) if not np.isnan(matrix[i][j])}
+            graph = nx.Graph()
+            graph.add_nodes_from(range(n1 + n2))
+            for (head, tail), edge in weights.items():
+                graph.add_edge(head, tail, weight=max(0, 1 - edge[2]))
+            matching = bipartite.matching.minimum_weight_full_matching(graph, top_nodes=range(n1), weight='weight')
+            reference = sorted((head, tail, weights[(head, tail)][2]) for head, tail in matching.items() if head < n1)
+            actual = sorted(utils.get_maximum_weighted_match(None, [""] * n1, [""] * n2, weights=weights))
+            self.assertEqual(reference, actual)
+
+
+    def test_threaded_pair_scoring(self):
+        # the pair mappings scored in threads are the same as the serial scoring. Each run has its own model and 
+        # scores/graphs caches, so the second run is encoding and scoring everything again.
+        base, target = ["earth", "sun", "gravity", "newton"], ["electrons", "nucleus", "electricity", "faraday"]
+        available_pairs = mapping.get_all_possible_pairs_map(base, target)
+        data_collector = DataCollector(api={"quasimodo": True}, quasimodo=quasimodo)
+        mapping.prefetch_entities_relations(data_collector, base, target)
+        freq = Frequencies(backend_dir / 'frequency' / 'freq.json', threshold=float(FREQUENCY_THRESHOLD))
+        results = []
+        for workers in [1, 4]:
+            unmutables = {"model": SentenceEmbedding(store_folder=None), "data_collector": data_collector, "freq": freq}
+            cache = mapping.get_cache()
+            with mock.patch.object(mapping, "get_pair_scores", return_value=PairScores()), \
+                 mock.patch.object(mapping, "get_pair_graphs", return_value=PairGraphs()):
+                best_results = mapping.get_best_pair_mapping(unmutables, available_pairs, cache, workers=workers)
+            results.append((best_results, dict(cache["scores"])))
+        self.assertEqual(results[0], results[1])
+
+
+    def test_openie_store(self):
+        with tempfile.TemporaryDirectory() as folder:
+            (Path(folder) / 's').mkdir()
+            with open(Path(folder) / 's' / 'u.tsv', 'w') as f:
+                f.write("sun\theat\tearth\nsun\tlight\tearth\nsun\tpull\tearth\nbad line\nsun\tlight\tearth\nsun\twarm\tmoon\n")
+            openIE.build_openie_store(Path(folder), Path(folder) / 'openie.sqlite')
+            openie_store = openIE.OpenIEStore(Path(folder) / 'openie.sqlite')
+            self.assertEqual(["light", "heat", "pull"], openie_store.get_relations("sun", "earth"))
+            self.assertEqual(["light", "heat"], openie_store.get_relations("sun", "earth", n=2))
+            self.assertEqual([], openie_store.get_relations("earth", "sun"))
+
+
+    def test_pair_scores(self):
+        context = ('msmarco-distilbert-base-v4', 500.0, ('openie', 'quasimodo'))
+        mapping = [[("earth", "sun"), ("electrons", "nucleus")], [("sun", "earth"), ("nucleus", "electrons")]]
+        other = [[("earth", "gravity"), ("electrons", "electricity")], [("gravity", "earth"), ("electricity", "electrons")]]
+        with tempfile.TemporaryDirectory() as folder:
+            cache_store = CacheStore(path=Path(folder) / 'cache.sqlite', json_folder=None)
+            pair_scores = PairScores(max_size=1, cache_store=cache_store)
+            pair_scores.set_many(context, [mapping, other], [(1.5, 10), (0.5, 3)])
+            # the other direction is the same pair
+            self.assertEqual({0: (1.5, 10)}, pair_scores.get_many(context, [mapping[::-1]]))
+            self.assertEqual({}, pair_scores.get_many(context[:2] + (('openie',),), [mapping]))
+            self.assertEqual(1, len(pair_scores.scores))
+            
+            pair_scores = PairScores(cache_store=cache_store)
+            self.assertEqual({0: (0.5, 3), 1: (1.5, 10)}, pair_scores.get_many(context, [other, mapping]))
+            cache_store.close()
+
+        pair_graphs = PairGraphs(max_size=1)
+        pair_graphs.set(context, mapping[0], {"score": 1.5})
+        self.assertEqual({"score": 1.5}, pair_graphs.get(context, [list(mapping[0][0]), mapping[0][1]]))
+        self.assertIsNone(pair_graphs.get(context, mapping[1]))
+        pair_graphs.set(context, other[0], {})
+        self.assertIsNone(pair_graphs.get(context, mapping[0]))
+
+
+    def test_jobs(self):
+        def run(params, progress):
+            progress({"pairs_scored": 18, "depth": 3})
+            if not params["base"]:
+                raise ValueError("empty base")
+            return {"mapping": params["base"]}
+
+        with tempfile.TemporaryDirectory() as folder:
+            queue = JobQueue(run=run, store=JobStore(Path(folder) / 'jobs.sqlite'), max_workers=1, max_pending=2)
+            done_id, failed_id = queue.submit({"base": ["earth"]}), queue.submit({"base": []})
+            queue.get_executor().shutdown(wait=True)
+            job = queue.get(done_id)
+            self.assertEqual(("done", {"mapping": ["earth"]}, {"pairs_scored": 18, "depth": 3}), (job["status"], job["result"], job["progress"]))
+            self.assertEqual(("failed", "ValueError('empty base')"), (queue.get(failed_id)["status"], queue.get(failed_id)["error"]))
+            self.assertIsNone(queue.get("unknown"))
+
+
+    def test_result_cache(self):
+        key = ResultCache.get_key(base=["earth", "sun"], target=["electrons", "nucleus"], depth=3)
+        self.assertEqual(key, ResultCache.get_key(depth=3, target=["electrons", "nucleus"], base=["earth", "sun"]))
+        with tempfile.TemporaryDirectory() as folder:
+            cache_store = CacheStore(path=Path(folder) / 'cache.sqlite', json_folder=None)
+            results = ResultCache(ttl=60, max_size=1, cache_store=cache_store)
+            results.set(key, {"data": [1]})
+            results.set("other", {"data": [2]})
+            self.assertEqual(1, len(results.results))
+            # evicted from the memory, but still in the store
+            self.assertEqual({"data": [1]}, results.get(key))
+            self.assertEqual({"data": [1]}, ResultCache(ttl=60, cache_store=cache_store).get(key))
+
+            # only the last store_size results are kept in the store, and the expired ones are deleted when they are found
+            results = ResultCache(ttl=60, cache_store=cache_store, store_size=2)
+            results.set("third", {"data": [3]})
+            self.assertEqual({("other", ""), ("third", "")}, set(cache_store.get_source("mapping_results")))
+            results = ResultCache(ttl=0.05, cache_store=cache_store)
+            results.set("expired", {"data": [4]})
+            time.sleep(0.1)
+            self.assertIsNone(ResultCache(ttl=60, cache_store=cache_store).get("expired"))
+            self.assertNotIn(("expired", ""), cache_store.get_source("mapping_results"))
+            cache_store.close()
+
+        results = ResultCache(ttl=0.05)
+        results.set(key, {"data": [1]})
+        time.sleep(0.1)
+        self.assertIsNone(results.get(key))
+
+
+    def test_progress(self):
+        counters, events = [], []
+        progress = mapping.Progress(counters.append, lambda name, solution: events.append((name, solution.length, solution.score)))
+        for length, score in [(2, 1.0), (2, 0.5), (3, 0.2), (3, 0.2)]:
+            progress.add_solution(mapping.Solution(mapping=[], relations=[], scores=[], score=score, actual_base=[], actual_target=[], actual_indecies={}, length=length, coverage=[]))
+        # only the better solutions are sent
+        self.assertEqual([("solution", 2, 1.0), ("solution", 3, 0.2)], events)
+
+        progress.add("pairs_scored", 18)
+        progress.set_max("depth", 3)
+        progress.set_max("depth", 2)
+        self.assertEqual([{"pairs_scored": 18, "depth": 0}, {"pairs_scored": 18, "depth": 3}], counters)
+
+
+    def test_import_time(self):
+        # the entry points should not import the heavy dependencies (they are imported only when they are needed),
+        # so starting them stays quick. The budget is in seconds.
+        heavy = ["torch", "sentence_transformers", "sklearn", "scipy", "gensim", "openai", "bs4", "requests", "pandas"]
+        budget = float(os.environ.get("IMPORT_TIME_BUDGET", 3))
+        code = "import sys, time, json; sys.path.insert(0, sys.argv[2]); start = time.time(); __import__(sys.argv[1]); print(json.dumps([time.time() - start, [m for m in sys.argv[3:] if m in sys.modules]]))"
+        for module in ["app.app", "evaluation.evaluation"]:
+            output = subprocess.run([sys.executable, "-c", code, module, str(backend_dir)] + heavy, env=dict(os.environ, SKIP_WARM_UP="1"), capture_output=True, text=True, check=True).stdout
+            import_time, loaded = json.loads(output.splitlines()[-1])
+            self.assertEqual([], loaded, module)
+            self.assertLess(import_time, budget, module)
+
+
+    def test_embedding_store(self):
+        with tempfile.TemporaryDirectory() as folder:
+            store = EmbeddingStore(Path(folder), dim=4)
+            vectors = np.arange(8, dtype=np.float32).reshape(2, 4)
+            store.add(["orbit", "revolve around"], vectors)
+            self.assertEqual(["orbit"], list(store.get_many(["orbit", "pull in"]).keys()))
+
+            # another worker should see the same embeddings
+            store = EmbeddingStore(Path(folder), dim=4)
+            self.assertTrue(np.array_equal(vectors[1], store.get("revolve around")))
+            self.assertIsNone(store.get("pull in"))
+
 
     # def test_suggestions(self):
     #     # testing get_score_between_two_entitites
@@ -0,0 +1,97 @@
+import os
+import json
+import fcntl
+import threading
+from pathlib import Path
+from typing import List, Dict, Optional
+
+import numpy as np
+
+root = Path(__file__).resolve().parent.parent.parent
+EMBEDDINGS_FOLDER = root / 'backend' / 'cache' / 'embeddings'
+
+
+class EmbeddingStore(object):
+    """
+    Embeddings of phrases that already encoded by a model, saved on disk so they can be reused between runs and workers.
+    The vectors are one float32 matrix (vectors.bin, memory-mapped), and phrases.jsonl holds the phrase of each row.
+    Both files are append-only, the vectors of a row are written before its phrase, so a phrase is always
+    pointing to a complete vector.
+    """
+    def __init__(self, folder: Path, dim: int):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.row_size = dim * np.dtype(np.float32).itemsize
+        self.vectors_path = self.folder / 'vectors.bin'
+        self.phrases_path = self.folder / 'phrases.jsonl'
+        self.lock_path = self.folder / '.lock'
+        self.lock = threading.RLock()
+        self.index: Dict[str, int] = {}
+        self.rows = 0
+        self.phrases_offset = 0
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.check_meta()
+        self.refresh()
+
+    def check_meta(self):
+        meta_path = self.folder / 'meta.json'
+        if meta_path.exists():
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            if meta["dim"] != self.dim:
+                raise ValueError(f"the embeddings in {self.folder} are of dimension {meta['dim']}, expected {self.dim}")
+        else:
+            with open(meta_path, 'w') as f:
+                json.dump({"dim": self.dim}, f, indent='\t')
+
+    def refresh(self):
+        # reading the phrases that added since the last time (maybe by another process).
+        with self.lock:
+            if not self.phrases_path.exists() or self.phrases_path.stat().st_size == self.phrases_offset:
+                return
+            with open(self.phrases_path, 'rb') as f:
+                f.seek(self.phrases_offset)
+                content = f.read()
+            # only complete lines, the last one can be in the middle of writing.
+            content = content[:content.rfind(b'\n') + 1]
+            for line in content.splitlines():
+                self.index[json.loads(line)] = self.rows
+                self.rows += 1
+            self.phrases_offset += len(content)
+
+    def get_vectors(self) -> np.ndarray:
+        if len(self.vectors) < self.rows:
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(self.rows, self.dim))
+        return self.vectors
+
+    def get_many(self, phrases: List[str]) -> Dict[str, np.ndarray]:
+        # returns only the phrases that are in the store.
+        with self.lock:
+            if any(phrase not in self.index for phrase in phrases):
+                self.refresh()
+            vectors = self.get_vectors()
+            return {phrase: vectors[self.index[phrase]] for phrase in phrases if phrase in self.index}
+
+    def get(self, phrase: str) -> Optional[np.ndarray]:
+        return self.get_many([phrase]).get(phrase)
+
+    def add(self, phrases: List[str], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(phrases), self.dim)
+        with self.lock, open(self.lock_path, 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                # dropping leftovers of a process that died in the middle of writing.
+                with open(self.phrases_path, 'ab') as f:
+                    f.truncate(self.phrases_offset)
+                with open(self.vectors_path, 'ab') as f:
+                    f.truncate(self.rows * self.row_size)
+                    f.write(vectors.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                with open(self.phrases_path, 'ab') as f:
+                    f.write(b''.join(json.dumps(phrase).encode('utf-8') + b'\n' for phrase in phrases))
+                self.refresh()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -1,25 +1,59 @@
-from typing import List, Dict
+import threading
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple, FrozenSet, Union
 
-import torch
 import numpy as np
 from click import secho
-from sklearn.cluster import AgglomerativeClustering
-from sentence_transformers import SentenceTransformer, util
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
-device = "mps" if torch.backends.mps.is_available() else device
+from utils.embedding_store import EmbeddingStore, EMBEDDINGS_FOLDER
 
+CLUSTERS_CACHE_SIZE = 100000
 
-class SentenceEmbedding(SentenceTransformer):
-    def __init__(self, model: str = 'msmarco-distilbert-base-v4'):
-        super().__init__(model, device=device)
+
+class SentenceEmbedding(object):
+    """
+    sBERT model with the embeddings (in memory and on disk) and the clusters of the props we already saw.
+    torch, sentence_transformers and sklearn are slow to import, so they are imported only when they are needed (creating a model, clustering).
+    """
+    def __init__(self, model: str = 'msmarco-distilbert-base-v4', store_folder: Optional[Path] = EMBEDDINGS_FOLDER):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model, device=get_device())
+        self.model_name = model
         self.embaddings = {}
+        # the pairs can be scored in threads, so a phrase that is missing is encoded (and added to the store) only once.
+        self.embaddings_lock = threading.RLock()
+        self.clusters: Dict[Tuple[FrozenSet[str], float], Dict[str, int]] = {}
+        self.clusters_lock = threading.Lock()
+        # the embeddings are also saved on disk, so we don't need to encode the same phrases on every run.
+        self.store = None
+        if store_folder:
+            self.store = EmbeddingStore(Path(store_folder) / model.replace('/', '__'), dim=self.model.get_sentence_embedding_dimension())
 
     
+    def encode(self, sentences: Union[str, List[str]], **kwargs) -> np.ndarray:
+        return self.model.encode(sentences, **kwargs)
+
+
     def encode_sentence(self, sentence: str):
         # saving the embadding of the given sentence
-        embedding = super().encode(sentence)
-        self.embaddings[sentence] = embedding
+        self.get_embeddings([sentence])
+
+
+    def get_embeddings(self, sentences: List[str]) -> np.ndarray:
+        # first we are looking in the memory, then in the store, and only the rest are encoded (in one batch).
+        with self.embaddings_lock:
+            missing = [sentence for sentence in dict.fromkeys(sentences) if sentence not in self.embaddings]
+            if missing and self.store:
+                stored = self.store.get_many(missing)
+                self.embaddings.update(stored)
+                missing = [sentence for sentence in missing if sentence not in stored]
+            if missing:
+                embeddings = self.model.encode(missing)
+                if self.store:
+                    self.store.add(missing, embeddings)
+                for sentence, embedding in zip(missing, embeddings):
+                    self.embaddings[sentence] = embedding
+            return np.stack([self.embaddings[sentence] for sentence in sentences])
     
 
     def similarity(self, sentence1: str, sentence2: str, verbose: bool = False) -> float:
@@ -30,6 +64,7 @@ class SentenceEmbedding(SentenceTransformer):
             self.encode_sentence(sentence2)
 
         # https://www.sbert.net/docs/usage/semantic_textual_similarity.html
+        from sentence_transformers import util
         similarity = round(util.pytorch_cos_sim(self.embaddings[sentence1], self.embaddings[sentence2]).item(), 3)
         if verbose:
             secho(f"{sentence1} ~ {sentence2},  ", fg='blue', nl=False)
@@ -37,6 +72,16 @@ class SentenceEmbedding(SentenceTransformer):
         return similarity
     
 
+    def similarity_matrix(self, sentences1: List[str], sentences2: List[str]) -> np.ndarray:
+        # the similarity of each sentence in sentences1 to each sentence in sentences2 (rounded as in similarity).
+        if not sentences1 or not sentences2:
+            return np.zeros((len(sentences1), len(sentences2)))
+        from sentence_transformers import util
+        embeddings = self.get_embeddings(list(sentences1) + list(sentences2))
+        similarities = util.pytorch_cos_sim(embeddings[:len(sentences1)], embeddings[len(sentences1):]).numpy()
+        return np.round(similarities.astype(np.float64), 3)
+    
+
     def clustering(self, tokens: List[str], distance_threshold: float) -> Dict[int, List[str]]:
         if not tokens:
             return {}
@@ -45,24 +90,51 @@ class SentenceEmbedding(SentenceTransformer):
         if len(tokens) == 1:
             return {0: tokens}
         
+        if len(set(tokens)) < len(tokens):
+            # duplicates are changing the average distances, so it is not the same clustering as of the unique tokens.
+            return get_clusters(tokens, self.get_cluster_assignment(tokens, distance_threshold))
+
+        # the same lists of props are clustered many times (for each pair that they are part of).
+        # the assignment is calculated on the sorted tokens, which is the order that we usually get them.
+        key = (frozenset(tokens), distance_threshold)
+        assignment = self.clusters.get(key)
+        if assignment is None:
+            sorted_tokens = sorted(tokens)
+            assignment = dict(zip(sorted_tokens, self.get_cluster_assignment(sorted_tokens, distance_threshold)))
+            with self.clusters_lock:
+                self.clusters[key] = assignment
+                if len(self.clusters) > CLUSTERS_CACHE_SIZE:
+                    del self.clusters[next(iter(self.clusters))]
+        return get_clusters(tokens, [assignment[token] for token in tokens])
+
+
+    def get_cluster_assignment(self, tokens: List[str], distance_threshold: float) -> np.ndarray:
         # https://github.com/UKPLab/sentence-transformers/blob/master/examples/applications/clustering/agglomerative.py
-        corpus_embeddings = self.encode(tokens)
+        corpus_embeddings = self.get_embeddings(tokens)
         corpus_embeddings = corpus_embeddings / np.linalg.norm(corpus_embeddings, axis=1, keepdims=True)
 
         # https://scikit-learn.org/stable/modules/generated/sklearn.cluster.AgglomerativeClustering.html
+        from sklearn.cluster import AgglomerativeClustering
         clustering_model = AgglomerativeClustering(n_clusters=None, affinity='cosine', linkage='average', distance_threshold=distance_threshold)
         clustering_model.fit(corpus_embeddings)
-        cluster_assignment = clustering_model.labels_
+        return clustering_model.labels_
 
-        clustered_sentences = {}
-        for sentence_id, cluster_id in enumerate(cluster_assignment):
-            if cluster_id not in clustered_sentences:
-                clustered_sentences[cluster_id] = []
-            clustered_sentences[cluster_id].append(tokens[sentence_id])
 
-        # the key is the id of the cluster (0,1,...) and the value is a list of props
-        return dict(sorted(clustered_sentences.items()))
-    
+def get_device() -> str:
+    import torch
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    return "mps" if torch.backends.mps.is_available() else device
+
+
+def get_clusters(tokens: List[str], cluster_assignment: List[int]) -> Dict[int, List[str]]:
+    clustered_sentences = {}
+    for sentence_id, cluster_id in enumerate(cluster_assignment):
+        if cluster_id not in clustered_sentences:
+            clustered_sentences[cluster_id] = []
+        clustered_sentences[cluster_id].append(tokens[sentence_id])
+
+    # the key is the id of the cluster (0,1,...) and the value is a list of props
+    return dict(sorted(clustered_sentences.items()))
 
 
 if __name__ == '__main__':
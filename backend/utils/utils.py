@@ -2,9 +2,8 @@ import json
 from pathlib import Path
 from typing import List, Dict, Tuple, Union, Optional
 
-import networkx as nx
+import numpy as np
 from click import secho
-from networkx.algorithms import bipartite
 
 from utils.sentence_embadding import SentenceEmbedding
 
@@ -56,10 +55,11 @@ def get_edges_combinations(edge1: Tuple[str, str], edge2: Tuple[str, str]):
 
 
 def get_ordered_edges_similarity(model: SentenceEmbedding, cluster1: List[str], cluster2: List[str]):
+    similarities = model.similarity_matrix(cluster1, cluster2).tolist()
     edges = []
-    for edge1 in cluster1:
-        for edge2 in cluster2:
-            edges.append((edge1, edge2, model.similarity(edge1, edge2)))
+    for i, edge1 in enumerate(cluster1):
+        for j, edge2 in enumerate(cluster2):
+            edges.append((edge1, edge2, similarities[i][j]))
     return sorted(edges, key=lambda x: x[2], reverse=True)
 
 
@@ -75,6 +75,14 @@ def get_edge_score(prop1: str, prop2: str, model: SentenceEmbedding, freq) -> fl
         return model.similarity(prop1, prop2)
 
 
+def get_similarity_matrix(model: SentenceEmbedding, props_edge1: List[str], props_edge2: List[str], freq) -> np.ndarray:
+    # same as get_edge_score for all the pairs together, the stopwords are masked to 0.
+    similarities = model.similarity_matrix(props_edge1, props_edge2)
+    similarities[np.array([prop in freq.stopwords for prop in props_edge1], dtype=bool), :] = 0
+    similarities[:, np.array([prop in freq.stopwords for prop in props_edge2], dtype=bool)] = 0
+    return similarities
+
+
 def get_maximum_weighted_match(model: SentenceEmbedding, 
                             props_edge1: Union[List[str], Dict[int, List[str]]],
                             props_edge2: Union[List[str], Dict[int, List[str]]], 
@@ -87,31 +95,25 @@ def get_maximum_weighted_match(model: SentenceEmbedding,
             secho("[ERROR] in clusters mode, weights has two calculated before", fg="red", bold=True)
             exit(1)
 
-    B = nx.Graph()
-    B.add_nodes_from(list(range(len(props_edge1))), bipartite=0)
-    B.add_nodes_from(list(range(len(props_edge1), len(props_edge1) + len(props_edge2))), bipartite=1)
-
-    all_edges = {}
-    for i, prop1 in enumerate(props_edge1):
-        for j, prop2 in enumerate(props_edge2):
-            if weights:
-                if (i, len(props_edge1) + j) not in weights:
-                    continue
-                similatiry = weights[(i, len(props_edge1) + j)][2]
-            else:
-                similatiry = get_edge_score(prop1, prop2, model, freq)
-            B.add_edge(i, len(props_edge1) + j, weight=max(0, 1-similatiry))
-            all_edges[(i, len(props_edge1) + j)] = similatiry
-
-    best_matching = bipartite.matching.minimum_weight_full_matching(B, weight='weight')
-    similatiry_edges = []
-    already_seen = set()
-    for head, tail in best_matching.items():
-        if (head, tail) not in already_seen and (tail, head) not in already_seen:
-            similatiry_edges.append((head, tail, all_edges[(head, tail)]))
-            already_seen.add((head, tail))
-
-    return similatiry_edges
+    # the weights matrix of the bipartite graph, rows are props_edge1 and columns are props_edge2. 
+    # missing edges are nan, and can't be chosen by the solver.
+    n1, n2 = len(props_edge1), len(props_edge2)
+    if weights:
+        similarities = np.full((n1, n2), np.nan)
+        for (head, tail), edge in weights.items():
+            similarities[head, tail - n1] = edge[2]
+    else:
+        similarities = get_similarity_matrix(model, props_edge1, props_edge2, freq)
+    if n1 == 0 or n2 == 0:
+        return []
+    costs = np.where(np.isnan(similarities), np.inf, np.maximum(0, 1 - similarities))
+
+    # scipy is slow to import, so it is imported only here.
+    from scipy.optimize import linear_sum_assignment
+    # networkx solved the same matrix (with its columns in the order of a set), the minimal matching is unique unless 
+    # there are ties, and then both matchings have the same total weight.
+    rows_ind, columns_ind = linear_sum_assignment(costs)
+    return [(int(row), n1 + int(column), float(similarities[row, column])) for row, column in zip(rows_ind, columns_ind)]
 
 
 def is_none(val):
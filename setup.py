@@ -25,6 +25,7 @@ setup(
     'requests',
     'graphviz',
     'networkx',
+    'scipy',
     'beautifulsoup4',
     'sentence_transformers',
   ],